@@ -0,0 +1,88 @@
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from utils.textrazor_client import (
+    DEFAULT_EXTRACTORS,
+    FakeTextRazor,
+    create_textrazor_client,
+)
+
+
+class FakeTextRazorHandler(BaseHTTPRequestHandler):
+    """
+    Answers analysis requests of the textrazor client like the TextRazor
+    API, with the topics and entities of FakeTextRazor, after the latency
+    configured on the server.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            # the textrazor client compresses large requests with zlib
+            body = zlib.decompress(body)
+        form = parse_qs(body.decode("utf8"))
+        extractors = ",".join(form.get("extractors", [])).split(",")
+        analyzer = FakeTextRazor(
+            [extractor for extractor in extractors if extractor] or DEFAULT_EXTRACTORS
+        )
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.request_count += 1
+        response = json.dumps(
+            analyzer.analyze(form.get("text", [""])[0]).json, ensure_ascii=False
+        ).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTextRazorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0):
+        super().__init__((host, port), FakeTextRazorHandler)
+        self.latency = latency
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def create_fake_textrazor_client(server_url, extractors=DEFAULT_EXTRACTORS):
+    """Creates a real textrazor client sending its requests to server_url."""
+    client = create_textrazor_client("benchmark", extractors)
+    client.set_do_encryption(False)
+    client.set_endpoint(server_url)
+    return client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake TextRazor server.")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    server = FakeTextRazorServer(port=args.port, latency=args.latency)
+    print(f"fake TextRazor listening on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,538 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from benchmarks.fake_textrazor_server import (
+    FakeTextRazorServer,
+    create_fake_textrazor_client,
+)
+from benchmarks.synthetic_corpus import BENCHMARK_TERMS, write_synthetic_corpus
+from mappings import chart_specifications
+from utils.analysis_cache import AnalysisCache
+from utils.chart_builder import clear_figure_cache, create_horizontal_barchart
+from utils.corpus_store import open_corpus
+from utils.doc_handler import (
+    build_textrazor_batch_frames,
+    extract_match_contexts,
+    read_docs_from_json,
+    request_textrazor_batch,
+    request_textrazor_data,
+    search_against_docs,
+)
+from utils.phrase_index import read_phrase_index, search_phrase_across_lines
+from utils.query import IndexResolver, count_queries
+from utils.ranking import RankedMatches
+from utils.result_cache import ResultCache
+from utils.search_index import build_search_index, search_against_index
+from utils.semantic_index import build_semantic_index, similar_passages
+from utils.textrazor_client import analyze_texts
+from wahlprogramm_reader import HttpReader, Reader
+from wahlprogramm_reader.server import ReaderServer
+
+COLD_LOAD_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+from utils.doc_handler import read_docs_from_corpus, read_docs_from_json
+if sys.argv[1] == "json":
+    asset_dict = read_docs_from_json(sys.argv[2])
+else:
+    asset_dict = read_docs_from_corpus(sys.argv[2])
+line_count = sum(len(asset_content_dict) for asset_content_dict in asset_dict.values())
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(timings):
+    """Summarizes timings in seconds as milliseconds."""
+    values = sorted(timing * 1000 for timing in timings)
+    return {
+        "n": len(values),
+        "mean_ms": sum(values) / len(values),
+        "min_ms": values[0],
+        "p50_ms": percentile(values, 0.5),
+        "p90_ms": percentile(values, 0.9),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": values[-1],
+    }
+
+
+def peak_memory_mib(function):
+    """Runs function once and returns the peak of traced Python allocations."""
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def benchmark(functions, repeat=5, warmup=1):
+    """
+    Times each of functions repeat times after warmup untimed runs, and
+    measures the allocation high-water mark of one additional run.
+
+    Parameters
+    ----------
+    functions : list
+        Callables without arguments, e.g. one query per search term.
+    """
+    for _ in range(warmup):
+        for function in functions:
+            function()
+    timings = []
+    for _ in range(repeat):
+        for function in functions:
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    result = summarize(timings)
+    result["peak_mib"] = max(peak_memory_mib(function) for function in functions[:3])
+    return result
+
+
+def cold_load(kind, path, repeat=3):
+    """Times loading in fresh interpreters, including the imports."""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_LOAD_CODE, kind, path],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    result = summarize([run["seconds"] for run in runs])
+    result["max_rss_mib"] = max(run["max_rss_kib"] for run in runs) / 1024
+    return result
+
+
+def load_test(reader, terms, requests_total, concurrency):
+    """
+    Serves reader with ReaderServer and sends requests_total search and
+    context requests from concurrency parallel clients.
+    """
+    server = ReaderServer(reader, max_workers=concurrency)
+    loop = asyncio.new_event_loop()
+    asyncio_server = loop.run_until_complete(
+        asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+    )
+    port = asyncio_server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    client = HttpReader(f"http://127.0.0.1:{port}")
+    party = reader.parties[0]
+
+    def request(request_nr):
+        term = terms[request_nr % len(terms)]
+        start = time.perf_counter()
+        if request_nr % 2:
+            client.contexts(party, term)
+        else:
+            client.search(term)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(request, range(requests_total)))
+    elapsed = time.perf_counter() - start
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    asyncio_server.close()
+    server.executor.shutdown()
+    result = summarize(timings)
+    result.update(concurrency=concurrency, requests_per_second=requests_total / elapsed)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    work_dir,
+    party_count=11,
+    line_count=10000,
+    seed=0,
+    repeat=5,
+    latency=0.05,
+    concurrency=16,
+    requests_total=400,
+    only=None,
+):
+    """
+    Runs all benchmark scenarios against a synthetic corpus.
+
+    Returns
+    -------
+    dict
+        With keys meta (commit, environment and parameters) and results, a
+        dict of structure scenario: summary (timings in milliseconds,
+        percentiles over all runs and terms, memory high-water marks in MiB).
+    """
+    corpus_path = os.path.join(work_dir, "synthetic.corpus")
+    json_path = os.path.join(work_dir, "synthetic.json")
+    phrase_index_path = os.path.join(work_dir, "synthetic.phrases")
+    asset_dict = write_synthetic_corpus(
+        corpus_path, json_path, party_count, line_count, seed
+    )
+    terms = BENCHMARK_TERMS
+    party = next(iter(asset_dict))
+    results = {}
+
+    def scenario(name, compute):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            return
+        print(f"running {name}", file=sys.stderr)
+        results[name] = compute()
+
+    # loading
+    scenario("load_json_cold", lambda: cold_load("json", json_path))
+    scenario(
+        "load_json_warm",
+        lambda: benchmark([lambda: read_docs_from_json(json_path)], repeat),
+    )
+    scenario("load_corpus_cold", lambda: cold_load("corpus", corpus_path))
+    scenario(
+        "load_corpus_warm",
+        lambda: benchmark([lambda: open_corpus(corpus_path).close()], repeat),
+    )
+
+    # search
+    corpus = open_corpus(corpus_path)
+    search_index = build_search_index(corpus)
+    phrase_index = read_phrase_index(phrase_index_path, corpus)
+    scenario(
+        "build_search_index",
+        lambda: benchmark([lambda: build_search_index(corpus)], 2, warmup=0),
+    )
+    scenario(
+        "search_linear",
+        lambda: benchmark(
+            [lambda term=term: search_against_docs(asset_dict, term) for term in terms],
+            repeat,
+        ),
+    )
+    scenario(
+        "search_index",
+        lambda: benchmark(
+            [
+                lambda term=term: search_against_index(search_index, corpus, term)
+                for term in terms
+            ],
+            repeat,
+        ),
+    )
+    scenario(
+        "search_across_lines",
+        lambda: benchmark(
+            [
+                lambda term=term: search_phrase_across_lines(phrase_index, corpus, term)
+                for term in terms
+            ],
+            repeat,
+        ),
+    )
+    # all terms at once: N separate linear searches against one batch
+    scenario(
+        "search_terms_separate",
+        lambda: benchmark(
+            [lambda: [search_against_docs(asset_dict, term) for term in terms]],
+            repeat,
+        ),
+    )
+    scenario(
+        "search_terms_batch",
+        lambda: benchmark(
+            [lambda: count_queries(IndexResolver(search_index), terms, asset_dict)],
+            repeat,
+        ),
+    )
+    semantic_index = build_semantic_index(corpus, corpus.version)
+    scenario(
+        "build_semantic_index",
+        lambda: benchmark(
+            [lambda: build_semantic_index(corpus, corpus.version)], 1, warmup=0
+        ),
+    )
+    scenario(
+        "search_semantic",
+        lambda: benchmark(
+            [
+                lambda term=term: similar_passages(semantic_index, term)
+                for term in terms
+            ],
+            repeat,
+        ),
+    )
+    match_lines = {
+        term: list(search_against_index(search_index, corpus, term)[party])
+        for term in terms
+    }
+    scenario(
+        "contexts_ranked_page",
+        lambda: benchmark(
+            [
+                lambda term=term: RankedMatches(
+                    extract_match_contexts(
+                        corpus[party], match_lines[term], term, render_markdown=False
+                    ),
+                    term,
+                ).page()
+                for term in terms
+            ],
+            repeat,
+        ),
+    )
+    reader = Reader(
+        corpus_path=corpus_path,
+        json_path=json_path,
+        search_index_path=os.path.join(work_dir, "synthetic.search"),
+        phrase_index_path=phrase_index_path,
+        fuzzy_index_path=os.path.join(work_dir, "synthetic.fuzzy"),
+        annotations_path=os.path.join(work_dir, "no_annotations.npz"),
+        result_cache=ResultCache(memory_entries=4 * len(terms)),
+    )
+    scenario(
+        "reader_search_cached",
+        lambda: benchmark(
+            [lambda term=term: reader.search(term) for term in terms], repeat
+        ),
+    )
+
+    # analysis, against the fake TextRazor server
+    snippet_texts = {
+        match_nr: snippet["text"]
+        for match_nr, snippet in enumerate(
+            extract_match_contexts(corpus[party], match_lines["Klima"][:10], "Klima")
+        )
+    }
+    fake_server = FakeTextRazorServer(latency=latency).start()
+    client = create_fake_textrazor_client(fake_server.url)
+    responses = {
+        key: response_json
+        for key, (response_json, _) in analyze_texts(
+            snippet_texts, "benchmark", client=client
+        ).items()
+    }
+    scenario(
+        "textrazor_frames",
+        lambda: benchmark([lambda: build_textrazor_batch_frames(responses)], repeat),
+    )
+    scenario(
+        "request_textrazor_data",
+        lambda: benchmark(
+            [
+                lambda match_nr=match_nr, text=text: request_textrazor_data(
+                    match_nr, text, "benchmark", client=client
+                )
+                for match_nr, text in snippet_texts.items()
+            ],
+            1,
+            warmup=0,
+        ),
+    )
+    scenario(
+        "request_textrazor_batch_uncached",
+        lambda: benchmark(
+            [
+                lambda: request_textrazor_batch(
+                    snippet_texts, "benchmark", client=client
+                )
+            ],
+            repeat,
+            warmup=0,
+        ),
+    )
+    analysis_cache = AnalysisCache(
+        os.path.join(work_dir, "textrazor.sqlite"), daily_limit=10**6
+    )
+    scenario(
+        "request_textrazor_batch_cached",
+        lambda: benchmark(
+            [
+                lambda: request_textrazor_batch(
+                    snippet_texts, "benchmark", cache=analysis_cache, client=client
+                )
+            ],
+            repeat,
+        ),
+    )
+
+    # charts
+    match_frames = [
+        pd.DataFrame(
+            {
+                "doc": list(asset_dict),
+                "matches": [
+                    len(search_against_index(search_index, corpus, term)[asset_name])
+                    for asset_name in asset_dict
+                ],
+            }
+        )
+        for term in terms[:5]
+    ]
+
+    def build_chart(frame, cached):
+        if not cached:
+            clear_figure_cache()
+        # including the serialization st.plotly_chart does
+        return create_horizontal_barchart(
+            frame,
+            chart_specifications["search_topic_matches"],
+            title_wildcards={"search_phrase": "Klima"},
+            meta_variables={"search_phrase": "Klima"},
+        ).to_json(validate=False)
+
+    for name, cached in [("chart_build", False), ("chart_build_cached", True)]:
+        scenario(
+            name,
+            lambda cached=cached: benchmark(
+                [
+                    lambda frame=frame: build_chart(frame, cached)
+                    for frame in match_frames
+                ],
+                repeat,
+            ),
+        )
+
+    # concurrent clients against the HTTP API
+    scenario(
+        "api_load",
+        lambda: load_test(
+            reader, terms, requests_total=requests_total, concurrency=concurrency
+        ),
+    )
+    fake_server.stop()
+    corpus.close()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "party_count": party_count,
+                "line_count": line_count,
+                "seed": seed,
+                "repeat": repeat,
+                "textrazor_latency": latency,
+                "concurrency": concurrency,
+                "requests_total": requests_total,
+                "terms": terms,
+            },
+            "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, metric="p50_ms", threshold=0.2):
+    """
+    Compares metric of the scenarios in both results.
+
+    Returns
+    -------
+    list
+        One (scenario, baseline_value, current_value, ratio, regressed) tuple
+        per scenario in both results; regressed if current exceeds baseline
+        by more than threshold.
+    """
+    rows = []
+    for name, current_result in current["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if not baseline_result or metric not in current_result:
+            continue
+        before, after = baseline_result[metric], current_result[metric]
+        ratio = after / before if before else float("inf")
+        rows.append((name, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading, search, analysis and charts on a "
+        "synthetic corpus, or compare two benchmark results."
+    )
+    parser.add_argument("--parties", type=int, default=11)
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="fake TextRazor latency (s)"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--only", nargs="*", help="scenario name prefixes")
+    parser.add_argument("--out", help="write the results as json to this file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two result files instead of running the benchmarks",
+    )
+    parser.add_argument("--metric", default="p50_ms")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as baseline_file:
+            baseline = json.load(baseline_file)
+        with open(args.compare[1]) as current_file:
+            current = json.load(current_file)
+        rows = compare_results(baseline, current, args.metric, args.threshold)
+        for name, before, after, ratio, regressed in rows:
+            print(
+                f"{name:36} {before:12.3f} {after:12.3f} {ratio:8.2f}x"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmark_results = run_benchmarks(
+            work_dir,
+            party_count=args.parties,
+            line_count=args.lines,
+            seed=args.seed,
+            repeat=args.repeat,
+            latency=args.latency,
+            concurrency=args.concurrency,
+            requests_total=args.requests,
+            only=args.only,
+        )
+    output = json.dumps(benchmark_results, indent=2)
+    if args.out:
+        with open(args.out, "w") as out_file:
+            out_file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,193 @@
+import argparse
+import random
+
+from utils.corpus_store import write_corpus
+from utils.doc_handler import store_docs_as_json
+
+# frequent words of electoral programs; the generator draws from them with a
+# Zipf-like distribution, so common terms match thousands of lines and rare
+# ones only a few
+VOCABULARY = [
+    "und",
+    "die",
+    "der",
+    "wir",
+    "für",
+    "in",
+    "zu",
+    "den",
+    "mit",
+    "von",
+    "das",
+    "eine",
+    "auf",
+    "ist",
+    "nicht",
+    "werden",
+    "sich",
+    "auch",
+    "des",
+    "im",
+    "Menschen",
+    "wollen",
+    "Deutschland",
+    "Europa",
+    "Zukunft",
+    "Klima",
+    "Klimaschutz",
+    "Bildung",
+    "Rente",
+    "Steuer",
+    "Arbeit",
+    "Wirtschaft",
+    "Digitalisierung",
+    "Gesundheit",
+    "Pflege",
+    "Familien",
+    "Kinder",
+    "Energie",
+    "Wasserstoff",
+    "Mobilität",
+    "Verkehr",
+    "Bahn",
+    "Zug",
+    "Wohnen",
+    "Mieten",
+    "Landwirtschaft",
+    "Tierschutz",
+    "Migration",
+    "Integration",
+    "Sicherheit",
+    "Polizei",
+    "Bundeswehr",
+    "Demokratie",
+    "Freiheit",
+    "Gerechtigkeit",
+    "soziale",
+    "erneuerbare",
+    "Energien",
+    "Innovation",
+    "Forschung",
+    "Unternehmen",
+    "Kommunen",
+    "Länder",
+    "Bund",
+    "Förderung",
+    "Investitionen",
+    "Infrastruktur",
+    "Breitband",
+    "Verwaltung",
+    "Datenschutz",
+    "Umwelt",
+    "Artenvielfalt",
+    "Wasser",
+    "Wald",
+    "Kohleausstieg",
+    "Gleichstellung",
+    "Kultur",
+    "Sport",
+    "Ehrenamt",
+    "Jugend",
+    "Senioren",
+    "Grundsicherung",
+    "Bürgergeld",
+    "Mindestlohn",
+    "Tarifbindung",
+    "Handwerk",
+    "Mittelstand",
+]
+# search terms of realistic shape: frequent and rare words, short substrings
+# and multi-word phrases
+BENCHMARK_TERMS = [
+    "Klima",
+    "Klimaschutz",
+    "Rente",
+    "Bildung",
+    "Digitalisierung",
+    "Steuer",
+    "Wohnen",
+    "Mobilität",
+    "Gesundheit",
+    "Europa",
+    "Migration",
+    "Pflege",
+    "Wasserstoff",
+    "Bürgergeld",
+    "Zug",
+    "ab",
+    "soziale Gerechtigkeit",
+    "erneuerbare Energien",
+    "Deutschland",
+    "Tierschutz",
+]
+
+
+def generate_line(rng, weights, min_words=4, max_words=14):
+    words = rng.choices(VOCABULARY, weights, k=rng.randint(min_words, max_words))
+    line = " ".join(words)
+    if rng.random() < 0.03:
+        # a word hyphenated across lines, as produced by the PDF extraction
+        line += " Zu-"
+    return line
+
+
+def generate_corpus(party_count=11, line_count=10000, seed=0):
+    """
+    Generates a synthetic corpus with the structure of the parsed electoral
+    programs. The output only depends on the arguments.
+
+    Parameters
+    ----------
+    party_count : int
+    line_count : int
+        Lines per party.
+    seed : int
+
+    Returns
+    -------
+    dict
+        A dict with doc_name as key. Contains a nested dict of structure
+        line_number: line_text.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+    asset_dict = {}
+    for party_nr in range(party_count):
+        lines = {}
+        for line_number in range(line_count):
+            if rng.random() < 0.05:
+                lines[line_number] = ""
+            else:
+                lines[line_number] = generate_line(rng, weights)
+        asset_dict[f"Partei {party_nr + 1}"] = lines
+    return asset_dict
+
+
+def write_synthetic_corpus(
+    corpus_path, json_path=None, party_count=11, line_count=10000, seed=0
+):
+    """
+    Generates a synthetic corpus and writes it in the corpus format (and as
+    json if json_path is given).
+
+    Returns
+    -------
+    dict
+        The generated corpus.
+    """
+    asset_dict = generate_corpus(party_count, line_count, seed)
+    write_corpus(asset_dict, corpus_path)
+    if json_path:
+        store_docs_as_json(asset_dict, json_path)
+    return asset_dict
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus.")
+    parser.add_argument("--corpus", default="synthetic.corpus")
+    parser.add_argument("--json", default=None)
+    parser.add_argument("--parties", type=int, default=11)
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_corpus(args.corpus, args.json, args.parties, args.lines, args.seed)
@@ -1,25 +1,34 @@
 import streamlit as st
 import pandas as pd
-import re
 from decouple import config
-from random import sample
-from PIL import Image
 import base64
+import time
 
-from mappings import docs, docs_colors, chart_specifications, topics_df, entities_df
-from utils.doc_handler import (
-    read_docs_from_json,
-    search_against_docs,
-    request_textrazor_data,
+from mappings import (
+    docs_colors,
+    default_doc_color,
+    chart_specifications,
+    sampling_modes,
 )
-from utils.chart_builder import create_horizontal_barchart
+from utils.analysis_cache import AnalysisCache
+from utils.doc_handler import split_textrazor_frames
+from utils.query import QuerySyntaxError, is_plain_phrase, parse_query
+from utils.result_cache import create_result_cache
+from utils.chart_builder import create_grouped_barchart, create_horizontal_barchart
+from utils.instrumentation import (
+    cache_metrics,
+    configure_timing_log,
+    metrics,
+    span,
+    start_metrics_server,
+    start_rerun,
+)
+from wahlprogramm_reader import CorpusRegistry, HttpReader, analysis_frames
 
 
 # #############################################
 # SETTINGS
 # #############################################
-textrazor_key = st.secrets["TEXTRAZOR"]
-
 # hide menu and fullscreen icon
 st.markdown(
     """ <style>
@@ -33,19 +42,49 @@ st.markdown(
 # #############################################
 if "search_phrase" not in st.session_state:
     st.session_state["search_phrase"] = None
+if "across_lines" not in st.session_state:
+    st.session_state["across_lines"] = None
+if "fuzzy" not in st.session_state:
+    st.session_state["fuzzy"] = None
+if "corpus" not in st.session_state:
+    st.session_state["corpus"] = None
 if "selected_party" not in st.session_state:
     st.session_state["selected_party"] = None
 if "matches_to_analyze" not in st.session_state:
     st.session_state["matches_to_analyze"] = None
+if "match_pages" not in st.session_state:
+    st.session_state["match_pages"] = 1
 if "selected_topic" not in st.session_state:
     st.session_state["selected_topic"] = None
 if "selected_entity" not in st.session_state:
     st.session_state["selected_entity"] = None
 
+# collect the timing spans of this rerun for the debug panel
+rerun_timings = start_rerun()
+
+# ###############################
+# STATIC ASSETS
+# ###############################
+@st.cache(allow_output_mutation=True)
+def st_static_assets():
+    # read and encoded once per process, not on every rerun
+    static_assets = {}
+    for asset_name in ["header", "GitHub-Mark-32px", "LI-In-Bug"]:
+        with open(f"assets/{asset_name}.png", "rb") as image_file:
+            image_bytes = image_file.read()
+        static_assets[asset_name] = {
+            "bytes": image_bytes,
+            "base64": base64.b64encode(image_bytes).decode("utf-8"),
+        }
+    return static_assets
+
+
+static_assets = st_static_assets()
+
 # ###############################
 # APP STRUCTURE
 # ###############################
-st.image(Image.open("assets/header.png"))
+st.image(static_assets["header"]["bytes"])
 f"""
     ## Jetzt noch alle Wahlprogramme im Detail lesen?
     ## Irgendwie unrealistisch, oder?
@@ -62,14 +101,18 @@ with st.expander("Disclaimer & How-To", expanded=False):
     - Für den Inhalt der Wahlprogramme sind allein die Parteien verantwortlich.
     - Die Inhalte der Wahlgramme wurden am 17.09.2021 abgerufen. Spätere Änderungen sind hier nicht mehr berücksichtigt.
     - Diese App ist eine Work-In-Progress Tech Demo und weist daher einige Einschränkungen auf:
-      - Die Textsuche kann keine Zeilenumbrüche erkennen. Wird dein gesuchtes Wort im Text umgebrochen, wird dies daher nicht als Treffer aufgeführt.
+      - Die Textsuche erkennt standardmäßig keine Zeilenumbrüche. Wird dein gesuchtes Wort im Text umgebrochen, wird dies nur als Treffer aufgeführt, wenn du die Suche über Zeilenumbrüche hinweg aktivierst.
       - Wird dein Suchwort (z.B. "Zug") als Teil eines anderen Worts (z.B. "Aufzug") gefunden, wird dies als Treffer gewertet.
-      - Für die Themen- und Konzepterkennung stehen nur 500 Anfragen je Tag bereit. Ist dieses Kontingent erschöpft, werden für deine Suche keine Themen und Konzepte gefunden und die App gibt einen Fehler aus.
-      - Themen und Konzepte können je Partei nur für 10 zufällig ermittelte Treffer bestimmt werden.\n\n
+      - Für die Themen- und Konzepterkennung stehen nur 500 Anfragen je Tag bereit. Bereits analysierte Treffer werden zwischengespeichert; ist das Kontingent erschöpft, werden nur noch Themen und Konzepte für bereits analysierte Treffer angezeigt.
+      - Themen und Konzepte werden nicht für alle Treffer bestimmt, sondern je Partei für die unter "Welche Treffer sollen analysiert werden?" gewählten: {", ".join(f'"{mode}"' for mode in sampling_modes)}.\n\n
     **How-To**\n
     - Nach der Eingabe einen Suchbegriff kannst du zunächst einsehen, wie häufig das gesuchte Wort in den Wahlprogrammen der verschiedenen Parteien verwendet wird; Klein- / Großschreibung wird dabei ignoriert.
+    - Mehrere Suchbegriffe trennst du durch Kommas (z.B. "Klima, Kohle"), um sie miteinander zu vergleichen. Suchbegriffe lassen sich außerdem verknüpfen: "Klima OR Kohle", "Klima AND Verkehr" (in derselben Zeile), "Klima AND/3 Bahn" (höchstens 3 Zeilen voneinander entfernt), "Klima NOT Kohle", "Klima*" (Wörter, die mit Klima beginnen) und Klammern; Text in Anführungszeichen wird wörtlich gesucht. Mit "~Klimaschutz" (oder der Option "Auch ähnliche Schreibweisen und Wortformen finden") werden auch gebeugte Formen, Schreibweisen ohne Umlaute, Tippfehler und zusammengesetzte Wörter gefunden.
+    - Sind Wahlprogramme mehrerer Wahlen verfügbar, wählst du oben die Wahl aus; mit "Mit den Wahlprogrammen anderer Wahlen vergleichen" siehst du, wie oft die Parteien deinen Suchbegriff je 1000 Zeilen ihres Programms bei den verschiedenen Wahlen erwähnen.
+    - Mit "Nach Bedeutung suchen" findest du je Partei die Passagen, die deiner Eingabe inhaltlich am nächsten kommen, auch wenn sie den Suchbegriff selbst nicht enthalten; du kannst dabei auch ganze Fragen eingeben.
+    - Zu jedem Treffer wird, soweit bekannt, die Seite und das Kapitel im Wahlprogramm angezeigt; unter "Treffer nach Kapitel anzeigen" siehst du, in welchen Kapiteln der Suchbegriff vorkommt.
     - Über die Button unterhalb des ersten Charts kannst du anschließend eine Partei auswählen, für welche du die Treffer für deinen Suchbegriff analysieren möchtest.
-      - In der aufklappbaren Sektion "Alle einzelnen Treffer anzeigen" kannst du ... nun ... alle Treffer anzeigen :wink:
+      - In der aufklappbaren Sektion "Die relevantesten Treffer anzeigen" kannst du ... nun ... die Treffer anzeigen :wink: Die Treffer sind nach Relevanz sortiert, über "Weitere Treffer anzeigen" werden weitere nachgeladen.
       - Über die zusätzlichen Buttons unterhalb der Charts für Themen und Konzepte kannst du diejenigen Treffer im Kontext des jeweiligen Themas oder Konzepts anzeigen.
     """
 
@@ -77,24 +120,69 @@ f"""
     ---
     ### Los geht´s!
 """
+# filled once the corpora are known, if there are several elections
+corpus_placeholder = st.empty()
 search_phrase = st.text_input(
     label="Gib hier den Suchbegriff ein, der dich interessiert.", value="Klima"
 )
-if search_phrase != st.session_state["search_phrase"]:
+semantic = st.checkbox(
+    'Nach Bedeutung suchen: die ähnlichsten Passagen finden, auch ohne den genauen Suchbegriff (z.B. "Wie soll die Rente finanziert werden?")',
+    value=False,
+)
+fuzzy = st.checkbox(
+    "Auch ähnliche Schreibweisen und Wortformen finden (z.B. Wähler, Waehler, Wählerinnen)",
+    value=False,
+)
+# several terms separated by commas are compared with each other; matches
+# of any of them are displayed and analyzed
+search_terms = [term.strip() for term in search_phrase.split(",") if term.strip()]
+if fuzzy:
+    search_terms = [
+        f'~"{term}"' if is_plain_phrase(term) else term for term in search_terms
+    ]
+if len(search_terms) > 1:
+    search_query = " OR ".join(f"({term})" for term in search_terms)
+else:
+    search_query = search_terms[0] if search_terms else search_phrase
+try:
+    if not semantic:
+        parse_query(search_query)
+except QuerySyntaxError:
+    st.error(
+        f"Die Suchanfrage ***{search_phrase}*** ist ungültig. Prüfe Klammern, "
+        "Anführungszeichen und die Operatoren AND, AND/N, OR und NOT."
+    )
+    st.stop()
+across_lines = st.checkbox(
+    "Auch über Zeilenumbrüche hinweg suchen (z.B. nach Wortgruppen)", value=False
+)
+if (
+    search_phrase != st.session_state["search_phrase"]
+    or across_lines != st.session_state["across_lines"]
+    or fuzzy != st.session_state["fuzzy"]
+):
     st.session_state["search_phrase"] = search_phrase
+    st.session_state["across_lines"] = across_lines
+    st.session_state["fuzzy"] = fuzzy
     st.session_state["selected_party"] = None
+    st.session_state["match_pages"] = 1
     st.session_state["selected_topic"] = None
     st.session_state["selected_entity"] = None
 
 section1_placeholder = st.empty()
 doc_match_chart_placeholder = st.empty()
+corpus_comparison_placeholder = st.container()
 section2_placeholder = st.empty()
 
 button_container = st.container()
 col1, col2, col3, col4 = button_container.columns(4)
 party_matches_placeholder = st.empty()
 all_matches_placeholder = st.empty()
+section_matches_placeholder = st.empty()
+distinctive_terms_placeholder = st.empty()
 
+sampling_placeholder = st.empty()
+analysis_progress_placeholder = st.empty()
 topics_placeholder = st.empty()
 topics_selection_placeholder = st.container()
 topics_col0, topics_col1 = topics_selection_placeholder.columns(2)
@@ -108,8 +196,8 @@ entity_match_placeholder = st.empty()
 st.markdown(
     f"""
         ---
-        Check out the repository for this app: <a href="https://github.com/caff9/wahlprogramm_reader" target="_blank"><img src="data:image/gif;base64,{base64.b64encode(open("assets/GitHub-Mark-32px.png", "rb").read()).decode("utf-8")}" height="32" alt="GitHub"></a> \n
-        Write me on LinkedIn: <a href="https://www.linkedin.com/in/erik-klemusch/" target="_blank"><img src="data:image/gif;base64,{base64.b64encode(open("assets/LI-In-Bug.png", "rb").read()).decode("utf-8")}" height="32" alt="LinkedIn"></a>
+        Check out the repository for this app: <a href="https://github.com/caff9/wahlprogramm_reader" target="_blank"><img src="data:image/gif;base64,{static_assets["GitHub-Mark-32px"]["base64"]}" height="32" alt="GitHub"></a> \n
+        Write me on LinkedIn: <a href="https://www.linkedin.com/in/erik-klemusch/" target="_blank"><img src="data:image/gif;base64,{static_assets["LI-In-Bug"]["base64"]}" height="32" alt="LinkedIn"></a>
     """,
     unsafe_allow_html=True,
 )
@@ -118,57 +206,96 @@ st.markdown(
 # DEFINTION OF FUNCTIONS USING CACHE
 # #############################################
 @st.cache(allow_output_mutation=True)
-def st_read_docs_from_links():
-    assets = read_docs_from_json()
-    return assets
+def st_result_cache():
+    result_cache = create_result_cache(config("RESULT_CACHE_URL", default=None))
+    return result_cache
 
 
-@st.cache
-def st_search_against_docs(asset_dict, search_phrase):
-    asset_search_matches = search_against_docs(asset_dict, search_phrase)
-    return asset_search_matches
+@st.cache(allow_output_mutation=True)
+def st_instrumentation():
+    # TIMING_LOG: "-" for stderr or a file path; METRICS_PORT: port of the
+    # Prometheus endpoint /metrics
+    timing_log = config("TIMING_LOG", default=None)
+    if timing_log:
+        configure_timing_log(timing_log)
+    metrics_port = config("METRICS_PORT", default=0, cast=int)
+    metrics_server = start_metrics_server(metrics_port) if metrics_port else None
+    return metrics_server
+
+
+@st.cache(allow_output_mutation=True)
+def st_registry():
+    # with READER_API_URL, search and analysis run on a separate server (see
+    # wahlprogramm_reader.server), else in this process
+    reader_api_url = config("READER_API_URL", default=None)
+    if reader_api_url:
+        registry = HttpReader(reader_api_url)
+        metrics.register_collector("caches", cache_metrics(st_result_cache()))
+        return registry
+    # the corpus of each election is loaded with its first query, with all
+    # its indexes at once; least recently used corpora are dropped beyond
+    # CORPUS_MEMORY_BUDGET_MB
+    analysis_cache = AnalysisCache()
+    registry = CorpusRegistry(
+        memory_budget=config("CORPUS_MEMORY_BUDGET_MB", default=1024, cast=int)
+        * 1024**2,
+        eager=True,
+        result_cache=st_result_cache(),
+        analysis_cache=analysis_cache,
+        textrazor_key=st.secrets.get("TEXTRAZOR"),
+    )
+    metrics.register_collector(
+        "caches", cache_metrics(st_result_cache(), analysis_cache)
+    )
+    return registry
+
+
+@st.cache(allow_output_mutation=True)
+def st_corpora():
+    corpora = st_registry().corpora()
+    return corpora
 
 
-@st.cache
 def st_create_horizontal_barchart(chart_data, chart_specs, **kwargs):
-    fig = create_horizontal_barchart(chart_data, chart_specs, **kwargs)
+    # figures are built from prebuilt templates and cached by chart_builder
+    with span("chart", "st_create_horizontal_barchart"):
+        fig = create_horizontal_barchart(chart_data, chart_specs, **kwargs)
+    return fig
+
+
+def st_create_grouped_barchart(chart_data, chart_specs, **kwargs):
+    with span("chart", "st_create_grouped_barchart"):
+        fig = create_grouped_barchart(chart_data, chart_specs, **kwargs)
     return fig
 
 
+def match_location(snippet):
+    # page and chapter of a match, where the structure of the program is known
+    location = snippet.get("location")
+    if not location:
+        return ""
+    section = " › ".join(location["section"])
+    return f" (S. {location['page']}{', ' + section if section else ''})"
+
+
 @st.cache
-def st_random_match_sample(match_dict, party):
-    matches_to_analyze = sample(
-        list(range(0, match_dict[party])),
-        min(10, match_dict[party]),
+def st_sample_matches(corpus, party, search_phrase, across_lines, sampling):
+    # seeded by corpus version, party and search phrase, so every user gets
+    # the same sample and shares its cached analysis
+    reader = st_registry().for_corpus(corpus)
+    matches_to_analyze = reader.sample_matches(
+        party, search_phrase, 10, across_lines=across_lines, sampling=sampling
     )
     return matches_to_analyze
 
 
 @st.cache
-def st_textrazor_match_data(
-    topics_across_matches,
-    entities_across_matches,
-    asset_search_matches,
-    matches_to_analyze,
-    match_context,
-):
-    tr_match_data = {}
-    for asset_name, matches in asset_search_matches.items():
-        if asset_name == st.session_state["selected_party"]:
-            for match_nr, match in enumerate(matches):
-                if match_nr in matches_to_analyze:
-                    topics, entities = request_textrazor_data(
-                        match_nr, match_context[match_nr], textrazor_key
-                    )
-                    topics_across_matches = topics_across_matches.append(
-                        topics, ignore_index=True
-                    )
-                    entities_across_matches = entities_across_matches.append(
-                        entities, ignore_index=True
-                    )
-                    # store textrazor_match_data
-                    tr_match_data[match_nr] = {"topics": topics, "entities": entities}
-    return tr_match_data, topics_across_matches, entities_across_matches
+def st_analyze(corpus, party, search_phrase, match_nrs, across_lines):
+    reader = st_registry().for_corpus(corpus)
+    analysis = reader.analyze(
+        party, search_phrase, match_nrs=match_nrs, across_lines=across_lines
+    )
+    return analysis
 
 
 # ###############################
@@ -177,41 +304,149 @@ def st_textrazor_match_data(
 with st.spinner(
     "Einen Moment, wir laden erst einmal die Texte der verschiedenen Wahlprogramme."
 ):
-    assets = st_read_docs_from_links()
+    st_instrumentation()
+    with span("load", "st_registry"):
+        registry = st_registry()
+        corpora = st_corpora()
+        if len(corpora) > 1:
+            # latest election first
+            corpus_titles = {
+                corpus["title"]: corpus["name"] for corpus in reversed(corpora)
+            }
+            corpus = corpus_titles[
+                corpus_placeholder.selectbox(
+                    "Wahl",
+                    list(corpus_titles),
+                    index=[corpus["default"] for corpus in reversed(corpora)].index(
+                        True
+                    ),
+                )
+            ]
+        else:
+            corpus = corpora[0]["name"]
+        reader = registry.for_corpus(corpus)
+    if corpus != st.session_state["corpus"]:
+        st.session_state["corpus"] = corpus
+        st.session_state["selected_party"] = None
+        st.session_state["match_pages"] = 1
+        st.session_state["selected_topic"] = None
+        st.session_state["selected_entity"] = None
     section1_placeholder.write(
         f"""
             ### Ok, lass uns zunächst einmal nachsehen, wie häufig die Wahlprogramme der Parteien ***{search_phrase}*** erwähnen. Mal schauen, was wir so finden :face_with_monocle:
         """
     )
 
+# ################################
+# SEMANTIC SEARCH
+# ################################
+if semantic:
+    with st.spinner("Einen Moment, wir suchen die ähnlichsten Passagen."):
+        with span("search", "similar_passages"):
+            similar_passages = reader.similar_passages(search_phrase, top_k=5)
+    section1_placeholder.write(
+        f"""
+            ### Diese Passagen der Wahlprogramme kommen ***{search_phrase}*** inhaltlich am nächsten :face_with_monocle:
+        """
+    )
+    with doc_match_chart_placeholder.container():
+        for asset_name, passages in similar_passages.items():
+            with st.expander(asset_name, expanded=False):
+                if not passages:
+                    st.write("Keine ähnlichen Passagen gefunden.")
+                for passage in passages:
+                    st.caption(
+                        f"Ähnlichkeit {passage['score']:.2f}, Zeilen "
+                        f"{passage['line_start'] + 1}-{passage['line_end']}"
+                    )
+                    st.markdown(passage["markdown"])
+    st.stop()
+
 # ################################
 # EXECUTE SEARCH AGAINST DOCUMENTS
 # ################################
 with st.spinner("Einen Moment, wir führen die Suche gegen die Wahlprogramme durch."):
-    asset_search_matches = st_search_against_docs(
-        asset_dict=assets, search_phrase=search_phrase
-    )
+    # all terms and the combined query are counted in one pass
+    with span("search", "match_matrix"):
+        match_matrix = reader.match_matrix(
+            dict.fromkeys(search_terms + [search_query]), across_lines=across_lines
+        )
     match_dict = {
-        asset_name: len(search_matches)
-        for asset_name, search_matches in asset_search_matches.items()
+        asset_name: term_counts[search_query]
+        for asset_name, term_counts in match_matrix.items()
     }
-    search_topic_matches = (
-        pd.DataFrame.from_dict(match_dict, orient="index", columns=["matches"])
-        .rename_axis("doc")
-        .reset_index()
-    )
-    match_fig = st_create_horizontal_barchart(
-        chart_data=search_topic_matches,
-        chart_specs=chart_specifications["search_topic_matches"],
-        title_wildcards={
-            "search_phrase": search_phrase,
-        },
-        meta_variables={"search_phrase": search_phrase},
-    )
+    if len(search_terms) > 1:
+        search_term_matches = (
+            pd.DataFrame.from_dict(match_matrix, orient="index")[search_terms]
+            .rename_axis("doc")
+            .reset_index()
+        )
+        match_fig = st_create_grouped_barchart(
+            chart_data=search_term_matches,
+            chart_specs=chart_specifications["search_term_matrix"],
+            title_wildcards={"search_phrase": ", ".join(search_terms)},
+        )
+    else:
+        search_topic_matches = (
+            pd.DataFrame.from_dict(match_dict, orient="index", columns=["matches"])
+            .rename_axis("doc")
+            .reset_index()
+        )
+        match_fig = st_create_horizontal_barchart(
+            chart_data=search_topic_matches,
+            chart_specs=dict(
+                chart_specifications["search_topic_matches"],
+                marker_color_list=[
+                    docs_colors.get(asset_name, default_doc_color)
+                    for asset_name in search_topic_matches["doc"]
+                ],
+            ),
+            title_wildcards={
+                "search_phrase": search_phrase,
+            },
+            meta_variables={"search_phrase": search_phrase},
+        )
     doc_match_chart_placeholder.plotly_chart(
         match_fig, use_container_width=True, config={"displayModeBar": False}
     )
 
+    # the other elections are only loaded on request
+    if len(corpora) > 1 and corpus_comparison_placeholder.checkbox(
+        "Mit den Wahlprogrammen anderer Wahlen vergleichen"
+    ):
+        with span("search", "compare"):
+            comparison = registry.compare([search_query], across_lines=across_lines)
+        # programs differ in length, so mentions are compared per 1000 lines
+        corpus_matches = pd.DataFrame(
+            {
+                corpus_comparison["title"]: {
+                    asset_name: round(
+                        1000
+                        * term_counts[search_query]
+                        / max(corpus_comparison["line_counts"][asset_name], 1),
+                        2,
+                    )
+                    for asset_name, term_counts in corpus_comparison["matrix"].items()
+                }
+                for corpus_comparison in comparison.values()
+            }
+        )
+        # parties not running in an election have no bar there
+        corpus_matches = (
+            corpus_matches.astype(object)
+            .where(corpus_matches.notna(), None)
+            .rename_axis("doc")
+            .reset_index()
+        )
+        comparison_fig = st_create_grouped_barchart(
+            chart_data=corpus_matches,
+            chart_specs=chart_specifications["corpus_comparison"],
+            title_wildcards={"search_phrase": search_phrase},
+        )
+        corpus_comparison_placeholder.plotly_chart(
+            comparison_fig, use_container_width=True, config={"displayModeBar": False}
+        )
+
     section2_placeholder.write(
         f"""
             ### Alles klar, die oben gezeigten Parteien erwähnen ***{search_phrase}*** also mindestens einmal in ihrem Wahlprogramm.\n
@@ -221,13 +456,14 @@ with st.spinner("Einen Moment, wir führen die Suche gegen die Wahlprogramme dur
 
     # populate buttons for parties with >= 1 match
     i = 0
-    for asset_name, matches in asset_search_matches.items():
-        if len(matches) > 0:
+    for asset_name, matches in match_dict.items():
+        if matches > 0:
             i = i + 1 if i < 4 else 1
             col = locals()[f"col{i}"]
             if col.button(asset_name):
                 if asset_name != st.session_state["selected_party"]:
                     st.session_state["selected_party"] = asset_name
+                    st.session_state["match_pages"] = 1
                     st.session_state["selected_topic"] = None
                     st.session_state["selected_entity"] = None
 
@@ -238,61 +474,146 @@ if st.session_state["selected_party"] != None:
     party_matches_placeholder.write(
         f"""### Was {st.session_state["selected_party"]} zu {search_phrase} zu sagen hat:"""
     )
-    topics_across_matches = topics_df.copy()
-    entities_across_matches = entities_df.copy()
     with all_matches_placeholder.expander(
-        "Alle einzelnen Treffer anzeigen", expanded=False
+        "Die relevantesten Treffer anzeigen", expanded=False
     ):
-        # select random matches for subsequent Textrazor treatment
-        matches_to_analyze = st_random_match_sample(
-            match_dict, st.session_state["selected_party"]
+        # display the best matches first, one page more per click
+        cursor = None
+        for page in range(st.session_state["match_pages"]):
+            with span("context", "contexts"):
+                contexts = reader.contexts(
+                    st.session_state["selected_party"],
+                    search_query,
+                    across_lines=across_lines,
+                    cursor=cursor,
+                )
+            cursor = contexts["next_cursor"]
+            for snippet in contexts["snippets"]:
+                match_nrs = snippet["match_nrs"]
+                if len(match_nrs) == 1:
+                    f"#### Treffer {match_nrs[0] + 1}{match_location(snippet)}:\n{snippet['markdown']}"
+                else:
+                    f"#### Treffer {match_nrs[0] + 1} - {match_nrs[-1] + 1}{match_location(snippet)}:\n{snippet['markdown']}"
+            if cursor is None:
+                break
+        if cursor is not None and st.button("Weitere Treffer anzeigen"):
+            st.session_state["match_pages"] += 1
+            st.experimental_rerun()
+
+# ############################################
+# DISPLAY MATCHES BY CHAPTER
+# ############################################
+if st.session_state["selected_party"] != None:
+    # matches are located in the structure index, no further search needed
+    with span("aggregate", "section_counts"):
+        section_counts = reader.section_counts(
+            st.session_state["selected_party"], search_query, across_lines=across_lines
         )
-        # display matches; also store match context for subsequent Textrazor treatment
-        match_context = {}
-        for match_nr, match in enumerate(
-            asset_search_matches[st.session_state["selected_party"]]
+    if section_counts:
+        with section_matches_placeholder.expander(
+            "Treffer nach Kapitel anzeigen", expanded=False
         ):
-            f"#### Treffer {match_nr + 1}:\n"
-            match_text = ">"
-            for line_number in range(match - 5, match + 6):
-                line_text = assets[st.session_state["selected_party"]][line_number]
-                line_text = re.sub(
-                    search_phrase,
-                    f"`{search_phrase}`",
-                    line_text,
-                    flags=re.IGNORECASE,
+            section_matches = pd.DataFrame(section_counts)
+            section_matches["section"] = [
+                f"{section or 'Vor dem ersten Kapitel'} (S. {page})"
+                for section, page in zip(
+                    section_matches["section"], section_matches["page"]
                 )
-                match_text += f"{line_text}  \n"
-            f"{match_text}"
-            match_context[match_nr] = match_text
+            ]
+            fig = st_create_horizontal_barchart(
+                chart_data=section_matches[["section", "matches"]],
+                chart_specs=chart_specifications["section_matches"],
+                title_wildcards={
+                    "search_phrase": search_phrase,
+                    "selected_party": st.session_state["selected_party"],
+                },
+                meta_variables={"search_phrase": search_phrase},
+            )
+            st.plotly_chart(
+                fig, use_container_width=True, config={"displayModeBar": False}
+            )
+
+# ############################################
+# DISPLAY DISTINCTIVE TERMS OF THE PARTY
+# ############################################
+if st.session_state["selected_party"] != None:
+    with distinctive_terms_placeholder.expander(
+        "Typische Begriffe dieses Wahlprogramms anzeigen", expanded=False
+    ):
+        # precomputed counts, no search needed
+        with span("aggregate", "distinctive_terms"):
+            distinctive_terms = pd.DataFrame(
+                reader.distinctive_terms()[st.session_state["selected_party"]],
+                columns=["term", "score"],
+            ).round({"score": 3})
+        fig = st_create_horizontal_barchart(
+            chart_data=distinctive_terms,
+            chart_specs=chart_specifications["distinctive_terms"],
+            title_wildcards={"selected_party": st.session_state["selected_party"]},
+            meta_variables={"selected_party": st.session_state["selected_party"]},
+        )
+        st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False})
 
 # ############################################
 # EXECUTE TEXTRAZOR ANALYSIS PER MATCH
 # ############################################
 if st.session_state["selected_party"] != None:
-    (
-        tr_match_data,
-        topics_across_matches,
-        entities_across_matches,
-    ) = st_textrazor_match_data(
-        topics_across_matches,
-        entities_across_matches,
-        asset_search_matches,
-        matches_to_analyze,
-        match_context,
-    )
+    sampling = sampling_modes[
+        sampling_placeholder.radio(
+            "Welche Treffer sollen analysiert werden?", list(sampling_modes)
+        )
+    ]
+    # precomputed annotations, if available, cover all matches without any
+    # API call; otherwise a sample of the matches is analyzed with TextRazor
+    with span("analysis", "st_analyze"):
+        if sampling == "progressive":
+            # more matches are analyzed in the background as long as the
+            # quota allows; the charts show those analyzed so far
+            analysis = reader.analyze_in_background(
+                st.session_state["selected_party"],
+                search_query,
+                across_lines=across_lines,
+            )
+            analysis_progress_placeholder.progress(
+                analysis["analyzed"] / max(analysis["total"], 1)
+            )
+        else:
+            matches_to_analyze = st_sample_matches(
+                corpus,
+                st.session_state["selected_party"],
+                search_query,
+                across_lines,
+                sampling,
+            )
+            analysis = st_analyze(
+                corpus,
+                st.session_state["selected_party"],
+                search_query,
+                tuple(matches_to_analyze),
+                across_lines,
+            )
+        topics_across_matches, entities_across_matches = analysis_frames(analysis)
+        tr_match_data = split_textrazor_frames(
+            topics_across_matches, entities_across_matches
+        )
+    if analysis["quota_remaining"] == 0:
+        st.info(
+            "Das heutige Kontingent für die Themen- und Konzepterkennung ist "
+            "erschöpft. Angezeigt werden nur bereits analysierte Treffer."
+        )
 
 # ############################################
 # DISPLAY CHARTS FOR TOPICS AND ENTITIES
 # ############################################
 if st.session_state["selected_party"] != None:
     for unit in ["topics", "entities"]:
-        agg_unit = (
-            locals()[f"{unit}_across_matches"]
-            .groupby(["label"], as_index=False)
-            .agg({"match_nr": pd.Series.nunique, "score": "sum"})
-        )
-        agg_unit = agg_unit.nlargest(10, "score")
+        with span("aggregate", unit):
+            agg_unit = (
+                locals()[f"{unit}_across_matches"]
+                .groupby(["label"], as_index=False, observed=True)
+                .agg({"match_nr": "nunique", "score": "sum"})
+            )
+            agg_unit = agg_unit.nlargest(10, "score")
         fig = st_create_horizontal_barchart(
             chart_data=agg_unit,
             chart_specs=chart_specifications[unit],
@@ -326,23 +647,73 @@ if st.session_state["selected_party"] != None and (
             f"""Treffer für {st.session_state["selected_topic"]} anzeigen""",
             expanded=False,
         ):
-            for tr_match in tr_match_data.values():
-                match_topics = tr_match["topics"]
-                if st.session_state["selected_topic"] in match_topics["label"].unique():
-                    for match_topic in match_topics["match_nr"].unique():
-                        f"#### Treffer {match_topic + 1}:\n"
-                        f"""{match_context[match_topic]}"""
+            topic_match_nrs = [
+                match_topic
+                for tr_match in tr_match_data.values()
+                if st.session_state["selected_topic"]
+                in tr_match["topics"]["label"].unique()
+                for match_topic in tr_match["topics"]["match_nr"].unique().tolist()
+            ]
+            topic_snippets = reader.match_snippets(
+                st.session_state["selected_party"],
+                search_query,
+                topic_match_nrs,
+                across_lines=across_lines,
+            )
+            for match_topic in topic_match_nrs:
+                f"#### Treffer {match_topic + 1}{match_location(topic_snippets[match_topic])}:\n"
+                f"""{topic_snippets[match_topic]["markdown"]}"""
     if st.session_state["selected_entity"] != None:
         with entity_match_placeholder.expander(
             f"""Treffer für {st.session_state["selected_entity"]} anzeigen""",
             expanded=False,
         ):
-            for tr_match in tr_match_data.values():
-                match_entities = tr_match["entities"]
-                if (
-                    st.session_state["selected_entity"]
-                    in match_entities["label"].unique()
-                ):
-                    for match_entity in match_entities["match_nr"].unique():
-                        f"#### Treffer {match_entity + 1}:\n"
-                        f"""{match_context[match_entity]}"""
+            entity_match_nrs = [
+                match_entity
+                for tr_match in tr_match_data.values()
+                if st.session_state["selected_entity"]
+                in tr_match["entities"]["label"].unique()
+                for match_entity in tr_match["entities"]["match_nr"].unique().tolist()
+            ]
+            entity_snippets = reader.match_snippets(
+                st.session_state["selected_party"],
+                search_query,
+                entity_match_nrs,
+                across_lines=across_lines,
+            )
+            for match_entity in entity_match_nrs:
+                f"#### Treffer {match_entity + 1}{match_location(entity_snippets[match_entity])}:\n"
+                f"""{entity_snippets[match_entity]["markdown"]}"""
+
+# ################################################
+# DEBUG PANEL
+# ################################################
+# only the deployment can enable it: timings reveal the load of the host
+if config("DEBUG_PANEL", default=False, cast=bool):
+    with st.expander("Debug: Laufzeiten dieses Durchlaufs", expanded=False):
+        st.markdown(f"**Gesamt:** {rerun_timings.total_ms():.1f} ms")
+        st.table(
+            pd.DataFrame(
+                [
+                    {
+                        "Stufe": entry["stage"],
+                        "Schritt": "· " * entry["depth"] + entry["name"],
+                        "ms": round(entry["ms"] or 0, 2),
+                    }
+                    for entry in rerun_timings.spans
+                ]
+            )
+        )
+        st.json(
+            {
+                "stage_totals_ms": rerun_timings.stage_totals(),
+                "process": metrics.export(),
+            }
+        )
+
+# ################################################
+# REFRESH WHILE ANALYZING IN THE BACKGROUND
+# ################################################
+if st.session_state["selected_party"] != None and analysis.get("running"):
+    time.sleep(2)
+    st.experimental_rerun()
@@ -1,19 +1,3 @@
-import pandas as pd
-
-docs = {
-    "Bündnis 90 / Grüne": "https://cms.gruene.de/uploads/documents/Wahlprogramm-DIE-GRUENEN-Bundestagswahl-2021_barrierefrei.pdf",
-    "SPD": "https://www.spd.de/fileadmin/Dokumente/Beschluesse/Programm/SPD-Zukunftsprogramm.pdf",
-    "CDU / CSU": "https://www.csu.de/common/download/Regierungsprogramm.pdf",
-    "FDP": "https://www.fdp.de/sites/default/files/2021-06/FDP_Programm_Bundestagswahl2021_1.pdf",
-    "Die Linke": "https://www.die-linke.de/fileadmin/download/wahlen2021/Wahlprogramm/DIE_LINKE_Wahlprogramm_zur_Bundestagswahl_2021.pdf",
-    "Volt": "https://assets.volteuropa.org/2021-06/Wahlprogramm%20Langversion.pdf",
-    "Freie Wähler": "https://www.freiewaehler.eu/template/elemente/203/FREIE%20WÄHLER_Wahlprogramm-BTW21.pdf",
-    "Die PARTEI": "https://spitzenkandidatinnen.sh/file.php/btw21/wahlprogramm-btw21_online.pdf",
-    "Piratenpartei": "https://wiki.piratenpartei.de/wiki/images/9/9e/Wahlprogramm_zur_Bundestagswahl_2021_der_Piratenpartei_Deutschland.pdf",
-    "ÖDP": "https://www.oedp.de/fileadmin/user_upload/bundesverband/programm/programme/OEDPWahlprogrammBundestagswahl2021.pdf",
-    "V-Partei": "https://v-partei.de/wp-content/uploads/V-Partei³-Wahlprogramm-BTW-2021.pdf",
-}
-
 docs_colors = {
     "Bündnis 90 / Grüne": "#3E8825",  # "#A8C671",
     "SPD": "#E03021",  # "#D12C24",
@@ -27,6 +11,15 @@ docs_colors = {
     "ÖDP": "#DF772D",
     "V-Partei": "#52672F",
 }
+# parties without an entry in docs_colors, e.g. of other elections
+default_doc_color = "#7F7F7F"
+
+# label of the choice in the app: sampling mode, see utils.sampling
+sampling_modes = {
+    "10 zufällig ausgewählte Treffer": "random",
+    "10 über das Wahlprogramm verteilte Treffer": "stratified",
+    "Nach und nach weitere Treffer (im Hintergrund)": "progressive",
+}
 
 chart_specifications = {
     "search_topic_matches": {
@@ -37,6 +30,34 @@ chart_specifications = {
         "hovertemplate": "<extra></extra>%{y} erwähnt %{meta} %{x} mal in ihrem Wahlprogramm.",
         "chart_title": "Anzahl Erwähnungen von <br><b>{search_phrase}</b><br> nach Partei",
     },
+    "search_term_matrix": {
+        "label": "doc",
+        "hovertemplate": "<extra></extra>%{y} erwähnt %{meta} %{x} mal in ihrem Wahlprogramm.",
+        "chart_title": "Anzahl Erwähnungen von <br><b>{search_phrase}</b><br> nach Partei",
+    },
+    "corpus_comparison": {
+        "label": "doc",
+        "hovertemplate": "<extra></extra>%{y} erwähnt den Suchbegriff %{x} mal je 1000 Zeilen ihres Wahlprogramms zur %{meta}.",
+        "chart_title": "Erwähnungen von <br><b>{search_phrase}</b><br> je 1000 Zeilen nach Partei und Wahl",
+    },
+    "distinctive_terms": {
+        "label": "term",
+        "value": "score",
+        "color_col": "score",
+        "colorscale": "blugrn",
+        "meta_template": "{selected_party}",
+        "hovertemplate": "<extra></extra>%{y} ist typisch für das Wahlprogramm von %{meta} (TF-IDF %{x}).",
+        "chart_title": "Typische Begriffe im Wahlprogramm von <br><b>{selected_party}</b>",
+    },
+    "section_matches": {
+        "label": "section",
+        "value": "matches",
+        "color_col": "matches",
+        "colorscale": "blugrn",
+        "meta_template": "{search_phrase}",
+        "hovertemplate": "<extra></extra>%{meta} wird in %{y} %{x} mal erwähnt.",
+        "chart_title": "Erwähnungen von <b>{search_phrase}</b> nach Kapitel<br>im Wahlprogramm von <b>{selected_party}</b>",
+    },
     "topics": {
         "label": "label",
         "value": "match_nr",
@@ -56,23 +77,3 @@ chart_specifications = {
         "chart_title": "Top 10 Konzepte, in deren Kontext<br><b>{search_phrase}</b><br>von <b>{selected_party}</b> erwähnt wird",
     },
 }
-
-topics_df = pd.DataFrame(
-    columns=[
-        "match_nr",
-        "topic_result_id",
-        "label",
-        "score",
-        "wikiLink",
-    ]
-)
-
-entities_df = pd.DataFrame(
-    columns=[
-        "match_nr",
-        "entity_result_id",
-        "label",
-        "type",
-        "score",
-    ]
-)
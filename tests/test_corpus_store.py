@@ -0,0 +1,31 @@
+import os
+import threading
+
+from utils.corpus_store import open_corpus, write_corpus
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "doc_data.corpus")
+    docs = {"A": {0: "Klimaschutz", 1: ""}, "Bündnis": {0: "Wähler"}}
+    version = write_corpus(docs, path)
+    corpus = open_corpus(path)
+    assert corpus.version == version
+    assert {name: dict(doc) for name, doc in corpus.items()} == docs
+
+
+def test_concurrent_writers_leave_one_complete_file(tmp_path):
+    path = str(tmp_path / "doc_data.corpus")
+    docs = [
+        {"A": {line: f"Zeile {line} von {writer} " * 20 for line in range(500)}}
+        for writer in range(6)
+    ]
+    threads = [
+        threading.Thread(target=write_corpus, args=(writer_docs, path))
+        for writer_docs in docs
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert os.listdir(tmp_path) == ["doc_data.corpus"]
+    assert dict(open_corpus(path)["A"]) in [writer_docs["A"] for writer_docs in docs]
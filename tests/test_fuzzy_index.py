@@ -0,0 +1,71 @@
+import pytest
+
+from utils.fuzzy_index import (
+    build_fuzzy_index,
+    find_fuzzy_line_ids,
+    read_fuzzy_index,
+    stem_word,
+    write_fuzzy_index,
+)
+from utils.search_index import build_search_index
+
+LINES = [
+    "Die Zahl der Stimmen",
+    "Das ist wahr",
+    "Die Wähler entscheiden",
+    "Waehlerinnen und Wähler",
+    "Das Klimaschutzgesetz kommt",
+    "Ein Gesetz zum Klimaschutz",
+    "Der Klimashutz fehlt",
+    "Die Bahn fährt",
+]
+
+
+@pytest.fixture(scope="module")
+def search_index():
+    return build_search_index({"A": dict(enumerate(LINES))})
+
+
+@pytest.fixture(scope="module")
+def fuzzy_index(search_index):
+    return build_fuzzy_index(search_index, "v1")
+
+
+def fuzzy_lines(fuzzy_index, search_index, search_phrase):
+    return [
+        search_index["line_refs"][line_id][1]
+        for line_id in find_fuzzy_line_ids(fuzzy_index, search_index, search_phrase)
+    ]
+
+
+def test_stems_fold_umlauts_and_inflections():
+    assert stem_word("Klimaschützend") == stem_word("Klimaschutzes")
+    assert stem_word("Wähler") == stem_word("Waehler")
+
+
+@pytest.mark.parametrize("search_phrase", ["Wähler", "Waehler", "wähler"])
+def test_short_stems_tolerate_no_typos(fuzzy_index, search_index, search_phrase):
+    # "wahl" is one edit away from "zahl" and "wahr"
+    assert fuzzy_lines(fuzzy_index, search_index, search_phrase) == [2, 3]
+
+
+def test_inflections_compounds_and_typos(fuzzy_index, search_index):
+    assert fuzzy_lines(fuzzy_index, search_index, "Wählerinnen") == [3]
+    assert fuzzy_lines(fuzzy_index, search_index, "Klimaschutz") == [4, 5, 6]
+    # a compound search word also finds its parts in one line
+    assert fuzzy_lines(fuzzy_index, search_index, "Klimaschutzgesetz") == [4, 5]
+
+
+def test_written_index_is_mapped_and_versioned(tmp_path, fuzzy_index, search_index):
+    path = str(tmp_path / "fuzzy")
+    write_fuzzy_index(fuzzy_index, path)
+    mapped = read_fuzzy_index(path, "v1")
+    assert mapped["version"] == "v1"
+    for search_phrase in ["Wähler", "Klimaschutz", "Klimaschutzgesetz"]:
+        assert fuzzy_lines(mapped, search_index, search_phrase) == fuzzy_lines(
+            fuzzy_index, search_index, search_phrase
+        )
+    assert read_fuzzy_index(path, "v2") is None
+    rebuilt = read_fuzzy_index(path, "v2", search_index)
+    assert rebuilt["version"] == "v2"
+    assert read_fuzzy_index(path, "v2")["version"] == "v2"
@@ -0,0 +1,51 @@
+from utils.corpus_store import open_corpus, write_corpus
+from utils.phrase_index import (
+    build_stream_segments,
+    read_phrase_index,
+    search_phrase_across_lines,
+)
+
+LINES = [
+    "Wir stärken den Klima-",
+    "schutz und die",
+    "Klima-",
+    "und Umweltpolitik sowie den",
+    "CO2-",
+    "Ausstoß",
+]
+
+
+def stream(lines):
+    return "".join(build_stream_segments(dict(enumerate(lines))).values())
+
+
+def test_hyphenated_words_are_joined():
+    assert stream(LINES[:2]) == "wir stärken den klimaschutz und die "
+    assert stream(LINES[4:]) == "co2-ausstoß "
+
+
+def test_hyphens_before_conjunctions_are_kept():
+    assert stream(LINES[2:4]) == "klima- und umweltpolitik sowie den "
+    assert stream(["Energie- oder", "Verkehrs-", "bzw. Agrarwende"]) == (
+        "energie- oder verkehrs- bzw. agrarwende "
+    )
+
+
+def test_outdated_phrase_index_is_rebuilt(tmp_path):
+    corpus_path = str(tmp_path / "doc_data.corpus")
+    phrase_index_path = str(tmp_path / "doc_data.phrases")
+    write_corpus({"A": dict(enumerate(LINES))}, corpus_path)
+    corpus = open_corpus(corpus_path)
+    phrase_index = read_phrase_index(phrase_index_path, corpus)
+    assert phrase_index.metadata["corpus_version"] == corpus.version
+    assert search_phrase_across_lines(phrase_index, corpus, "Klimaschutz") == {
+        "A": {0: [LINES[0]]}
+    }
+
+    write_corpus({"A": {0: "Kein Klima-", 1: "schutz"}}, corpus_path)
+    changed = open_corpus(corpus_path)
+    phrase_index = read_phrase_index(phrase_index_path, changed)
+    assert phrase_index.metadata["corpus_version"] == changed.version
+    assert search_phrase_across_lines(phrase_index, changed, "kein klimaschutz") == {
+        "A": {0: ["Kein Klima-"]}
+    }
@@ -0,0 +1,99 @@
+import pytest
+
+from utils.corpus_store import open_corpus, write_corpus
+from utils.doc_handler import search_against_docs
+from utils.phrase_index import read_phrase_index
+from utils.query import (
+    IndexResolver,
+    PhraseIndexResolver,
+    QuerySyntaxError,
+    count_queries,
+    parse_query,
+    search_query,
+)
+from utils.search_index import build_search_index, search_against_index
+
+CORPUS = {
+    "A": {
+        0: "Wir wollen Klimaschutz und Verkehrswende.",
+        1: "Die Kohle bleibt im Boden.",
+        2: "Mehr Bahn, weniger Auto.",
+        3: "Klima ist Zukunft.",
+        4: "",
+        5: "Der Klimawandel betrifft alle; ja.",
+    },
+    "B": {
+        0: "Kohle sichert Arbeitsplätze.",
+        1: "Wir schützen das Klima",
+        2: "und die Bahn.",
+        3: "Die Autobahn wird ausgebaut.",
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return IndexResolver(build_search_index(CORPUS))
+
+
+def lines(resolver, query, asset_dict=CORPUS):
+    return {
+        party: list(matches)
+        for party, matches in search_query(resolver, asset_dict, query).items()
+    }
+
+
+@pytest.mark.parametrize(
+    "search_phrase", ["Klima", "kohle", "bahn", "ja", "Die", "Klimaschutz und", "xyz"]
+)
+def test_phrases_keep_the_substring_semantics(resolver, search_phrase):
+    expected = search_against_docs(CORPUS, search_phrase)
+    assert search_query(resolver, CORPUS, search_phrase) == expected
+    index = resolver.index
+    assert search_against_index(index, CORPUS, search_phrase) == expected
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("Kohle OR Bahn", {"A": [1, 2], "B": [0, 2, 3]}),
+        ("Klima AND Wir", {"A": [0], "B": [1]}),
+        ("Klima NOT Klimawandel", {"A": [0, 3], "B": [1]}),
+        ("NOT Klima AND Die", {"A": [1], "B": [2, 3]}),
+        ("Klima* AND NOT wandel", {"A": [0, 3], "B": [1]}),
+        ("Kohle AND/1 Bahn", {"A": [1, 2], "B": []}),
+        ("Klima AND/1 Bahn", {"A": [2, 3], "B": [1, 2]}),
+        ('"Klima AND Bahn"', {"A": [], "B": []}),
+        ("(Kohle OR Auto) AND Die", {"A": [1], "B": [3]}),
+        ("Kohle OR Auto AND Die", {"A": [1], "B": [0, 3]}),
+    ],
+)
+def test_operators(resolver, query, expected):
+    assert lines(resolver, query) == expected
+
+
+def test_counts_match_the_searches(resolver):
+    queries = ["Klima", "Kohle OR Bahn", "Klima* AND NOT wandel"]
+    counts = count_queries(resolver, queries, list(CORPUS))
+    for query in queries:
+        for party, matches in lines(resolver, query).items():
+            assert counts[party][query] == len(matches)
+
+
+def test_phrases_across_lines(tmp_path):
+    path = str(tmp_path / "doc_data.corpus")
+    write_corpus(CORPUS, path)
+    corpus = open_corpus(path)
+    phrase_index = read_phrase_index(str(tmp_path / "doc_data.phrases"), corpus)
+    resolver = PhraseIndexResolver(build_search_index(corpus), phrase_index)
+    assert lines(resolver, "Klima und die Bahn", corpus) == {"A": [], "B": [1]}
+    assert lines(resolver, "Klima und die Bahn OR Kohle", corpus) == {
+        "A": [1],
+        "B": [0, 1],
+    }
+
+
+@pytest.mark.parametrize("query", ["Klima AND", "(Klima OR Kohle", "OR Bahn", ")"])
+def test_syntax_errors(query):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
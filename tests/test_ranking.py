@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from utils.ranking import (
+    InvalidCursorError,
+    RankedMatches,
+    UnknownMatchError,
+    bm25_scores,
+    query_terms,
+)
+
+
+def snippet(text, match_nr):
+    return {"text": text, "match_nrs": [match_nr], "line_start": 0, "line_end": 1}
+
+
+def test_query_terms_are_words_prefixes_and_fuzzy_phrases():
+    assert list(query_terms("Klimaschutz und Bahn")) == [
+        ("phrase", "klimaschutz"),
+        ("phrase", "und"),
+        ("phrase", "bahn"),
+    ]
+    assert list(query_terms("Klima* AND NOT Kohle OR ~Wähler")) == [
+        ("prefix", "klima"),
+        ("fuzzy", "Wähler"),
+    ]
+
+
+def test_rare_terms_weigh_more():
+    snippets = [snippet("Die Bahn fährt", 0), snippet("Die Tram fährt", 1)]
+    terms = query_terms("Bahn Tram")
+    # "bahn" occurs in most lines of the corpus, "tram" in few
+    scores = bm25_scores(
+        snippets,
+        terms,
+        document_frequencies={("phrase", "bahn"): 900, ("phrase", "tram"): 3},
+        line_count=1000,
+    )
+    assert scores[1] > scores[0] > 0
+    # without corpus statistics, both terms are equally rare among the snippets
+    assert bm25_scores(snippets, terms)[0] == pytest.approx(
+        bm25_scores(snippets, terms)[1]
+    )
+
+
+def test_pages_and_snippets_leave_the_shared_instance_unchanged():
+    snippets = [snippet(f"Zeile {nr} Bahn" + " Bahn" * nr, nr) for nr in range(5)]
+    ranked = RankedMatches(snippets, "Bahn")
+    page, cursor = ranked.page(page_size=2)
+    assert [snippet["match_nrs"] for snippet in page] == [[4], [3]]
+    assert all("markdown" in snippet for snippet in page)
+    assert not any("markdown" in snippet for snippet in snippets)
+    assert ranked.page(cursor, page_size=3)[1] is None
+    assert ranked.snippet_for_match(2)["markdown"].count("`Bahn`") == 3
+    with pytest.raises(InvalidCursorError):
+        ranked.page("next")
+    with pytest.raises(UnknownMatchError):
+        ranked.snippet_for_match(7)
+
+
+def test_concurrent_pages_agree():
+    snippets = [snippet(f"Zeile {nr} Bahn", nr) for nr in range(200)]
+    ranked = RankedMatches(snippets, "Bahn")
+    pages = []
+    threads = [
+        threading.Thread(target=lambda: pages.append(ranked.page(page_size=200)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(page == pages[0] for page in pages)
@@ -0,0 +1,52 @@
+import pytest
+
+from utils.corpus_registry import UnknownCorpusError
+from utils.corpus_store import write_corpus
+from utils.result_cache import ResultCache
+from wahlprogramm_reader.registry import CorpusRegistry
+
+CORPORA = {
+    "btw2017": {"A": {0: "Klimaschutz", 1: "Bahn"}},
+    "btw2021": {"A": {0: "Klimaschutz und Bahn", 1: "Mehr Klimaschutz", 2: "Nein"}},
+}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    manifests = {}
+    for name, docs in CORPORA.items():
+        (tmp_path / name).mkdir()
+        write_corpus(docs, str(tmp_path / name / "doc_data.corpus"))
+        manifests[name] = {
+            "name": name,
+            "title": name.upper(),
+            "date": f"{name[-4:]}-09-26",
+            "docs": {party: "" for party in docs},
+        }
+    return CorpusRegistry(
+        manifests=manifests,
+        assets_dir=str(tmp_path),
+        eager=True,
+        memory_budget=None,
+        result_cache=ResultCache(memory_entries=16),
+    )
+
+
+def test_default_is_the_latest_election(registry):
+    assert registry.default == "btw2021"
+    assert registry.get().version == registry.get("btw2021").version
+    with pytest.raises(UnknownCorpusError):
+        registry.get("btw1949")
+
+
+def test_compare_loads_only_what_counting_needs(registry):
+    current = registry.get("btw2021")
+    assert current._semantic_index is not None
+    comparison = registry.compare(["Klimaschutz", "Bahn"])
+    assert comparison["btw2017"]["matrix"] == {"A": {"Klimaschutz": 1, "Bahn": 1}}
+    assert comparison["btw2021"]["matrix"] == {"A": {"Klimaschutz": 2, "Bahn": 1}}
+    assert comparison["btw2021"]["line_counts"] == {"A": 3}
+    # corpora loaded for comparing are dropped before the one in use
+    assert list(registry._readers) == ["btw2017", "btw2021"]
+    compared = registry._readers["btw2017"]
+    assert compared._semantic_index is None and compared._structure is None
@@ -0,0 +1,60 @@
+import pickle
+
+import numpy as np
+
+from utils.ranking import RankedMatches
+from utils.result_cache import (
+    ResultCache,
+    SqliteResultStore,
+    decode_result,
+    encode_result,
+)
+
+
+class BrokenStore:
+    def get(self, key):
+        raise OSError("store unavailable")
+
+    def put(self, key, value):
+        raise OSError("store unavailable")
+
+
+def test_results_round_trip_as_json():
+    result = {"A": {3: ["Zeile drei"], 10: ["Zeile zehn"]}, "B": {}}
+    assert decode_result(encode_result(result)) == result
+    assert decode_result(encode_result({"score": np.float32(0.5)})) == {"score": 0.5}
+    assert encode_result(result).startswith(b"{")
+
+
+def test_store_is_shared_and_old_entries_are_recomputed(tmp_path):
+    store = SqliteResultStore(str(tmp_path / "results.sqlite"))
+    store.put("search:old", pickle.dumps({"A": {1: ["alt"]}}))
+    cache = ResultCache(store, memory_entries=0)
+    assert cache.get_or_compute("search:old", lambda: {"A": {1: ["neu"]}}) == {
+        "A": {1: ["neu"]}
+    }
+    other = ResultCache(store, memory_entries=0)
+    assert other.get_or_compute("search:old", lambda: None) == {"A": {1: ["neu"]}}
+
+
+def test_ranked_matches_are_stored_with_their_order(tmp_path):
+    snippets = [
+        {"text": "Bahn" + " Bahn" * nr, "match_nrs": [nr], "line_start": nr}
+        for nr in range(3)
+    ]
+    store = SqliteResultStore(str(tmp_path / "results.sqlite"))
+    codec = {"encode": RankedMatches.to_json, "decode": RankedMatches.from_json}
+    ResultCache(store).get_or_compute(
+        "ranked_matches:1", lambda: RankedMatches(snippets, "Bahn"), **codec
+    )
+    restored = ResultCache(store).get_or_compute(
+        "ranked_matches:1", lambda: None, **codec
+    )
+    assert [snippet["match_nrs"] for snippet in restored.page()[0]] == [[2], [1], [0]]
+    assert restored.snippet_for_match(1)["text"] == "Bahn Bahn"
+
+
+def test_failing_store_falls_back_to_computing():
+    cache = ResultCache(BrokenStore())
+    assert cache.get_or_compute("search:1", lambda: {"A": {}}) == {"A": {}}
+    assert cache.get_or_compute("search:1", lambda: None) == {"A": {}}
@@ -0,0 +1,50 @@
+from utils.search_index import (
+    build_search_index,
+    find_line_ids,
+    read_search_index,
+    write_search_index,
+)
+
+
+class Corpus(dict):
+    version = "v1"
+
+
+CORPUS = Corpus(
+    {
+        "A": {0: "Klimaschutz ist wichtig", 1: "Die Bahn fährt"},
+        "B": {0: "Mehr Klimaschutz", 1: "Klimageld für alle", 2: "Ja"},
+    }
+)
+
+
+def test_postings_lookup_and_prefixes():
+    index = build_search_index(CORPUS, version="v1")
+    assert index["line_refs"][2] == ("B", 0)
+    assert index["tokens"]["klimaschutz"] == [0, 2]
+    assert "bus" not in index["tokens"]
+    assert index["tokens"].get("bus", []) == []
+    assert dict(index["tokens"].with_prefix("klima")) == {
+        "klimageld": [3],
+        "klimaschutz": [0, 2],
+    }
+    assert find_line_ids(index, "Klimaschutz") == [0, 2]
+    assert find_line_ids(index, "ja") == [4]
+
+
+def test_written_index_is_mapped_and_versioned(tmp_path):
+    path = str(tmp_path / "search")
+    built = read_search_index(path, CORPUS)
+    mapped = read_search_index(path, CORPUS)
+    assert mapped["tokens"].line_ids.filename is not None
+    assert mapped["line_refs"] == built["line_refs"]
+    for phrase in ["Klimaschutz", "bahn f", "für alle"]:
+        assert find_line_ids(mapped, phrase) == find_line_ids(built, phrase)
+
+    changed = Corpus({"A": {0: "Die Bahn fährt"}})
+    changed.version = "v2"
+    rebuilt = read_search_index(path, changed)
+    assert rebuilt["version"] == "v2"
+    assert find_line_ids(rebuilt, "Klimaschutz") == []
+    write_search_index(build_search_index(CORPUS, version="v1"), path)
+    assert read_search_index(path, CORPUS)["docs"] == ["A", "B"]
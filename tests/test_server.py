@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+
+from utils.corpus_store import write_corpus
+from utils.result_cache import ResultCache
+from wahlprogramm_reader.core import Reader
+from wahlprogramm_reader.server import ReaderServer, RequestError
+
+LINES = ["Klimaschutz ist wichtig"] + ["Nichts"] * 20 + ["Mehr Klimaschutz", "Bahn"]
+CORPUS = {
+    "A": dict(enumerate(LINES)),
+    "B": {0: "Klimaschutz und Bahn", 1: "Nichts"},
+}
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    path = tmp_path_factory.mktemp("corpus")
+    write_corpus(CORPUS, str(path / "doc_data.corpus"))
+    reader = Reader(
+        **{
+            f"{kind}_path": str(path / file_name)
+            for kind, file_name in [
+                ("corpus", "doc_data.corpus"),
+                ("json", "doc_data.json"),
+                ("search_index", "doc_data.search"),
+                ("phrase_index", "doc_data.phrases"),
+                ("fuzzy_index", "doc_data.fuzzy"),
+                ("term_matrix", "doc_data.terms.npz"),
+                ("semantic_index", "doc_data.semantic"),
+                ("structure", "doc_data.structure.npz"),
+                ("annotations", "annotations.npz"),
+            ]
+        },
+        result_cache=ResultCache(memory_entries=16),
+    )
+    return ReaderServer(reader, max_workers=2)
+
+
+def dispatch(server, method, target, body=None):
+    return asyncio.run(
+        server.dispatch(method, target, json.dumps(body).encode() if body else b"")
+    )
+
+
+def status(server, method, target, body=None):
+    with pytest.raises(RequestError) as error:
+        dispatch(server, method, target, body)
+    return error.value.status
+
+
+def test_valid_requests(server):
+    matches = dispatch(server, "GET", "/search?q=Klimaschutz")["matches"]
+    assert {party: list(lines) for party, lines in matches.items()} == {
+        "A": [0, 21],
+        "B": [0],
+    }
+    page = dispatch(server, "GET", "/contexts?party=A&q=Klimaschutz&page_size=1")
+    assert page["total"] == 2
+    rest = dispatch(
+        server,
+        "GET",
+        f"/contexts?party=A&q=Klimaschutz&page_size=1&cursor={page['next_cursor']}",
+    )
+    assert rest["next_cursor"] is None
+
+
+def test_phrases_and_queries_are_cached_apart(server):
+    # the lowercased phrase has no operators and matches nothing
+    assert (
+        dispatch(server, "GET", "/contexts?party=A&q=klimaschutz or bahn")["total"] == 0
+    )
+    query = dispatch(server, "GET", "/contexts?party=A&q=Klimaschutz OR Bahn")
+    assert query["total"] == 2
+
+
+@pytest.mark.parametrize(
+    "method, target, body",
+    [
+        ("GET", "/search", None),
+        ("GET", "/distinctive_terms?top_n=many", None),
+        ("GET", "/distinctive_terms?top_n=-1", None),
+        ("GET", "/contexts?party=A&q=Klimaschutz&page_size=0", None),
+        ("GET", "/contexts?party=A&q=Klimaschutz&cursor=abc", None),
+        ("GET", "/section_counts?party=A&q=Klimaschutz&level=x", None),
+        ("GET", "/sample_matches?party=A&q=Klimaschutz&sample_size=1.5", None),
+        ("GET", "/sample_matches?party=A&q=Klimaschutz&sampling=best", None),
+        ("GET", "/search?q=Klima AND (Bahn", None),
+        ("POST", "/match_snippets", {"party": "A", "q": "Bahn", "match_nrs": ["x"]}),
+        ("POST", "/match_snippets", {"party": "A", "q": "Bahn", "match_nrs": 3}),
+        ("POST", "/match_snippets", {"party": "A", "q": "Bahn", "match_nrs": [99]}),
+        ("POST", "/match_matrix", {"queries": []}),
+    ],
+)
+def test_bad_input_is_a_client_error(server, method, target, body):
+    assert status(server, method, target, body) == 400
+
+
+def test_unknown_resources(server):
+    assert status(server, "GET", "/contexts?party=C&q=Bahn") == 404
+    assert status(server, "GET", "/search?q=Bahn&corpus=btw1949") == 404
+    assert status(server, "GET", "/nothing") == 404
+    assert status(server, "POST", "/search", {"q": "Bahn"}) == 405
@@ -0,0 +1,135 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = ".cache/textrazor.sqlite"
+# free tier of TextRazor
+DAILY_REQUEST_LIMIT = 500
+
+
+def analysis_cache_key(text, extractors):
+    key_source = json.dumps(sorted(extractors)) + "\0" + text
+    return hashlib.sha256(key_source.encode("utf8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    On-disk cache for TextRazor responses, shared by all processes using the
+    same sqlite file. Entries expire after ttl seconds; beyond max_entries
+    the least recently used entries are evicted. The same file keeps a
+    per-day counter of requests sent to TextRazor.
+    """
+
+    def __init__(
+        self,
+        db_path=DEFAULT_CACHE_PATH,
+        ttl=30 * 24 * 3600,
+        max_entries=50000,
+        daily_limit=DAILY_REQUEST_LIMIT,
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.daily_limit = daily_limit
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS analyses "
+                "(key TEXT PRIMARY KEY, response TEXT, created REAL, accessed REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS analyses_accessed ON analyses (accessed)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS quota (day TEXT PRIMARY KEY, used INTEGER)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # connections are short-lived so that the cache can be shared between
+        # threads and processes
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT response, created FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if now - created > self.ttl:
+                connection.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                return None
+            connection.execute(
+                "UPDATE analyses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(response)
+
+    def put(self, key, response):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), now, now),
+            )
+            connection.execute(
+                "DELETE FROM analyses WHERE key IN (SELECT key FROM analyses "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.utcnow().date().isoformat()
+
+    def try_consume_quota(self, requests=1):
+        """
+        Books requests against today's quota.
+
+        Returns
+        -------
+        bool
+            False, and nothing is booked, if the quota does not allow for
+            the requests anymore.
+        """
+        today = self._today()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT used FROM quota WHERE day = ?", (today,)
+            ).fetchone()
+            used = row[0] if row else 0
+            if used + requests > self.daily_limit:
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO quota VALUES (?, ?)", (today, used + requests)
+            )
+            connection.execute("COMMIT")
+        return True
+
+    def quota_used(self):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT used FROM quota WHERE day = ?", (self._today(),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def quota_remaining(self):
+        return max(self.daily_limit - self.quota_used(), 0)
@@ -0,0 +1,279 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.textrazor_client import DEFAULT_EXTRACTORS, analyze_texts
+
+WINDOW_SIZE = 11
+KINDS = ["topics", "entities"]
+ANNOTATION_COLUMNS = ["party", "line_start", "line_end", "kind", "label", "score"]
+
+
+def iter_line_windows(asset_dict, window_size=WINDOW_SIZE):
+    """
+    Splits every doc into consecutive, non-overlapping windows of
+    window_size lines and yields (doc_name, line_start, line_end, text);
+    line_end is exclusive.
+    """
+    for asset_name, asset_content_dict in asset_dict.items():
+        line_count = len(asset_content_dict)
+        for line_start in range(0, line_count, window_size):
+            line_end = min(line_start + window_size, line_count)
+            text = "\n".join(
+                asset_content_dict[line_number]
+                for line_number in range(line_start, line_end)
+            )
+            yield asset_name, line_start, line_end, text
+
+
+def annotate_corpus(
+    asset_dict,
+    client,
+    api_key=None,
+    cache=None,
+    window_size=WINDOW_SIZE,
+    batch_size=50,
+    max_workers=4,
+    version=None,
+):
+    """
+    Annotates all line windows of all docs with topics and entities.
+
+    Parameters
+    ----------
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested mapping of structure
+        line_number: line_text.
+    client : object
+        The annotator; anything with an analyze(text) method returning a
+        response with TextRazor's json layout, e.g. textrazor.TextRazor or
+        FakeTextRazor.
+    api_key : string
+    cache : AnalysisCache
+        Reuses earlier responses; windows beyond the daily quota stay
+        unannotated, so the job can be resumed with the same cache.
+    window_size : int
+    batch_size : int
+        Number of windows handed to analyze_texts at once.
+    max_workers : int
+    version : string
+        The corpus version, stored to detect annotations of another corpus.
+
+    Returns
+    -------
+    dict
+        Columns party, line_start, line_end, kind, label and score as numpy
+        arrays, with party, kind and label as codes into the lists parties,
+        kinds and labels, plus window_size and the number of windows that
+        could not be annotated (missing) and the corpus version.
+    """
+    parties = list(asset_dict)
+    labels = {}
+    columns = {column: [] for column in ANNOTATION_COLUMNS}
+    missing = 0
+
+    def flush(batch):
+        nonlocal missing
+        responses = analyze_texts(
+            {key: text for key, (_, text) in batch.items()},
+            api_key,
+            extractors=DEFAULT_EXTRACTORS,
+            cache=cache,
+            client=client,
+            max_workers=max_workers,
+        )
+        for key, (response_json, _) in responses.items():
+            (asset_name, line_start, line_end), _ = batch[key]
+            if response_json is None:
+                missing += 1
+                continue
+            response = response_json.get("response", {})
+            annotations = [
+                ("topics", topic["label"], topic["score"])
+                for topic in response.get("topics", [])
+            ] + [
+                ("entities", entity["entityId"], entity["confidenceScore"])
+                for entity in response.get("entities", [])
+                # filter irrelevant entity types
+                if entity.get("type") != ["Number"]
+            ]
+            for kind, label, score in annotations:
+                columns["party"].append(parties.index(asset_name))
+                columns["line_start"].append(line_start)
+                columns["line_end"].append(line_end)
+                columns["kind"].append(KINDS.index(kind))
+                columns["label"].append(labels.setdefault(label, len(labels)))
+                columns["score"].append(score)
+
+    batch = {}
+    for asset_name, line_start, line_end, text in iter_line_windows(
+        asset_dict, window_size
+    ):
+        batch[len(batch)] = ((asset_name, line_start, line_end), text)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = {}
+    if batch:
+        flush(batch)
+
+    dtypes = {
+        "party": np.int16,
+        "line_start": np.int32,
+        "line_end": np.int32,
+        "kind": np.int8,
+        "label": np.int32,
+        "score": np.float32,
+    }
+    annotations = {
+        column: np.array(values, dtype=dtypes[column])
+        for column, values in columns.items()
+    }
+    annotations.update(
+        parties=parties,
+        kinds=KINDS,
+        labels=list(labels),
+        window_size=window_size,
+        missing=missing,
+        version=version,
+    )
+    return annotations
+
+
+def write_annotations(annotations, path):
+    np.savez_compressed(
+        path,
+        **{column: annotations[column] for column in ANNOTATION_COLUMNS},
+        parties=np.array(annotations["parties"]),
+        kinds=np.array(annotations["kinds"]),
+        labels=np.array(annotations["labels"]),
+        window_size=annotations["window_size"],
+        missing=annotations["missing"],
+        version=np.array(annotations["version"] or ""),
+    )
+
+
+def read_annotations(path, version=None):
+    """
+    Reads precomputed annotations. Returns None if the file does not exist
+    or, with a version, belongs to another corpus version: its windows
+    would refer to shifted line numbers.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as annotation_file:
+        annotations = {column: annotation_file[column] for column in ANNOTATION_COLUMNS}
+        annotations.update(
+            parties=annotation_file["parties"].tolist(),
+            kinds=annotation_file["kinds"].tolist(),
+            labels=annotation_file["labels"].tolist(),
+            window_size=int(annotation_file["window_size"]),
+            missing=int(annotation_file["missing"]),
+            version=str(annotation_file["version"]) or None
+            if "version" in annotation_file
+            else None,
+        )
+    if version is not None and annotations["version"] != version:
+        return None
+    return annotations
+
+
+def annotations_for_matches(annotations, party, line_numbers, kind):
+    """
+    Looks up the precomputed annotations of kind ("topics" or "entities")
+    for the windows containing the given matched lines of party.
+
+    Returns
+    -------
+    DataFrame
+        With columns match_nr, label (categorical) and score; match_nr is
+        the position of the line in line_numbers.
+    """
+    if party not in annotations["parties"]:
+        return pd.DataFrame(
+            {
+                "match_nr": np.array([], dtype=np.int64),
+                "label": pd.Categorical([]),
+                "score": np.array([], dtype=np.float32),
+            }
+        )
+    rows = np.flatnonzero(
+        (annotations["party"] == annotations["parties"].index(party))
+        & (annotations["kind"] == annotations["kinds"].index(kind))
+    )
+    line_start = annotations["line_start"][rows]
+    line_end = annotations["line_end"][rows]
+    # rows of one party are ordered by window, so each matched line selects
+    # the contiguous block of rows of its window
+    line_numbers = np.asarray(list(line_numbers), dtype=np.int64)
+    block_start = np.searchsorted(line_end, line_numbers, side="right")
+    block_end = np.searchsorted(line_start, line_numbers, side="right")
+    block_length = np.maximum(block_end - block_start, 0)
+    match_nr = np.repeat(np.arange(len(line_numbers)), block_length)
+    offsets = np.arange(block_length.sum()) - np.repeat(
+        np.cumsum(block_length) - block_length, block_length
+    )
+    selected = rows[np.repeat(block_start, block_length) + offsets]
+    return pd.DataFrame(
+        {
+            "match_nr": match_nr,
+            "label": pd.Categorical.from_codes(
+                annotations["label"][selected], categories=annotations["labels"]
+            ),
+            "score": annotations["score"][selected],
+        }
+    )
+
+
+if __name__ == "__main__":
+    from decouple import config
+
+    from utils.analysis_cache import AnalysisCache
+    from utils.doc_handler import read_docs_from_corpus
+    from utils.textrazor_client import FakeTextRazor, create_textrazor_client
+
+    parser = argparse.ArgumentParser(
+        description="Annotate all line windows of the corpus with topics and entities."
+    )
+    parser.add_argument("--corpus", default="assets/doc_data.corpus")
+    parser.add_argument(
+        "--out",
+        default=None,
+        help="defaults to assets/annotations.npz, read by the app, and to "
+        "assets/annotations.fake.npz for the fake annotator",
+    )
+    parser.add_argument(
+        "--annotator", choices=["textrazor", "fake"], default="textrazor"
+    )
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE)
+    args = parser.parse_args()
+    if args.annotator == "textrazor":
+        api_key = config("TEXTRAZOR")
+        client = create_textrazor_client(api_key)
+        cache = AnalysisCache()
+    else:
+        api_key = None
+        client = FakeTextRazor()
+        cache = None
+    if args.out is None:
+        # made-up annotations never go where the app would serve them
+        args.out = (
+            "assets/annotations.npz"
+            if args.annotator == "textrazor"
+            else "assets/annotations.fake.npz"
+        )
+    corpus = read_docs_from_corpus(args.corpus)
+    annotations = annotate_corpus(
+        corpus,
+        client,
+        api_key=api_key,
+        cache=cache,
+        window_size=args.window_size,
+        version=corpus.version,
+    )
+    write_annotations(annotations, args.out)
+    print(
+        f"wrote {len(annotations['label'])} annotations to {args.out}, "
+        f"{annotations['missing']} windows could not be annotated"
+    )
@@ -1,19 +1,31 @@
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
 import plotly.graph_objects as go
-from PIL import Image
 
+FIGURE_CACHE_SIZE = 256
 
-def create_horizontal_barchart(chart_data, chart_specs, **kwargs):
+_templates = {}
+_figure_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _horizontal_barchart_spec(chart_specs):
     dict_of_fig = dict(
         {
             "data": {
                 "type": "bar",
-                "x": chart_data[chart_specs["value"]],
-                "y": chart_data[chart_specs["label"]],
-                "text": chart_data[chart_specs["value"]],
+                "x": [],
+                "y": [],
+                "text": [],
                 "textposition": "auto",
                 "textangle": 0,
                 "orientation": "h",
-                "meta": chart_specs["meta_template"].format(**kwargs["meta_variables"]),
+                "meta": "",
                 "hovertemplate": chart_specs["hovertemplate"],
                 "opacity": 0.9,
                 "marker_line": {"color": "white", "width": 1},
@@ -27,9 +39,7 @@ def create_horizontal_barchart(chart_data, chart_specs, **kwargs):
                     "gridcolor": "black",
                 },
                 "title": {
-                    "text": chart_specs["chart_title"].format(
-                        **kwargs["title_wildcards"]
-                    ),
+                    "text": "",
                     "y": 0.9,
                     "x": 0.5,
                     "xanchor": "center",
@@ -46,8 +56,194 @@ def create_horizontal_barchart(chart_data, chart_specs, **kwargs):
         dict_of_fig["data"]["marker_color"] = chart_specs["marker_color_list"]
     if "color_col" in chart_specs:
         dict_of_fig["data"]["marker"] = {
-            "color": chart_data[chart_specs["color_col"]],
+            "color": [],
             "colorscale": chart_specs["colorscale"],
         }
-    fig = go.Figure(dict_of_fig)
-    return fig
+    return dict_of_fig
+
+
+def _grouped_barchart_spec(chart_specs):
+    return dict(
+        {
+            "data": {
+                "type": "bar",
+                "name": "",
+                "x": [],
+                "y": [],
+                "text": [],
+                "textposition": "auto",
+                "textangle": 0,
+                "orientation": "h",
+                "meta": "",
+                "hovertemplate": chart_specs["hovertemplate"],
+                "opacity": 0.9,
+                "marker_line": {"color": "white", "width": 1},
+            },
+            "layout": {
+                "barmode": "group",
+                "yaxis": {"categoryorder": "total ascending"},
+                "xaxis": {
+                    "zeroline": True,
+                    "zerolinewidth": 1,
+                    "zerolinecolor": "black",
+                    "gridcolor": "black",
+                },
+                "title": {
+                    "text": "",
+                    "y": 0.9,
+                    "x": 0.5,
+                    "xanchor": "center",
+                    "yanchor": "top",
+                },
+                "legend": {"traceorder": "normal"},
+                "paper_bgcolor": "rgba(162,162,162,0.1)",
+                "plot_bgcolor": "rgba(0,0,0,0)",
+                "margin_pad": 10,
+            },
+        }
+    )
+
+
+_CHART_SPECS = {
+    "horizontal_barchart": _horizontal_barchart_spec,
+    "grouped_barchart": _grouped_barchart_spec,
+}
+
+
+def _template(chart_type, chart_specs):
+    """
+    Returns the figure of chart_type for chart_specs without data, as a
+    plain dict validated once by plotly: the trace under "trace" and the
+    layout under "layout".
+    """
+    key = (chart_type, json.dumps(chart_specs, sort_keys=True, default=str))
+    with _lock:
+        template = _templates.get(key)
+    if template is None:
+        fig = go.Figure(_CHART_SPECS[chart_type](chart_specs)).to_dict()
+        template = {"trace": fig["data"][0], "layout": fig["layout"]}
+        with _lock:
+            _templates[key] = template
+    return template
+
+
+def _values(series):
+    return series.tolist()
+
+
+def _fill_horizontal_barchart(template, chart_data, chart_specs, **kwargs):
+    trace = copy.deepcopy(template["trace"])
+    trace["x"] = _values(chart_data[chart_specs["value"]])
+    trace["y"] = _values(chart_data[chart_specs["label"]])
+    trace["text"] = trace["x"]
+    trace["meta"] = chart_specs["meta_template"].format(**kwargs["meta_variables"])
+    if "color_col" in chart_specs:
+        trace["marker"]["color"] = _values(chart_data[chart_specs["color_col"]])
+    layout = copy.deepcopy(template["layout"])
+    layout["title"]["text"] = chart_specs["chart_title"].format(
+        **kwargs["title_wildcards"]
+    )
+    return {"data": [trace], "layout": layout}
+
+
+def _fill_grouped_barchart(template, chart_data, chart_specs, **kwargs):
+    labels = _values(chart_data[chart_specs["label"]])
+    traces = []
+    for value_column in chart_data.columns:
+        if value_column == chart_specs["label"]:
+            continue
+        trace = copy.deepcopy(template["trace"])
+        trace["name"] = trace["meta"] = value_column
+        trace["x"] = trace["text"] = _values(chart_data[value_column])
+        trace["y"] = labels
+        traces.append(trace)
+    layout = copy.deepcopy(template["layout"])
+    layout["title"]["text"] = chart_specs["chart_title"].format(
+        **kwargs["title_wildcards"]
+    )
+    return {"data": traces, "layout": layout}
+
+
+_FILL_TEMPLATE = {
+    "horizontal_barchart": _fill_horizontal_barchart,
+    "grouped_barchart": _fill_grouped_barchart,
+}
+
+
+def figure_digest(chart_type, chart_data, chart_specs, **kwargs):
+    """Digest of everything a figure is built from, hashing the data values."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(
+        json.dumps(
+            [chart_type, chart_specs, kwargs, list(map(str, chart_data.columns))],
+            sort_keys=True,
+            default=str,
+        ).encode("utf8")
+    )
+    digest.update(pd.util.hash_pandas_object(chart_data, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def figure_json(chart_type, chart_data, chart_specs, **kwargs):
+    """
+    Returns the figure JSON of a chart, filling only the data arrays and
+    title into the prebuilt template of chart_specs. Results are kept in
+    an in-process LRU cache keyed on figure_digest.
+
+    Parameters
+    ----------
+    chart_type : string
+        "horizontal_barchart" or "grouped_barchart".
+    chart_data : DataFrame
+    chart_specs : dict
+        An entry of mappings.chart_specifications.
+    """
+    key = figure_digest(chart_type, chart_data, chart_specs, **kwargs)
+    with _lock:
+        cached = _figure_cache.get(key)
+        if cached is not None:
+            _figure_cache.move_to_end(key)
+            return cached
+    fig_json = json.dumps(
+        _FILL_TEMPLATE[chart_type](
+            _template(chart_type, chart_specs), chart_data, chart_specs, **kwargs
+        ),
+        ensure_ascii=False,
+    )
+    with _lock:
+        _figure_cache[key] = fig_json
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return fig_json
+
+
+def clear_figure_cache():
+    with _lock:
+        _figure_cache.clear()
+
+
+def _figure(fig_json):
+    # the template was validated when it was built; a fresh copy per call
+    # keeps the cached JSON safe from changes to the returned figure
+    return go.Figure(json.loads(fig_json), _validate=False)
+
+
+def create_horizontal_barchart(chart_data, chart_specs, **kwargs):
+    return _figure(
+        figure_json("horizontal_barchart", chart_data, chart_specs, **kwargs)
+    )
+
+
+def create_grouped_barchart(chart_data, chart_specs, **kwargs):
+    """
+    Creates a horizontal bar chart with one group of bars per label and one
+    bar per value column, e.g. a party x term matrix of match counts.
+
+    Parameters
+    ----------
+    chart_data : DataFrame
+        The label column given by chart_specs["label"] plus one column per
+        bar of a group.
+    chart_specs : dict
+    """
+    return _figure(figure_json("grouped_barchart", chart_data, chart_specs, **kwargs))
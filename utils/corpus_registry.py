@@ -0,0 +1,114 @@
+import json
+import mmap
+import os
+import sys
+
+import numpy as np
+
+DEFAULT_CORPORA_DIR = "assets/corpora"
+# the files of a corpus, see Reader and utils.ingestion; by default named
+# assets/<corpus name>/doc_data.*
+CORPUS_FILES = {
+    "corpus": "doc_data.corpus",
+    "json": "doc_data.json",
+    "search_index": "doc_data.search",
+    "phrase_index": "doc_data.phrases",
+    "fuzzy_index": "doc_data.fuzzy",
+    "term_matrix": "doc_data.terms.npz",
+    "semantic_index": "doc_data.semantic",
+    "structure": "doc_data.structure.npz",
+    "annotations": "annotations.npz",
+    "ingest_manifest": "doc_data.manifest.json",
+}
+
+
+class UnknownCorpusError(KeyError):
+    pass
+
+
+def read_corpus_manifests(corpora_dir=DEFAULT_CORPORA_DIR):
+    """
+    Reads the manifests of all corpora, one json file per election in
+    corpora_dir with keys name, title, date (of the election, ISO format),
+    docs (doc_name: url of the PDF) and optionally paths (overrides of
+    corpus_paths) and default.
+
+    Returns
+    -------
+    dict
+        A dict of structure name: manifest, ordered by date.
+    """
+    manifests = []
+    for file_name in sorted(os.listdir(corpora_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(corpora_dir, file_name), encoding="utf8") as file:
+            manifest = json.load(file)
+        manifest.setdefault("name", file_name[: -len(".json")])
+        manifest.setdefault("title", manifest["name"])
+        manifests.append(manifest)
+    manifests.sort(key=lambda manifest: (manifest.get("date", ""), manifest["name"]))
+    return {manifest["name"]: manifest for manifest in manifests}
+
+
+def corpus_paths(manifest, assets_dir="assets"):
+    """
+    The paths of the files of a corpus: assets_dir/<name>/<file name of
+    CORPUS_FILES>, unless the manifest names them.
+    """
+    paths = {
+        kind: os.path.join(assets_dir, manifest["name"], file_name)
+        for kind, file_name in CORPUS_FILES.items()
+    }
+    paths.update(manifest.get("paths", {}))
+    return paths
+
+
+def default_corpus(manifests):
+    """The name of the corpus marked as default, else of the latest election."""
+    if not manifests:
+        raise UnknownCorpusError("no corpus manifests")
+    for name, manifest in manifests.items():
+        if manifest.get("default"):
+            return name
+    return list(manifests)[-1]
+
+
+def select_manifest(manifests, name=None):
+    if name is None:
+        name = default_corpus(manifests)
+    if name not in manifests:
+        raise UnknownCorpusError(name)
+    return manifests[name]
+
+
+def _is_mapped(array):
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def approximate_size(value):
+    """
+    Estimates the bytes value holds on the heap, recursing into dicts,
+    lists, tuples and the attributes of objects. Arrays backed by a memory-mapped file count nothing:
+    their pages belong to the OS page cache, not to the process.
+    """
+    if isinstance(value, np.ndarray):
+        return 0 if _is_mapped(value) else value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            approximate_size(key) + approximate_size(item)
+            for key, item in value.items()
+        )
+    if hasattr(value, "__dict__"):
+        # index objects such as utils.search_index.Postings
+        return sys.getsizeof(value) + approximate_size(vars(value))
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], int):
+            # postings: lists of ints, counted without visiting every item
+            return sys.getsizeof(value) + sys.getsizeof(value[0]) * len(value)
+        return sys.getsizeof(value) + sum(approximate_size(item) for item in value)
+    return sys.getsizeof(value)
@@ -0,0 +1,234 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Mapping
+
+CORPUS_MAGIC = b"WPRC"
+CORPUS_FORMAT_VERSION = 1
+# magic, format version, header length
+_PREAMBLE = struct.Struct("<4sII")
+_OFFSET_ITEMSIZE = 8
+
+
+def _align(position, alignment=_OFFSET_ITEMSIZE):
+    return position + (-position % alignment)
+
+
+def write_corpus(asset_dict, corpus_path, metadata=None):
+    """
+    Writes docs to the binary corpus format: per doc one contiguous UTF-8
+    blob holding all lines plus an array of uint64 byte offsets, preceded by
+    a small JSON header describing where each doc lives in the file.
+
+    Parameters
+    ----------
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested dict of structure
+        line_number: line_text. Line numbers have to be 0..n-1.
+    corpus_path : string
+    metadata : dict
+        Stored in the header as is, see MappedCorpus.metadata; not part of
+        the version.
+
+    Returns
+    -------
+    string
+        The corpus version, a digest of the stored content.
+    """
+    sections = []
+    digest = hashlib.sha256()
+    for asset_name, asset_content_dict in asset_dict.items():
+        line_numbers = sorted(asset_content_dict)
+        if line_numbers != list(range(len(line_numbers))):
+            raise ValueError(f"line numbers of {asset_name} are not contiguous")
+        encoded_lines = [asset_content_dict[n].encode("utf8") for n in line_numbers]
+        offsets = [0]
+        for encoded_line in encoded_lines:
+            offsets.append(offsets[-1] + len(encoded_line))
+        blob = b"".join(encoded_lines)
+        offset_bytes = struct.pack(f"<{len(offsets)}Q", *offsets)
+        digest.update(asset_name.encode("utf8"))
+        digest.update(offset_bytes)
+        digest.update(blob)
+        sections.append((asset_name, offset_bytes, blob))
+
+    def build_header(data_start):
+        docs = []
+        position = data_start
+        for asset_name, offset_bytes, blob in sections:
+            docs.append(
+                {
+                    "name": asset_name,
+                    "line_count": len(offset_bytes) // _OFFSET_ITEMSIZE - 1,
+                    "offsets_start": position,
+                    "blob_start": position + len(offset_bytes),
+                    "blob_length": len(blob),
+                }
+            )
+            position = _align(position + len(offset_bytes) + len(blob))
+        header = {"version": digest.hexdigest()[:16], "docs": docs}
+        if metadata:
+            header["metadata"] = metadata
+        return json.dumps(header, ensure_ascii=False).encode("utf8")
+
+    # the header length depends on the data offsets it contains, so grow the
+    # space reserved for it until the header fits
+    data_start = _align(_PREAMBLE.size + len(build_header(0)))
+    header_bytes = build_header(data_start)
+    while _PREAMBLE.size + len(header_bytes) > data_start:
+        data_start = _align(_PREAMBLE.size + len(header_bytes))
+        header_bytes = build_header(data_start)
+    header_bytes = header_bytes.ljust(data_start - _PREAMBLE.size, b" ")
+
+    # a temporary file of its own per writer, so concurrent writers (such as
+    # workers creating a missing phrase index) never write into each other
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(corpus_path) or ".",
+        prefix=os.path.basename(corpus_path) + ".",
+        suffix=".tmp",
+    )
+    # mkstemp creates the file readable by its owner only
+    os.chmod(tmp_path, 0o644)
+    try:
+        with os.fdopen(file_descriptor, "wb") as corpus_file:
+            corpus_file.write(
+                _PREAMBLE.pack(CORPUS_MAGIC, CORPUS_FORMAT_VERSION, len(header_bytes))
+            )
+            corpus_file.write(header_bytes)
+            for _, offset_bytes, blob in sections:
+                corpus_file.write(offset_bytes)
+                corpus_file.write(blob)
+                corpus_file.write(b"\0" * (-corpus_file.tell() % _OFFSET_ITEMSIZE))
+        os.replace(tmp_path, corpus_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return json.loads(header_bytes)["version"]
+
+
+class MappedDoc(Mapping):
+    """
+    Read-only line_number: line_text mapping over one doc of a MappedCorpus.
+    Lines are decoded from the shared memory map on access.
+    """
+
+    def __init__(self, buffer, line_count, offsets_start, blob_start, source=None):
+        self._buffer = buffer
+        self._source = source
+        self._line_count = line_count
+        self._offsets = buffer[
+            offsets_start : offsets_start + (line_count + 1) * _OFFSET_ITEMSIZE
+        ].cast("Q")
+        self._blob_start = blob_start
+
+    def __getitem__(self, line_number):
+        if not isinstance(line_number, int) or not (
+            0 <= line_number < self._line_count
+        ):
+            raise KeyError(line_number)
+        start = self._blob_start + self._offsets[line_number]
+        end = self._blob_start + self._offsets[line_number + 1]
+        return str(self._buffer[start:end], "utf8")
+
+    def __iter__(self):
+        return iter(range(self._line_count))
+
+    def __len__(self):
+        return self._line_count
+
+    def find_lines(self, needle):
+        """
+        Finds all occurrences of needle (bytes) in the doc's blob, also
+        across line boundaries, without decoding it.
+
+        Returns
+        -------
+        list
+            Ascending line numbers in which an occurrence starts.
+        """
+        blob_end = self._blob_start + self._offsets[self._line_count]
+        line_numbers = []
+        position = self._source.find(needle, self._blob_start, blob_end)
+        while position != -1:
+            offset = position - self._blob_start
+            # the last line starting at or before offset; empty lines before
+            # it share its start offset
+            line_number = bisect.bisect_right(self._offsets, offset) - 1
+            if not line_numbers or line_numbers[-1] != line_number:
+                line_numbers.append(line_number)
+            position = self._source.find(needle, position + 1, blob_end)
+        return line_numbers
+
+    def text(self):
+        """Returns all lines of the doc joined by newlines."""
+        return "\n".join(self.values())
+
+
+class MappedCorpus(Mapping):
+    """
+    Read-only doc_name: MappedDoc mapping over a corpus file written by
+    write_corpus. The file is opened via mmap, so all processes opening the
+    same file share its pages.
+    """
+
+    def __init__(self, corpus_path):
+        with open(corpus_path, "rb") as corpus_file:
+            self._mmap = mmap.mmap(corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, format_version, header_length = _PREAMBLE.unpack_from(self._mmap)
+        if magic != CORPUS_MAGIC or format_version != CORPUS_FORMAT_VERSION:
+            raise ValueError(f"{corpus_path} is not a supported corpus file")
+        header = json.loads(self._mmap[_PREAMBLE.size : _PREAMBLE.size + header_length])
+        if sys.byteorder != "little":
+            raise ValueError("corpus files can only be mapped on little endian")
+        self.path = corpus_path
+        self._buffer = buffer
+        self.version = header["version"]
+        self.metadata = header.get("metadata", {})
+        self._docs = {
+            doc["name"]: MappedDoc(
+                buffer,
+                doc["line_count"],
+                doc["offsets_start"],
+                doc["blob_start"],
+                source=self._mmap,
+            )
+            for doc in header["docs"]
+        }
+
+    def __getitem__(self, asset_name):
+        return self._docs[asset_name]
+
+    def __iter__(self):
+        return iter(self._docs)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def close(self):
+        for doc in self._docs.values():
+            doc._offsets.release()
+        self._docs = {}
+        self._buffer.release()
+        self._mmap.close()
+
+
+def open_corpus(corpus_path):
+    return MappedCorpus(corpus_path)
+
+
+if __name__ == "__main__":
+    # convert a doc_data.json to the corpus format:
+    # python -m utils.corpus_store assets/doc_data.json assets/doc_data.corpus
+    json_path, corpus_path = sys.argv[1:3]
+    with open(json_path, encoding="utf8") as json_file:
+        asset_dict = json.load(json_file)
+    asset_dict = {
+        k: {int(kk): vv for kk, vv in v.items()} for k, v in asset_dict.items()
+    }
+    print(write_corpus(asset_dict, corpus_path))
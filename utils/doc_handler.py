@@ -1,15 +1,19 @@
-import requests
-import fitz
-import tempfile
-import textrazor
 import pandas as pd
 import json
+import os
+import re
 
+from utils.corpus_store import open_corpus, write_corpus
+from utils.instrumentation import timed
+from utils.textrazor_client import analyze_text, analyze_texts
 
+
+@timed("load")
 def read_docs_from_links(doc_dict):
     """
     Reads a dict of structure doc_name: doc_link and imports the respective
-    documents.
+    documents. Downloads and text extraction run concurrently, see
+    utils.ingestion.
 
     Returns
     -------
@@ -17,29 +21,18 @@ def read_docs_from_links(doc_dict):
         A dict with doc_name as key. Contains a nested dict of structure
         line_number: line_text.
     """
-    return_dict = {}
-    for asset_name, asset_link in doc_dict.items():
-        asset = requests.get(asset_link)
-        with tempfile.TemporaryDirectory() as directory:
-            temp_file_name = asset_name.replace("/", "-")
-            t = open(f"{directory}/{temp_file_name}.pdf", "wb").write(asset.content)
-            doc = fitz.Document(f"{directory}/{temp_file_name}.pdf")
-            doc_text = ""
-            for page in doc:
-                doc_text += page.getText()
-            asset_dict = {}
-            for line_number, line_text in enumerate(doc_text.splitlines()):
-                asset_dict[line_number] = line_text
-            return_dict[asset_name] = asset_dict
-    return return_dict
+    from utils.ingestion import fetch_and_parse_docs
+
+    return fetch_and_parse_docs(doc_dict)
 
 
-def store_docs_as_json(docs):
-    with open("doc_data.json", "w", encoding="utf8") as json_dump:
-        json.dump(assets, json_dump, sort_keys=True, indent=4, ensure_ascii=False)
+def store_docs_as_json(docs, json_path="doc_data.json"):
+    with open(json_path, "w", encoding="utf8") as json_dump:
+        json.dump(docs, json_dump, sort_keys=True, indent=4, ensure_ascii=False)
 
 
-def read_docs_from_json():
+@timed("load")
+def read_docs_from_json(json_path="assets/doc_data.json"):
     """
     Reads docs from json file. For performance purposes only.
 
@@ -49,13 +42,34 @@ def read_docs_from_json():
         A dict with doc_name as key. Contains a nested dict of structure
         line_number: line_text.
     """
-    asset_dict = json.load(open("assets/doc_data.json"))
+    with open(json_path, encoding="utf8") as json_file:
+        asset_dict = json.load(json_file)
     asset_dict = {
         k: {int(kk): vv for kk, vv in v.items()} for k, v in asset_dict.items()
     }
     return asset_dict
 
 
+@timed("load")
+def read_docs_from_corpus(
+    corpus_path="assets/doc_data.corpus", json_path="assets/doc_data.json"
+):
+    """
+    Opens docs from the memory-mapped corpus file. If the corpus file does
+    not exist yet, it is created from the json file first.
+
+    Returns
+    -------
+    MappedCorpus
+        A read-only mapping with doc_name as key. Contains a nested mapping
+        of structure line_number: line_text.
+    """
+    if not os.path.exists(corpus_path):
+        write_corpus(read_docs_from_json(json_path), corpus_path)
+    return open_corpus(corpus_path)
+
+
+@timed("search")
 def search_against_docs(asset_dict, search_phrase):
     """
     Checks all loaded docs against search phrase and creates a dict
@@ -81,60 +95,251 @@ def search_against_docs(asset_dict, search_phrase):
     return asset_search_matches
 
 
-def request_textrazor_data(match_nr, text_to_analyze, api_key):
-    textrazor.api_key = api_key
-    tr_client = textrazor.TextRazor(extractors=["entities", "topics", "categories"])
-    response = None
-    topic_df = pd.DataFrame(
-        columns=["match_nr", "topic_result_id", "label", "score", "wikiLink"]
+TOPIC_COLUMNS = {
+    "match_nr": "int64",
+    "topic_result_id": "int64",
+    "label": "category",
+    "score": "float64",
+    "wikiLink": "object",
+}
+ENTITY_COLUMNS = {
+    "match_nr": "int64",
+    "entity_result_id": "int64",
+    "label": "category",
+    "type": "category",
+    "score": "float64",
+}
+
+
+def compile_highlight_pattern(search_phrase):
+    """
+    Compiles one case-insensitive pattern for search_phrase; the phrase is
+    escaped and its words may be separated by any whitespace, including
+    line breaks.
+    """
+    words = search_phrase.split()
+    if not words:
+        return None
+    return re.compile(r"\s+".join(re.escape(word) for word in words), re.IGNORECASE)
+
+
+@timed("context")
+def extract_match_contexts(
+    asset_content_dict,
+    match_lines,
+    search_phrase,
+    context_lines=5,
+    merge_overlapping=True,
+    max_snippet_lines=33,
+    render_markdown=True,
+):
+    """
+    Builds the context snippets for all matches of one doc in a single pass
+    over the matched lines. Each match gets a window of context_lines lines
+    before and after it, clipped to the doc; overlapping windows are merged
+    into snippets of at most max_snippet_lines lines.
+
+    Parameters
+    ----------
+    asset_content_dict : dict
+        A mapping of structure line_number: line_text.
+    match_lines : list
+        Ascending line numbers of the matches, e.g. the keys of a doc's
+        entry in the result of search_against_docs.
+    search_phrase : string
+    context_lines : int
+    merge_overlapping : bool
+    max_snippet_lines : int
+    render_markdown : bool
+        If False, markdown is left out and can be rendered later for the
+        snippets actually displayed, see render_snippet_markdown.
+
+    Returns
+    -------
+    list
+        One dict per snippet with keys match_nrs (positions in match_lines),
+        line_start, line_end (exclusive), text (the plain lines) and markdown
+        (a quote with the search phrase highlighted).
+    """
+    line_count = len(asset_content_dict)
+    snippets = []
+    for match_nr, match_line in enumerate(match_lines):
+        line_start = max(match_line - context_lines, 0)
+        line_end = min(match_line + context_lines + 1, line_count)
+        previous = snippets[-1] if merge_overlapping and snippets else None
+        if previous and line_start < previous["line_end"]:
+            if line_end - previous["line_start"] <= max_snippet_lines:
+                previous["match_nrs"].append(match_nr)
+                previous["line_end"] = max(line_end, previous["line_end"])
+                continue
+            if match_line < previous["line_end"]:
+                # already displayed, but the snippet must not grow any further
+                previous["match_nrs"].append(match_nr)
+                continue
+            line_start = previous["line_end"]
+        snippets.append(
+            {
+                "match_nrs": [match_nr],
+                "line_start": line_start,
+                "line_end": line_end,
+            }
+        )
+    highlight_pattern = (
+        compile_highlight_pattern(search_phrase) if render_markdown else None
     )
-    entity_df = pd.DataFrame(
-        columns=[
-            "match_nr",
-            "entity_result_id",
-            "label",
-            "type",
-            "score",
+    for snippet in snippets:
+        lines = [
+            asset_content_dict[line_number]
+            for line_number in range(snippet["line_start"], snippet["line_end"])
         ]
-    )
+        snippet["text"] = "\n".join(lines)
+        if render_markdown:
+            render_snippet_markdown(snippet, highlight_pattern)
+    return snippets
 
-    try:
-        response = tr_client.analyze(text_to_analyze)
-    except textrazor.TextRazorAnalysisException:
-        pass
-    if response:
-        if response.topics():
-            for topic_n, topic in enumerate(response.topics()):
-                topic_data = topic.json
-                topic_df = topic_df.append(
-                    {
-                        "match_nr": match_nr,
-                        "topic_result_id": topic_n,
-                        "label": topic_data["label"],
-                        "score": topic_data["score"],
-                        "wikiLink": topic_data["wikiLink"],
-                    },
-                    ignore_index=True,
-                )
-        if response.entities():
-            for entity_n, entity in enumerate(response.entities()):
-                entity_data = entity.json
-                # catch missing values
-                try:
-                    entity_type = str(entity_data["type"])
-                except KeyError:
-                    entity_type = "type unknown"
-                # build df
-                entity_df = entity_df.append(
-                    {
-                        "match_nr": match_nr,
-                        "entity_result_id": entity_n,
-                        "label": entity_data["entityId"],
-                        "type": entity_type,
-                        "score": entity_data["confidenceScore"],
-                    },
-                    ignore_index=True,
+
+def render_snippet_markdown(snippet, highlight_pattern):
+    """
+    Adds the markdown of a snippet: its lines as a quote, with all matches
+    of highlight_pattern (see compile_highlight_pattern) highlighted.
+    """
+    markdown = snippet["text"].replace("\n", "  \n")
+    if highlight_pattern is not None:
+        markdown = highlight_pattern.sub(lambda match: f"`{match.group(0)}`", markdown)
+    snippet["markdown"] = f">{markdown}  \n"
+    return snippet
+
+
+@timed("analysis")
+def build_textrazor_batch_frames(responses):
+    """
+    Builds the topic and entity DataFrames for several matches at once. The
+    records of all matches are collected first and each frame is created in
+    one go, with categorical label (and type) columns.
+
+    Parameters
+    ----------
+    responses : dict
+        A dict of structure match_nr: json of the TextRazor response (or
+        None).
+
+    Returns
+    -------
+    tuple
+        (topic_df, entity_df)
+    """
+    topic_records = []
+    entity_records = []
+    for match_nr, response_json in responses.items():
+        if not response_json:
+            continue
+        response = response_json.get("response", {})
+        for topic_n, topic_data in enumerate(response.get("topics", [])):
+            topic_records.append(
+                (
+                    match_nr,
+                    topic_n,
+                    topic_data["label"],
+                    topic_data["score"],
+                    topic_data["wikiLink"],
                 )
+            )
+        for entity_n, entity_data in enumerate(response.get("entities", [])):
+            # catch missing values
+            entity_type = str(entity_data.get("type", "type unknown"))
             # filter irrelevant entity types
-            entity_df = entity_df[entity_df["type"] != "['Number']"]
+            if entity_type == "['Number']":
+                continue
+            entity_records.append(
+                (
+                    match_nr,
+                    entity_n,
+                    entity_data["entityId"],
+                    entity_type,
+                    entity_data["confidenceScore"],
+                )
+            )
+    topic_df = pd.DataFrame.from_records(
+        topic_records, columns=list(TOPIC_COLUMNS)
+    ).astype(TOPIC_COLUMNS)
+    entity_df = pd.DataFrame.from_records(
+        entity_records, columns=list(ENTITY_COLUMNS)
+    ).astype(ENTITY_COLUMNS)
     return topic_df, entity_df
+
+
+def split_textrazor_frames(topic_df, entity_df):
+    """
+    Splits batch frames into a dict of structure
+    match_nr: {"topics": topic_df, "entities": entity_df}.
+    """
+    topics_by_match = dict(list(topic_df.groupby("match_nr")))
+    entities_by_match = dict(list(entity_df.groupby("match_nr")))
+    return {
+        match_nr: {
+            "topics": topics_by_match.get(match_nr, topic_df[:0]),
+            "entities": entities_by_match.get(match_nr, entity_df[:0]),
+        }
+        for match_nr in sorted(set(topics_by_match) | set(entities_by_match))
+    }
+
+
+def build_textrazor_frames(match_nr, response_json):
+    """
+    Builds the topic and entity DataFrames for one match from the json of a
+    TextRazor response (or None).
+    """
+    return build_textrazor_batch_frames({match_nr: response_json})
+
+
+@timed("analysis")
+def request_textrazor_data(match_nr, text_to_analyze, api_key, cache=None, client=None):
+    """
+    Analyzes text_to_analyze with TextRazor and returns its topics and
+    entities as DataFrames. With a cache, see analyze_texts, responses are
+    reused across processes and requests beyond the daily quota return
+    empty frames instead of failing.
+    """
+    response_json, _ = analyze_text(
+        text_to_analyze, api_key, cache=cache, client=client
+    )
+    return build_textrazor_frames(match_nr, response_json)
+
+
+@timed("analysis")
+def request_textrazor_batch(
+    match_texts,
+    api_key,
+    cache=None,
+    client=None,
+    max_workers=4,
+    timeout=30,
+    cache_only=False,
+):
+    """
+    Analyzes several matches concurrently, see analyze_texts. With
+    cache_only, only matches with a cached response are covered.
+
+    Parameters
+    ----------
+    match_texts : dict
+        A dict of structure match_nr: text_to_analyze.
+
+    Returns
+    -------
+    tuple
+        (topic_df, entity_df) across all matches, see
+        build_textrazor_batch_frames.
+    """
+    responses = analyze_texts(
+        match_texts,
+        api_key,
+        cache=cache,
+        client=client,
+        max_workers=max_workers,
+        timeout=timeout,
+        cache_only=cache_only,
+    )
+    return build_textrazor_batch_frames(
+        {match_nr: response_json for match_nr, (response_json, _) in responses.items()}
+    )
@@ -0,0 +1,292 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+# PyMuPDF span flag of bold text
+BOLD_FLAG = 16
+MAX_HEADING_LEVELS = 3
+MAX_HEADING_LENGTH = 120
+# a font style used for more lines of a doc than this is body text (e.g.
+# bold emphasis), not a heading
+MAX_HEADING_SHARE = 0.05
+
+
+def _is_bold(span):
+    return bool(span["flags"] & BOLD_FLAG) or "bold" in span.get("font", "").lower()
+
+
+def page_layout(text_dict):
+    """
+    Condenses the output of PyMuPDF's page.get_text("dict") into the lines
+    of the page (as page.get_text().splitlines() splits them) and the font
+    of those lines set in another font than the page's body text.
+
+    Returns
+    -------
+    dict
+        With keys lines, body_size (font size of most of the page's text)
+        and fonts, a list of [line offset, font size, bold] for the lines
+        set differently.
+    """
+    lines = []
+    line_fonts = []
+    characters = Counter()
+    for block in text_dict["blocks"]:
+        if block.get("type", 0) != 0:
+            continue
+        for line in block["lines"]:
+            lines.append("".join(span["text"] for span in line["spans"]))
+            visible = [span for span in line["spans"] if span["text"].strip()]
+            if not visible:
+                line_fonts.append(None)
+                continue
+            main_span = max(visible, key=lambda span: len(span["text"].strip()))
+            font = (
+                round(main_span["size"], 1),
+                all(_is_bold(span) for span in visible),
+            )
+            characters[font] += sum(len(span["text"].strip()) for span in visible)
+            line_fonts.append(font)
+    body_font = characters.most_common(1)[0][0] if characters else (0.0, False)
+    return {
+        "lines": lines,
+        "body_size": body_font[0],
+        "fonts": [
+            [offset, font[0], int(font[1])]
+            for offset, font in enumerate(line_fonts)
+            if font is not None and font != body_font
+        ],
+    }
+
+
+def detect_headings(lines, pages, max_levels=MAX_HEADING_LEVELS):
+    """
+    Finds the headings of a doc: short lines set larger than the body text,
+    or in bold. Each font style is one heading level, larger before bold,
+    and consecutive lines of one style form one heading.
+
+    Parameters
+    ----------
+    lines : list
+        The line texts of the doc.
+    pages : list
+        One dict per page with keys line_count, body_size and fonts, see
+        page_layout.
+    max_levels : int
+
+    Returns
+    -------
+    list
+        One (line_number, level, title) tuple per heading; level 1 is the
+        top level.
+    """
+    body_sizes = Counter()
+    for page in pages:
+        body_sizes[page["body_size"]] += page["line_count"]
+    body_size = body_sizes.most_common(1)[0][0] if body_sizes else 0.0
+    candidates = []
+    line_start = 0
+    for page in pages:
+        for offset, size, bold in page["fonts"]:
+            line_number = line_start + offset
+            title = lines[line_number].strip()
+            if not (0 < len(title) <= MAX_HEADING_LENGTH) or not any(
+                character.isalpha() for character in title
+            ):
+                continue
+            if size >= body_size + 1 or (bold and size >= body_size - 0.5):
+                candidates.append((line_number, (size, bool(bold)), title))
+        line_start += page["line_count"]
+    style_counts = Counter(style for _, style, _ in candidates)
+    styles = sorted(
+        (
+            style
+            for style, count in style_counts.items()
+            if count <= max(MAX_HEADING_SHARE * len(lines), 1)
+        ),
+        key=lambda style: (-style[0], not style[1]),
+    )[:max_levels]
+    levels = {style: level for level, style in enumerate(styles, 1)}
+    headings = []
+    previous_line = previous_style = None
+    for line_number, style, title in candidates:
+        if style not in levels:
+            continue
+        if style == previous_style and line_number == previous_line + 1:
+            # a heading broken over several lines
+            first_line, level, previous_title = headings[-1]
+            headings[-1] = (first_line, level, f"{previous_title} {title}")
+        else:
+            headings.append((line_number, levels[style], title))
+        previous_line, previous_style = line_number, style
+    return headings
+
+
+def build_structure(docs_pages, asset_dict, version=None):
+    """
+    Builds the interval index of pages and sections of all docs.
+
+    Parameters
+    ----------
+    docs_pages : dict
+        A dict of structure doc_name: [page], with pages as in
+        detect_headings.
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested mapping of structure
+        line_number: line_text.
+    version : string
+        The corpus version, stored to detect an outdated index.
+
+    Returns
+    -------
+    dict
+        With keys version, parties and flat arrays over all docs, the
+        entries of doc i between {kind}_offsets[i] and {kind}_offsets[i + 1]:
+        page_starts (first line of each page) and heading_lines,
+        heading_levels, heading_parents (the id of the enclosing heading,
+        or -1) and heading_titles.
+    """
+    parties = [party for party in asset_dict if party in docs_pages]
+    page_starts = []
+    page_offsets = [0]
+    headings = []
+    heading_offsets = [0]
+    for party in parties:
+        pages = docs_pages[party]
+        line_counts = [page["line_count"] for page in pages]
+        page_starts.extend(np.cumsum([0] + line_counts[:-1]).tolist())
+        page_offsets.append(len(page_starts))
+        asset_content_dict = asset_dict[party]
+        lines = [asset_content_dict[n] for n in range(len(asset_content_dict))]
+        enclosing = []
+        for line_number, level, title in detect_headings(lines, pages):
+            while enclosing and enclosing[-1][1] >= level:
+                enclosing.pop()
+            parent = enclosing[-1][0] if enclosing else -1
+            enclosing.append((len(headings), level))
+            headings.append((line_number, level, parent, title))
+        heading_offsets.append(len(headings))
+    return {
+        "version": version,
+        "parties": parties,
+        "page_offsets": np.array(page_offsets, dtype=np.int64),
+        "page_starts": np.array(page_starts, dtype=np.int32),
+        "heading_offsets": np.array(heading_offsets, dtype=np.int64),
+        "heading_lines": np.array([h[0] for h in headings], dtype=np.int32),
+        "heading_levels": np.array([h[1] for h in headings], dtype=np.int8),
+        "heading_parents": np.array([h[2] for h in headings], dtype=np.int32),
+        "heading_titles": [h[3] for h in headings],
+    }
+
+
+_STRUCTURE_ARRAYS = [
+    "page_offsets",
+    "page_starts",
+    "heading_offsets",
+    "heading_lines",
+    "heading_levels",
+    "heading_parents",
+]
+
+
+def write_structure(structure, path):
+    np.savez_compressed(
+        path,
+        version=np.array(structure["version"] or ""),
+        parties=np.array(structure["parties"]),
+        heading_titles=np.array(structure["heading_titles"], dtype=str),
+        **{array: structure[array] for array in _STRUCTURE_ARRAYS},
+    )
+
+
+def read_structure(path, version=None):
+    """
+    Reads the structure index. Returns None if the file does not exist or,
+    with a version, belongs to another corpus version: the structure comes
+    from the PDFs and can only be rebuilt at ingest time.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as structure_file:
+        structure = {array: structure_file[array] for array in _STRUCTURE_ARRAYS}
+        structure.update(
+            version=str(structure_file["version"]) or None,
+            parties=structure_file["parties"].tolist(),
+            heading_titles=structure_file["heading_titles"].tolist(),
+        )
+    if version is not None and structure["version"] != version:
+        return None
+    return structure
+
+
+def locate_lines(structure, party, line_numbers):
+    """
+    Resolves the page and innermost section of lines of party by binary
+    search.
+
+    Returns
+    -------
+    tuple
+        (pages, heading_ids) as arrays: 1-based page numbers in the PDF,
+        and the ids of the headings the lines belong to (-1 before the
+        first heading).
+    """
+    line_numbers = np.asarray(list(line_numbers), dtype=np.int64)
+    party_id = structure["parties"].index(party)
+    page_start, page_end = structure["page_offsets"][party_id : party_id + 2]
+    pages = np.searchsorted(
+        structure["page_starts"][page_start:page_end], line_numbers, side="right"
+    )
+    heading_start, heading_end = structure["heading_offsets"][party_id : party_id + 2]
+    positions = np.searchsorted(
+        structure["heading_lines"][heading_start:heading_end],
+        line_numbers,
+        side="right",
+    )
+    heading_ids = np.where(positions > 0, heading_start + positions - 1, -1)
+    return pages, heading_ids
+
+
+def enclosing_heading(structure, heading_id, level):
+    """The heading of at most level enclosing heading_id (or -1)."""
+    heading_id = int(heading_id)
+    while heading_id >= 0 and structure["heading_levels"][heading_id] > level:
+        heading_id = int(structure["heading_parents"][heading_id])
+    return heading_id
+
+
+def section_path(structure, heading_id):
+    """The titles of heading_id and the headings enclosing it, outermost first."""
+    titles = []
+    heading_id = int(heading_id)
+    while heading_id >= 0:
+        titles.append(structure["heading_titles"][heading_id])
+        heading_id = int(structure["heading_parents"][heading_id])
+    return titles[::-1]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.corpus_store import open_corpus
+
+    parser = argparse.ArgumentParser(
+        description="Print the detected headings of a structure index."
+    )
+    parser.add_argument("--corpus", default="assets/doc_data.corpus")
+    parser.add_argument("--structure", default="assets/doc_data.structure.npz")
+    args = parser.parse_args()
+    corpus = open_corpus(args.corpus)
+    structure = read_structure(args.structure, corpus.version)
+    if structure is None:
+        raise SystemExit(
+            f"{args.structure} is missing or outdated, run utils.ingestion"
+        )
+    for party_id, party in enumerate(structure["parties"]):
+        print(party)
+        start, end = structure["heading_offsets"][party_id : party_id + 2]
+        pages, _ = locate_lines(structure, party, structure["heading_lines"][start:end])
+        for heading_id, page in zip(range(start, end), pages):
+            indent = "  " * int(structure["heading_levels"][heading_id])
+            print(f"{indent}{structure['heading_titles'][heading_id]} (p. {page})")
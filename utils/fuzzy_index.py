@@ -0,0 +1,414 @@
+import re
+import zlib
+
+import numpy as np
+
+from utils.search_index import (
+    TOKEN_PATTERN,
+    normalize_text,
+    read_array_directory,
+    write_array_directory,
+)
+
+# umlauts and their transcriptions ("Waehler") fold to the plain vowel
+FOLDINGS = [
+    ("ä", "a"),
+    ("ö", "o"),
+    ("ü", "u"),
+    ("ß", "ss"),
+    ("ae", "a"),
+    ("oe", "o"),
+    ("ue", "u"),
+]
+MIN_PART_LENGTH = 4
+FUZZY_INDEX_FORMAT_VERSION = 1
+# "Arbeit-s-markt", "Klima-schutz", "Sonne-n-energie"
+LINKING_ELEMENTS = ["", "s", "es", "n", "en"]
+
+
+def fold_word(word):
+    word = normalize_text(word)
+    for umlaut, folded in FOLDINGS:
+        word = word.replace(umlaut, folded)
+    return word
+
+
+def stem_word(word):
+    """
+    Folds and stems a German word with CISTEM (Weissweiler and Fraser,
+    2017), ignoring case: "Klimaschützend" and "Klimaschutzes" both become
+    "klimaschutz".
+    """
+    word = fold_word(word)
+    word = re.sub(r"^ge(.{4,})", r"\1", word)
+    word = word.replace("sch", "$").replace("ei", "%").replace("ie", "&")
+    word = re.sub(r"(.)\1", r"\1*", word)
+    while len(word) > 3:
+        if len(word) > 5:
+            word, stripped = re.subn(r"e[mr]$|nd$", "", word)
+            if stripped:
+                continue
+        word, stripped = re.subn(r"[tesn]$", "", word)
+        if not stripped:
+            break
+    word = re.sub(r"(.)\*", r"\1\1", word)
+    return word.replace("&", "ie").replace("%", "ei").replace("$", "sch")
+
+
+def max_edit_distance(length):
+    """
+    Typos tolerated in a stem of length characters. Short stems tolerate
+    none: one edit turns "wahl" (of "Wähler") into "zahl" or "wahr".
+    """
+    if length < 5:
+        return 0
+    if length < 12:
+        return 1
+    return 2
+
+
+def _deletes(word, distance):
+    """word and all strings created by deleting up to distance characters."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {
+            variant[:position] + variant[position + 1 :]
+            for variant in frontier
+            for position in range(len(variant))
+        }
+        variants |= frontier
+    return variants
+
+
+def _variant_hash(variant):
+    # stable across processes, unlike hash(); collisions are filtered out by
+    # edit_distance
+    return zlib.crc32(variant.encode("utf8"))
+
+
+class SortedStrings:
+    """Membership test by binary search in a sorted (mapped) string array."""
+
+    def __init__(self, strings):
+        self.strings = strings
+
+    def __contains__(self, string):
+        position = int(np.searchsorted(self.strings, string))
+        return position < len(self.strings) and self.strings[position] == string
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def edit_distance(word, other, limit):
+    """
+    Damerau-Levenshtein distance (optimal string alignment) of two words;
+    any distance above limit is returned as limit + 1.
+    """
+    if abs(len(word) - len(other)) > limit:
+        return limit + 1
+    previous_row = before_previous_row = None
+    row = list(range(len(other) + 1))
+    for i in range(1, len(word) + 1):
+        previous_row, row = row, [i] + [0] * len(other)
+        for j in range(1, len(other) + 1):
+            cost = word[i - 1] != other[j - 1]
+            row[j] = min(
+                row[j - 1] + 1, previous_row[j] + 1, previous_row[j - 1] + cost
+            )
+            if (
+                i > 1
+                and j > 1
+                and word[i - 1] == other[j - 2]
+                and word[i - 2] == other[j - 1]
+            ):
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        before_previous_row = previous_row
+    return min(row[-1], limit + 1)
+
+
+def split_compound(word, lexicon, memo=None):
+    """
+    Splits a folded word into the fewest parts of lexicon (of at least
+    MIN_PART_LENGTH characters), allowing linking elements between them.
+
+    Returns
+    -------
+    list
+        The parts, or [word] if the word cannot be split.
+    """
+    memo = {} if memo is None else memo
+
+    def split(start):
+        if start == len(word):
+            return []
+        if start in memo:
+            return memo[start]
+        best = None
+        for end in range(len(word), start + MIN_PART_LENGTH - 1, -1):
+            part = word[start:end]
+            if part not in lexicon or end - start == len(word):
+                continue
+            for linking_element in LINKING_ELEMENTS:
+                if not word.startswith(linking_element, end):
+                    continue
+                rest = split(end + len(linking_element))
+                if rest is not None and (best is None or len(rest) + 1 < len(best)):
+                    best = [part] + rest
+        memo[start] = best
+        return best
+
+    parts = split(0)
+    return parts if parts and len(parts) > 1 else [word]
+
+
+def build_fuzzy_index(index, version=None):
+    """
+    Builds the vocabulary structures for fuzzy search over the tokens of a
+    search index (see build_search_index), as flat arrays that can be
+    written and memory-mapped, see write_fuzzy_index.
+
+    Parameters
+    ----------
+    index : dict
+    version : string
+        The corpus version, stored to detect an outdated index.
+
+    Returns
+    -------
+    dict
+        With keys version and
+        - stem_list: the sorted stems (folded and stemmed, see stem_word),
+          indexed by stem id,
+        - stem_tokens: the tokens of stem i between stem_token_offsets[i]
+          and stem_token_offsets[i + 1],
+        - part_keys: the sorted stems of compound parts; the ids of the
+          compounds containing part i are between part_offsets[i] and
+          part_offsets[i + 1] of part_stems,
+        - lexicon: the sorted folded tokens and stems compounds are split
+          into,
+        - delete_hashes, delete_stems: a symmetric-delete index, the sorted
+          hashes of all variants of each stem with up to max_edit_distance
+          characters deleted and the stem id of each variant.
+    """
+    stems = {}
+    folded_tokens = set()
+    for token in index["tokens"]:
+        stems.setdefault(stem_word(token), []).append(token)
+        if len(token) >= MIN_PART_LENGTH:
+            folded_tokens.add(fold_word(token))
+    lexicon = {stem for stem in stems if len(stem) >= MIN_PART_LENGTH}
+    lexicon |= folded_tokens
+    parts = {}
+    for stem in stems:
+        # stems are folded already
+        for part in _compound_parts(stem, lexicon, {}):
+            parts.setdefault(stem_word(part), set()).add(stem)
+    stem_list = sorted(stems)
+    stem_ids = {stem: stem_id for stem_id, stem in enumerate(stem_list)}
+    part_keys = sorted(parts)
+    delete_hashes = []
+    delete_stems = []
+    for stem_id, stem in enumerate(stem_list):
+        variants = _deletes(stem, max_edit_distance(len(stem)))
+        delete_hashes.extend(map(_variant_hash, variants))
+        delete_stems.extend([stem_id] * len(variants))
+    delete_hashes = np.array(delete_hashes, dtype=np.uint32)
+    order = np.argsort(delete_hashes, kind="stable")
+    return {
+        "version": version,
+        "stem_list": np.array(stem_list, dtype=str),
+        "stem_token_offsets": np.cumsum(
+            [0] + [len(stems[stem]) for stem in stem_list], dtype=np.int64
+        ),
+        "stem_tokens": np.array(
+            [token for stem in stem_list for token in sorted(stems[stem])], dtype=str
+        ),
+        "part_keys": np.array(part_keys, dtype=str),
+        "part_offsets": np.cumsum(
+            [0] + [len(parts[part]) for part in part_keys], dtype=np.int64
+        ),
+        "part_stems": np.array(
+            [stem_ids[stem] for part in part_keys for stem in sorted(parts[part])],
+            dtype=np.int32,
+        ),
+        "lexicon": np.array(sorted(lexicon), dtype=str),
+        "delete_hashes": delete_hashes[order],
+        "delete_stems": np.array(delete_stems, dtype=np.int32)[order],
+    }
+
+
+_ARRAYS = [
+    "stem_list",
+    "stem_token_offsets",
+    "stem_tokens",
+    "part_keys",
+    "part_offsets",
+    "part_stems",
+    "lexicon",
+    "delete_hashes",
+    "delete_stems",
+]
+
+
+def write_fuzzy_index(fuzzy_index, path):
+    """
+    Writes the index to the directory path, see
+    utils.search_index.write_array_directory.
+    """
+    write_array_directory(
+        path,
+        {array: fuzzy_index[array] for array in _ARRAYS},
+        {
+            "version": fuzzy_index["version"],
+            "format_version": FUZZY_INDEX_FORMAT_VERSION,
+        },
+    )
+
+
+def read_fuzzy_index(path, version=None, index=None):
+    """
+    Opens the memory-mapped index. If it does not exist or, with a version,
+    belongs to another corpus version, it is built from the search index
+    and written - or, without index, None is returned.
+    """
+    stored = read_array_directory(path, _ARRAYS, FUZZY_INDEX_FORMAT_VERSION, version)
+    if stored is not None:
+        meta, arrays = stored
+        return {"version": meta["version"], **arrays}
+    if index is None:
+        return None
+    fuzzy_index = build_fuzzy_index(index, version)
+    write_fuzzy_index(fuzzy_index, path)
+    return fuzzy_index
+
+
+def _lexicon(fuzzy_index):
+    return SortedStrings(fuzzy_index["lexicon"])
+
+
+def _slice(values, offsets, position):
+    return values[int(offsets[position]) : int(offsets[position + 1])]
+
+
+def stem_tokens(fuzzy_index, stem_id):
+    """The tokens of the vocabulary with stem stem_id."""
+    return _slice(
+        fuzzy_index["stem_tokens"], fuzzy_index["stem_token_offsets"], stem_id
+    ).tolist()
+
+
+def _compounds(fuzzy_index, stem):
+    # the ids of the stems of compounds containing stem
+    part_keys = fuzzy_index["part_keys"]
+    position = int(np.searchsorted(part_keys, stem))
+    if position == len(part_keys) or part_keys[position] != stem:
+        return []
+    return _slice(
+        fuzzy_index["part_stems"], fuzzy_index["part_offsets"], position
+    ).tolist()
+
+
+def _compound_parts(word, lexicon, memo):
+    # all parts of a compound, including the parts of its parts
+    parts = split_compound(word, lexicon)
+    if len(parts) == 1:
+        return []
+    found = set(parts)
+    for part in parts:
+        if part not in memo:
+            memo[part] = _compound_parts(part, lexicon, memo)
+        found.update(memo[part])
+    return found
+
+
+def similar_stems(fuzzy_index, word):
+    """
+    Returns the ids of the stems of the vocabulary within max_edit_distance
+    of the stem of word, plus of the compounds containing any of them.
+    """
+    stem = stem_word(word)
+    distance = max_edit_distance(len(stem))
+    delete_hashes = fuzzy_index["delete_hashes"]
+    variant_hashes = np.array(
+        [_variant_hash(variant) for variant in _deletes(stem, distance)],
+        dtype=np.uint32,
+    )
+    starts = np.searchsorted(delete_hashes, variant_hashes, "left")
+    ends = np.searchsorted(delete_hashes, variant_hashes, "right")
+    candidates = set()
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        candidates.update(fuzzy_index["delete_stems"][start:end].tolist())
+    stem_list = fuzzy_index["stem_list"]
+    similar = {
+        candidate
+        for candidate in candidates
+        if edit_distance(stem, str(stem_list[candidate]), distance) <= distance
+    }
+    for candidate in list(similar):
+        similar.update(_compounds(fuzzy_index, str(stem_list[candidate])))
+    return similar
+
+
+def find_fuzzy_line_ids(fuzzy_index, index, search_phrase):
+    """
+    Looks up the ids of all lines containing every word of search_phrase in
+    some form: inflected ("Klimaschutzes"), with other umlaut spellings
+    ("Waehler"), with typos, as part of a compound ("Klimaschutzgesetz"),
+    or - for a compound search word - with all its parts in the line
+    ("Gesetz zum Klimaschutz").
+
+    Returns
+    -------
+    list
+        Ascending list of line ids.
+    """
+    line_ids = None
+    for word in TOKEN_PATTERN.findall(normalize_text(search_phrase)):
+        word_line_ids = _word_line_ids(fuzzy_index, index, word)
+        line_ids = word_line_ids if line_ids is None else line_ids & word_line_ids
+        if not line_ids:
+            return []
+    return sorted(line_ids or [])
+
+
+def _word_line_ids(fuzzy_index, index, word):
+    tokens = index["tokens"]
+    word_line_ids = set()
+    for stem_id in similar_stems(fuzzy_index, word):
+        for token in stem_tokens(fuzzy_index, stem_id):
+            word_line_ids.update(tokens.get(token, []))
+    parts = split_compound(fold_word(word), _lexicon(fuzzy_index))
+    if len(parts) > 1:
+        part_line_ids = None
+        for part in parts:
+            part_line_ids = (
+                _word_line_ids(fuzzy_index, index, part)
+                if part_line_ids is None
+                else part_line_ids & _word_line_ids(fuzzy_index, index, part)
+            )
+        word_line_ids |= part_line_ids
+    return word_line_ids
+
+
+def fuzzy_highlight_pattern_source(search_phrase):
+    """
+    Returns a regular expression (source) matching the words of
+    search_phrase with any umlaut spelling and inflection, for highlighting
+    fuzzy matches; typos are not covered.
+    """
+    alternatives = {"a": "(?:ä|ae|a)", "o": "(?:ö|oe|o)", "u": "(?:ü|ue|u)"}
+    words = []
+    for word in TOKEN_PATTERN.findall(normalize_text(search_phrase)):
+        stem = stem_word(word)
+        if not stem:
+            continue
+        pattern = re.escape(stem).replace("ss", "(?:ß|ss)")
+        pattern = "".join(
+            alternatives.get(character, character) for character in pattern
+        )
+        words.append(r"\w*" + pattern + r"\w*")
+    return "|".join(words)
@@ -0,0 +1,550 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import fitz
+import requests
+
+from utils.corpus_registry import (
+    DEFAULT_CORPORA_DIR,
+    corpus_paths,
+    read_corpus_manifests,
+    select_manifest,
+)
+from utils.corpus_store import open_corpus, write_corpus
+from utils.doc_handler import store_docs_as_json
+from utils.doc_structure import build_structure, page_layout, write_structure
+from utils.fuzzy_index import build_fuzzy_index, write_fuzzy_index
+from utils.phrase_index import write_phrase_index
+from utils.search_index import build_search_index, write_search_index
+from utils.semantic_index import build_semantic_index, write_semantic_index
+from utils.term_matrix import build_term_matrix, write_term_matrix
+
+
+def asset_file_name(asset_name):
+    return asset_name.replace("/", "-")
+
+
+def fetch_from_web(asset_name, asset_link, validators=None, timeout=60):
+    """
+    Downloads asset_link. If validators from a previous download are given,
+    the request is conditional.
+
+    Returns
+    -------
+    tuple
+        (content, validators); content is None if the document has not been
+        modified since validators were recorded.
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    response = requests.get(asset_link, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return None, validators
+    response.raise_for_status()
+    return response.content, {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def directory_fetcher(directory):
+    """
+    Creates a fetch function reading <asset_name>.pdf from a local directory
+    instead of downloading asset_link ("/" in asset names is replaced by "-").
+    The file's modification time serves as validator.
+    """
+
+    def fetch_from_directory(asset_name, asset_link, validators=None):
+        file_path = os.path.join(directory, f"{asset_file_name(asset_name)}.pdf")
+        file_validators = {
+            "etag": None,
+            "last_modified": str(os.stat(file_path).st_mtime_ns),
+        }
+        if validators == file_validators:
+            return None, validators
+        with open(file_path, "rb") as pdf_file:
+            return pdf_file.read(), file_validators
+
+    return fetch_from_directory
+
+
+_REFERENCE_PATTERN = re.compile(r"(\d+) 0 R")
+
+
+def _page_resources(page):
+    """Returns the resources of page, which may be inherited from the page tree."""
+    doc = page.parent
+    xref = page.xref
+    while True:
+        kind, resources = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return resources
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            return ""
+        xref = int(parent.split()[0])
+
+
+def page_hash(page):
+    """
+    Hashes everything the layout of page is extracted from: its geometry,
+    content streams and the objects its resources refer to (fonts with their
+    encodings and ToUnicode maps, form XObjects, images).
+    """
+    doc = page.parent
+    digest = hashlib.sha256()
+    digest.update(
+        repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode()
+    )
+    digest.update(page.read_contents())
+    resources = _page_resources(page)
+    digest.update(resources.encode())
+    pending = [resources]
+    seen = set()
+    while pending:
+        for reference in _REFERENCE_PATTERN.findall(pending.pop()):
+            xref = int(reference)
+            if xref in seen:
+                continue
+            seen.add(xref)
+            # annotations and the like may refer back to the page tree
+            if doc.xref_get_key(xref, "Type")[1] in ("/Page", "/Pages"):
+                continue
+            source = doc.xref_object(xref, compressed=True)
+            digest.update(source.encode())
+            if doc.xref_is_stream(xref):
+                digest.update(doc.xref_stream_raw(xref))
+            pending.append(source)
+    return digest.hexdigest()
+
+
+def extract_pages(pdf_bytes):
+    """
+    Parses a PDF from memory into the layout of each page: its lines, body
+    font size and the fonts of lines set differently, see
+    utils.doc_structure.page_layout.
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [page_layout(page.get_text("dict")) for page in doc]
+
+
+def extract_changed_pages(pdf_bytes, known_page_hashes=()):
+    """
+    Hashes every page (see page_hash) and extracts the layout (see
+    extract_pages) of those pages only whose hash is not in
+    known_page_hashes.
+
+    Returns
+    -------
+    list
+        One (page_hash, layout) tuple per page; layout is None for known
+        pages.
+    """
+    known_page_hashes = set(known_page_hashes)
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page in doc:
+            content_hash = page_hash(page)
+            if content_hash in known_page_hashes:
+                pages.append((content_hash, None))
+            else:
+                pages.append((content_hash, page_layout(page.get_text("dict"))))
+    return pages
+
+
+def fetch_and_parse_docs(doc_dict, **kwargs):
+    """
+    Downloads and parses all docs, see fetch_and_parse_pages.
+
+    Returns
+    -------
+    dict
+        A dict with doc_name as key, in the order of doc_dict. Contains a
+        nested dict of structure line_number: line_text.
+    """
+    return {
+        asset_name: dict(enumerate(_page_lines(pages)))
+        for asset_name, pages in fetch_and_parse_pages(doc_dict, **kwargs).items()
+    }
+
+
+def _page_lines(pages):
+    return [line_text for page in pages for line_text in page["lines"]]
+
+
+def fetch_and_parse_pages(
+    doc_dict, fetch=fetch_from_web, download_workers=8, parse_workers=None
+):
+    """
+    Downloads all docs concurrently in a thread pool and extracts the layout
+    of their pages (see extract_pages) in a process pool as soon as each
+    download has finished.
+
+    Parameters
+    ----------
+    doc_dict : dict
+        A dict of structure doc_name: doc_link.
+    fetch : callable
+        Called as fetch(doc_name, doc_link) and returning a tuple of the PDF
+        bytes and their validators, see fetch_from_web.
+    download_workers : int
+    parse_workers : int
+        Defaults to the number of CPUs.
+
+    Returns
+    -------
+    dict
+        A dict with doc_name as key, in the order of doc_dict. Contains a
+        list of page layouts.
+    """
+    parsed = {}
+    with ThreadPoolExecutor(max_workers=download_workers) as download_pool:
+        with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool:
+            downloads = {
+                download_pool.submit(fetch, asset_name, asset_link): asset_name
+                for asset_name, asset_link in doc_dict.items()
+            }
+            extractions = {}
+            for download in as_completed(downloads):
+                pdf_bytes, _ = download.result()
+                extraction = parse_pool.submit(extract_pages, pdf_bytes)
+                extractions[extraction] = downloads[download]
+            for extraction in as_completed(extractions):
+                parsed[extractions[extraction]] = extraction.result()
+    return {asset_name: parsed[asset_name] for asset_name in doc_dict}
+
+
+def read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(manifest, manifest_path):
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(manifest_path) or ".",
+        prefix=os.path.basename(manifest_path) + ".",
+        suffix=".tmp",
+    )
+    # mkstemp creates the file readable by its owner only
+    os.chmod(tmp_path, 0o644)
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _old_page_layouts(old_lines, old_entry):
+    """Maps page hashes of the previous ingestion to their layouts."""
+    page_layouts = {}
+    line_number = 0
+    for page in old_entry.get("pages", []):
+        page_layouts[page["hash"]] = {
+            "lines": old_lines[line_number : line_number + page["line_count"]],
+            "body_size": page.get("body_size"),
+            "fonts": page.get("fonts"),
+        }
+        line_number += page["line_count"]
+    return page_layouts
+
+
+def _has_fonts(entry):
+    # docs ingested before fonts were recorded are parsed again
+    return all("fonts" in page for page in entry.get("pages", []))
+
+
+def refresh_docs(
+    doc_dict,
+    corpus_path,
+    manifest_path,
+    fetch=fetch_from_web,
+    download_workers=8,
+    parse_workers=None,
+):
+    """
+    Incrementally (re-)ingests all docs into corpus_path. The manifest keeps
+    per doc the validators (ETag / Last-Modified) of the last download, a
+    hash of the PDF bytes and per page a hash, its line count and the fonts
+    headings are detected from (see utils.doc_structure). Unmodified
+    documents are taken over from the existing corpus file; for modified
+    documents, only pages with unknown content hashes are re-extracted.
+
+    Returns
+    -------
+    dict
+        With keys version (the corpus version), changed (names of re-parsed
+        docs) and unchanged.
+    """
+    manifest = read_manifest(manifest_path)
+    old_docs = {}
+    if os.path.exists(corpus_path):
+        old_corpus = open_corpus(corpus_path)
+        old_docs = {
+            asset_name: list(asset_content.values())
+            for asset_name, asset_content in old_corpus.items()
+        }
+        old_corpus.close()
+
+    new_manifest = {}
+    new_docs = {}
+    changed = []
+    with ThreadPoolExecutor(max_workers=download_workers) as download_pool:
+        with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool:
+            downloads = {}
+            for asset_name, asset_link in doc_dict.items():
+                old_entry = manifest.get(asset_name, {})
+                validators = None
+                if (
+                    old_entry.get("link") == asset_link
+                    and asset_name in old_docs
+                    and _has_fonts(old_entry)
+                ):
+                    validators = old_entry.get("validators")
+                download = download_pool.submit(
+                    fetch, asset_name, asset_link, validators
+                )
+                downloads[download] = asset_name
+
+            extractions = {}
+            for download in as_completed(downloads):
+                asset_name = downloads[download]
+                old_entry = manifest.get(asset_name, {})
+                pdf_bytes, validators = download.result()
+                if pdf_bytes is None:
+                    new_manifest[asset_name] = old_entry
+                    new_docs[asset_name] = old_docs[asset_name]
+                    continue
+                source_hash = hashlib.sha256(pdf_bytes).hexdigest()
+                entry = dict(
+                    link=doc_dict[asset_name],
+                    validators=validators,
+                    source_sha256=source_hash,
+                )
+                if (
+                    old_entry.get("source_sha256") == source_hash
+                    and asset_name in old_docs
+                    and _has_fonts(old_entry)
+                ):
+                    new_manifest[asset_name] = dict(old_entry, **entry)
+                    new_docs[asset_name] = old_docs[asset_name]
+                    continue
+                new_manifest[asset_name] = entry
+                known_page_hashes = []
+                if asset_name in old_docs:
+                    known_page_hashes = [
+                        page["hash"]
+                        for page in old_entry.get("pages", [])
+                        if "fonts" in page
+                    ]
+                extraction = parse_pool.submit(
+                    extract_changed_pages, pdf_bytes, known_page_hashes
+                )
+                extractions[extraction] = asset_name
+
+            for extraction in as_completed(extractions):
+                asset_name = extractions[extraction]
+                old_page_layouts = _old_page_layouts(
+                    old_docs.get(asset_name, []), manifest.get(asset_name, {})
+                )
+                lines = []
+                pages = []
+                for content_hash, layout in extraction.result():
+                    if layout is None:
+                        layout = old_page_layouts[content_hash]
+                    lines.extend(layout["lines"])
+                    pages.append(
+                        {
+                            "hash": content_hash,
+                            "line_count": len(layout["lines"]),
+                            "body_size": layout["body_size"],
+                            "fonts": layout["fonts"],
+                        }
+                    )
+                new_manifest[asset_name]["pages"] = pages
+                new_docs[asset_name] = lines
+                changed.append(asset_name)
+
+    corpus_version = None
+    if changed or list(old_docs) != list(doc_dict):
+        corpus_version = write_corpus(
+            {
+                asset_name: dict(enumerate(new_docs[asset_name]))
+                for asset_name in doc_dict
+            },
+            corpus_path,
+        )
+    else:
+        corpus = open_corpus(corpus_path)
+        corpus_version = corpus.version
+        corpus.close()
+    write_manifest(new_manifest, manifest_path)
+    return {
+        "version": corpus_version,
+        "changed": [asset_name for asset_name in doc_dict if asset_name in changed],
+        "unchanged": [
+            asset_name for asset_name in doc_dict if asset_name not in changed
+        ],
+    }
+
+
+def ingest_docs(
+    doc_dict,
+    corpus_path,
+    json_path=None,
+    manifest_path=None,
+    search_index_path=None,
+    phrase_index_path=None,
+    fuzzy_index_path=None,
+    term_matrix_path=None,
+    semantic_index_path=None,
+    structure_path=None,
+    **kwargs,
+):
+    """
+    Fetches and parses all docs and writes the corpus file consumed by the
+    app, plus optionally the json file, the search index, the phrase index,
+    the fuzzy index, the term matrix and the semantic index derived from it,
+    and the structure index of pages and headings (see utils.doc_structure).
+    With a manifest_path, only documents and pages changed since the last
+    run are parsed again, see refresh_docs.
+
+    Returns
+    -------
+    string
+        The corpus version.
+    """
+    if manifest_path:
+        corpus_version = refresh_docs(doc_dict, corpus_path, manifest_path, **kwargs)[
+            "version"
+        ]
+        docs_pages = {
+            asset_name: entry.get("pages", [])
+            for asset_name, entry in read_manifest(manifest_path).items()
+        }
+    else:
+        docs_pages = fetch_and_parse_pages(doc_dict, **kwargs)
+        corpus_version = write_corpus(
+            {
+                asset_name: dict(enumerate(_page_lines(pages)))
+                for asset_name, pages in docs_pages.items()
+            },
+            corpus_path,
+        )
+        for pages in docs_pages.values():
+            for page in pages:
+                page["line_count"] = len(page.pop("lines"))
+    corpus = open_corpus(corpus_path)
+    if json_path:
+        store_docs_as_json(
+            {asset_name: dict(content) for asset_name, content in corpus.items()},
+            json_path,
+        )
+    if search_index_path or fuzzy_index_path:
+        search_index = build_search_index(corpus, version=corpus.version)
+        if search_index_path:
+            write_search_index(search_index, search_index_path)
+        if fuzzy_index_path:
+            write_fuzzy_index(
+                build_fuzzy_index(search_index, corpus.version), fuzzy_index_path
+            )
+    if phrase_index_path:
+        write_phrase_index(corpus, phrase_index_path)
+    if term_matrix_path:
+        write_term_matrix(build_term_matrix(corpus, corpus.version), term_matrix_path)
+    if structure_path:
+        write_structure(
+            build_structure(docs_pages, corpus, corpus.version), structure_path
+        )
+    if semantic_index_path:
+        write_semantic_index(
+            build_semantic_index(corpus, corpus.version), semantic_index_path
+        )
+    corpus.close()
+    return corpus_version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download and parse the electoral programs of an election "
+        "into a corpus. The programs and, unless given, the paths of the files "
+        "are taken from the corpus manifest of the election."
+    )
+    parser.add_argument("--corpora-dir", default=DEFAULT_CORPORA_DIR)
+    parser.add_argument(
+        "--election",
+        default=None,
+        help="name of the corpus manifest; defaults to the latest election",
+    )
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--json", default=None)
+    parser.add_argument("--search-index", default=None)
+    parser.add_argument("--phrase-index", default=None)
+    parser.add_argument("--fuzzy-index", default=None)
+    parser.add_argument("--term-matrix", default=None)
+    parser.add_argument("--semantic-index", default=None)
+    parser.add_argument("--structure", default=None)
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="manifest for incremental runs; pass an empty string to parse all",
+    )
+    parser.add_argument(
+        "--source-dir",
+        default=None,
+        help="read <party>.pdf files from this directory instead of downloading",
+    )
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--parse-workers", type=int, default=None)
+    args = parser.parse_args()
+    corpus_manifest = select_manifest(
+        read_corpus_manifests(args.corpora_dir), args.election
+    )
+    paths = corpus_paths(corpus_manifest)
+    path_args = {
+        "corpus": args.corpus,
+        "search_index": args.search_index,
+        "phrase_index": args.phrase_index,
+        "fuzzy_index": args.fuzzy_index,
+        "term_matrix": args.term_matrix,
+        "semantic_index": args.semantic_index,
+        "structure": args.structure,
+        "ingest_manifest": args.manifest,
+    }
+    paths.update({kind: path for kind, path in path_args.items() if path is not None})
+    os.makedirs(os.path.dirname(paths["corpus"]) or ".", exist_ok=True)
+    if args.source_dir:
+        fetch = directory_fetcher(args.source_dir)
+    else:
+        fetch = fetch_from_web
+    corpus_version = ingest_docs(
+        corpus_manifest["docs"],
+        paths["corpus"],
+        json_path=args.json,
+        manifest_path=paths["ingest_manifest"] or None,
+        search_index_path=paths["search_index"] or None,
+        phrase_index_path=paths["phrase_index"] or None,
+        fuzzy_index_path=paths["fuzzy_index"] or None,
+        term_matrix_path=paths["term_matrix"] or None,
+        semantic_index_path=paths["semantic_index"] or None,
+        structure_path=paths["structure"] or None,
+        fetch=fetch,
+        download_workers=args.download_workers,
+        parse_workers=args.parse_workers,
+    )
+    print(
+        f"wrote {paths['corpus']} of {corpus_manifest['name']} "
+        f"(version {corpus_version})"
+    )
@@ -0,0 +1,296 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ["load", "search", "context", "analysis", "aggregate", "chart"]
+# upper bounds in seconds of the histogram buckets
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+METRIC_PREFIX = "wahlprogramm_reader"
+
+timing_logger = logging.getLogger("wahlprogramm_reader.timing")
+
+
+class StageMetrics:
+    """
+    Process-wide timing histograms per stage, plus collectors for further
+    metrics (e.g. cache hit ratios and TextRazor quota) that are evaluated
+    on export.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = list(buckets)
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._collectors = {}
+
+    def record(self, stage, name, seconds):
+        with self._lock:
+            histogram = self._stages.setdefault(
+                (stage, name),
+                {"count": 0, "sum": 0.0, "buckets": [0] * len(self.buckets)},
+            )
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            for position, upper_bound in enumerate(self.buckets):
+                if seconds <= upper_bound:
+                    histogram["buckets"][position] += 1
+
+    def register_collector(self, name, collect):
+        """
+        Registers (or replaces) a collector: a callable returning a list of
+        (metric_name, metric_type, labels, value) samples.
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors.values())
+        samples = []
+        for collect in collectors:
+            try:
+                samples.extend(collect())
+            except Exception:
+                timing_logger.exception("metrics collector failed")
+        return samples
+
+    def snapshot(self):
+        """
+        Returns
+        -------
+        dict
+            A dict of structure stage: {name: {"count", "total_ms",
+            "mean_ms"}}, name being the timed function or block.
+        """
+        snapshot = {}
+        with self._lock:
+            for (stage, name), histogram in self._stages.items():
+                snapshot.setdefault(stage, {})[name] = {
+                    "count": histogram["count"],
+                    "total_ms": histogram["sum"] * 1000,
+                    "mean_ms": histogram["sum"] * 1000 / histogram["count"],
+                }
+        return snapshot
+
+    def export(self):
+        """Returns the stage timings and the collected samples as one dict."""
+        return {
+            "stages": self.snapshot(),
+            "samples": [
+                {"name": name, "type": metric_type, "labels": labels, "value": value}
+                for name, metric_type, labels, value in self.collect()
+            ],
+        }
+
+    def render_prometheus(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent per stage.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            stages = {
+                stage: dict(histogram, buckets=list(histogram["buckets"]))
+                for stage, histogram in self._stages.items()
+            }
+        for (stage, span_name), histogram in sorted(stages.items()):
+            labels = f'stage="{stage}",name="{span_name}"'
+            for upper_bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f'{name}_bucket{{{labels},le="{upper_bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+        typed = set()
+        # samples of one metric must be grouped
+        samples = sorted(self.collect(), key=lambda sample: sample[0])
+        for sample_name, metric_type, labels, value in samples:
+            sample_name = f"{METRIC_PREFIX}_{sample_name}"
+            if sample_name not in typed:
+                lines.append(f"# TYPE {sample_name} {metric_type}")
+                typed.add(sample_name)
+            label_text = ",".join(
+                f'{label}="{label_value}"' for label, label_value in labels.items()
+            )
+            lines.append(
+                f"{sample_name}{{{label_text}}} {value}"
+                if label_text
+                else f"{sample_name} {value}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+class RerunTimings:
+    """
+    The spans of one run of the script (or one request), in the order they
+    were started; nested spans have a higher depth.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._depth = 0
+        self.started = time.perf_counter()
+
+    def enter(self, stage, name):
+        entry = {"stage": stage, "name": name, "depth": self._depth, "ms": None}
+        self.spans.append(entry)
+        self._depth += 1
+        return entry
+
+    def exit(self, entry, seconds):
+        entry["ms"] = seconds * 1000
+        self._depth -= 1
+
+    def stage_totals(self):
+        """Milliseconds per stage, counting only the outermost spans."""
+        totals = {}
+        for entry in self.spans:
+            if entry["ms"] is not None and not any(
+                outer["stage"] == entry["stage"] for outer in self._outer_spans(entry)
+            ):
+                totals[entry["stage"]] = totals.get(entry["stage"], 0) + entry["ms"]
+        return totals
+
+    def _outer_spans(self, entry):
+        position = self.spans.index(entry)
+        depth = entry["depth"]
+        for outer in reversed(self.spans[:position]):
+            if outer["depth"] < depth:
+                depth = outer["depth"]
+                yield outer
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+metrics = StageMetrics()
+_current_rerun = contextvars.ContextVar("current_rerun", default=None)
+
+
+def start_rerun():
+    """Starts collecting the spans of this run of the script (this thread)."""
+    rerun_timings = RerunTimings()
+    _current_rerun.set(rerun_timings)
+    return rerun_timings
+
+
+@contextlib.contextmanager
+def span(stage, name=None, **fields):
+    """
+    Times the enclosed block as one of STAGES. The duration is added to the
+    process-wide metrics and the current rerun's breakdown, and logged as
+    one JSON line to the wahlprogramm_reader.timing logger.
+    """
+    rerun_timings = _current_rerun.get()
+    entry = rerun_timings.enter(stage, name or stage) if rerun_timings else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.record(stage, name or stage, seconds)
+        if entry is not None:
+            rerun_timings.exit(entry, seconds)
+        if timing_logger.isEnabledFor(logging.INFO):
+            timing_logger.info(
+                json.dumps(
+                    {
+                        "event": "span",
+                        "stage": stage,
+                        "name": name or stage,
+                        "duration_ms": round(seconds * 1000, 3),
+                        **fields,
+                    },
+                    ensure_ascii=False,
+                    default=str,
+                )
+            )
+
+
+def timed(stage):
+    """Decorator timing every call of the function as a span of stage."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, function.__name__):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def configure_timing_log(path="-"):
+    """Writes the timing log to stderr ("-") or appends it to a file."""
+    if path == "-":
+        handler = logging.StreamHandler()
+    else:
+        handler = logging.FileHandler(path, encoding="utf8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_logger.addHandler(handler)
+    timing_logger.setLevel(logging.INFO)
+    timing_logger.propagate = False
+    return handler
+
+
+def cache_metrics(result_cache=None, analysis_cache=None):
+    """
+    Returns a collector exporting the hits, misses and hit ratio of a
+    ResultCache per namespace, and today's TextRazor quota usage of an
+    AnalysisCache.
+    """
+
+    def collect():
+        samples = []
+        if result_cache is not None:
+            for namespace, counts in result_cache.stats().items():
+                labels = {"namespace": namespace}
+                samples += [
+                    ("cache_hits_total", "counter", labels, counts["hits"]),
+                    ("cache_misses_total", "counter", labels, counts["misses"]),
+                    ("cache_hit_ratio", "gauge", labels, counts["hit_ratio"]),
+                ]
+        if analysis_cache is not None:
+            samples += [
+                ("textrazor_quota_used", "gauge", {}, analysis_cache.quota_used()),
+                (
+                    "textrazor_quota_remaining",
+                    "gauge",
+                    {},
+                    analysis_cache.quota_remaining(),
+                ),
+            ]
+        return samples
+
+    return collect
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=metrics):
+    """Serves registry at /metrics on port, from a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,128 @@
+import os
+import re
+
+from utils.corpus_store import open_corpus, write_corpus
+
+PHRASE_INDEX_FORMAT_VERSION = 1
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# a word broken across lines: "Klima-" followed by a line starting lowercase
+HYPHENATION_PATTERN = re.compile(r"\w-$")
+# "Klima- und Umweltschutz": the hyphen stands for the rest of the compound
+CONJUNCTIONS = {"und", "oder", "bzw", "sowie"}
+FIRST_WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_phrase(text):
+    return WHITESPACE_PATTERN.sub(" ", text).strip().lower()
+
+
+def build_stream_segments(asset_content_dict):
+    """
+    Turns the lines of a doc into segments of one normalized text stream:
+    whitespace is collapsed, text is lowercased and lines are joined by a
+    single space. Words hyphenated at the end of a line are joined with the
+    next line without the hyphen; other trailing hyphens ("CO2-" followed by
+    "Ausstoß") are kept and joined without a space, and hyphens followed by
+    a conjunction ("Klima-" followed by "und Umweltschutz") are kept and
+    joined with a space.
+
+    Returns
+    -------
+    dict
+        A dict of structure line_number: segment. Concatenating all segments
+        gives the stream, so the segments' offsets map each position of the
+        stream back to its line.
+    """
+    line_numbers = sorted(asset_content_dict)
+    segments = {}
+    for position, line_number in enumerate(line_numbers):
+        line = normalize_phrase(asset_content_dict[line_number])
+        if not line:
+            segments[line_number] = ""
+        elif HYPHENATION_PATTERN.search(line):
+            next_texts = (
+                asset_content_dict[next_number].strip()
+                for next_number in line_numbers[position + 1 :]
+            )
+            next_text = next((text for text in next_texts if text), "")
+            first_word = FIRST_WORD_PATTERN.match(next_text)
+            if first_word and first_word.group() in CONJUNCTIONS:
+                segments[line_number] = line + " "
+            elif next_text[:1].islower():
+                segments[line_number] = line[:-1]
+            else:
+                segments[line_number] = line
+        else:
+            segments[line_number] = line + " "
+    return segments
+
+
+def write_phrase_index(asset_dict, phrase_index_path):
+    """
+    Precomputes the normalized text stream of all docs and stores it in the
+    corpus format, one segment per original line, together with the version
+    of asset_dict (a corpus). Usually run at ingest time.
+
+    Returns
+    -------
+    string
+        The version of the phrase index.
+    """
+    return write_corpus(
+        {
+            asset_name: build_stream_segments(asset_content_dict)
+            for asset_name, asset_content_dict in asset_dict.items()
+        },
+        phrase_index_path,
+        metadata={
+            "corpus_version": getattr(asset_dict, "version", None),
+            "format_version": PHRASE_INDEX_FORMAT_VERSION,
+        },
+    )
+
+
+def _is_current(phrase_index, asset_dict):
+    return phrase_index.metadata == {
+        "corpus_version": getattr(asset_dict, "version", None),
+        "format_version": PHRASE_INDEX_FORMAT_VERSION,
+    }
+
+
+def read_phrase_index(phrase_index_path, asset_dict):
+    """
+    Opens the phrase index, creating it from asset_dict if it does not exist
+    or was built from another corpus version.
+    """
+    if os.path.exists(phrase_index_path):
+        phrase_index = open_corpus(phrase_index_path)
+        if _is_current(phrase_index, asset_dict):
+            return phrase_index
+        phrase_index.close()
+    write_phrase_index(asset_dict, phrase_index_path)
+    return open_corpus(phrase_index_path)
+
+
+def search_phrase_across_lines(phrase_index, asset_dict, search_phrase):
+    """
+    Searches the normalized text stream of each doc, so multi-word phrases
+    and words broken across lines are found. Keeps the substring semantics
+    of search_against_docs.
+
+    Returns
+    -------
+    dict
+        A dict with doc_name as key. Contains a nested dict of structure
+        line_number: [line_text] for the lines in which a match starts.
+    """
+    needle = normalize_phrase(search_phrase).encode("utf8")
+    asset_search_matches = {}
+    for asset_name, stream in phrase_index.items():
+        if not needle:
+            line_numbers = list(stream)
+        else:
+            line_numbers = stream.find_lines(needle)
+        asset_search_matches[asset_name] = {
+            line_number: [asset_dict[asset_name][line_number]]
+            for line_number in line_numbers
+        }
+    return asset_search_matches
@@ -0,0 +1,424 @@
+import re
+from bisect import bisect_left
+from collections import Counter
+from operator import itemgetter
+
+from utils.doc_handler import compile_highlight_pattern
+from utils.fuzzy_index import find_fuzzy_line_ids, fuzzy_highlight_pattern_source
+from utils.phrase_index import normalize_phrase
+from utils.search_index import find_line_ids, normalize_text
+
+QUERY_TOKEN_PATTERN = re.compile(r'\(|\)|~?"[^"]*"?|[^\s()"]+')
+NEAR_PATTERN = re.compile(r"^AND/(\d+)$")
+OPERATORS = {"AND", "OR", "NOT"}
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def is_plain_phrase(query):
+    """
+    True if query contains no operators, quotes, parentheses or wildcards,
+    i.e. it is searched as a single phrase like before.
+    """
+    return not any(
+        token in OPERATORS
+        or NEAR_PATTERN.match(token)
+        or token[0] in '()"~'
+        or token.endswith("*")
+        for token in QUERY_TOKEN_PATTERN.findall(query)
+    )
+
+
+def query_key(query):
+    """
+    Canonical form of a phrase or query for cache keys and sample seeds:
+    plain phrases are normalized (see normalize_phrase), so case and
+    whitespace do not matter; queries only have their whitespace collapsed,
+    as their operators are case-sensitive ("Klima AND Verkehr" is a query,
+    "klima and verkehr" a phrase).
+    """
+    if is_plain_phrase(query):
+        return normalize_phrase(query)
+    return " ".join(query.split())
+
+
+def parse_query(query):
+    """
+    Parses a search query into a tree of tuples.
+
+    Syntax
+    ------
+    Klima Verkehr       consecutive words form one phrase (substring match)
+    "Klima OR Kohle"    quotes keep operators and other characters literal
+    Klima*              prefix wildcard, matches words starting with Klima
+    ~Klimaschutz        fuzzy, matches inflections, umlaut spellings, typos
+                        and compounds (see utils.fuzzy_index); also
+                        ~"Schutz des Klimas" for all words of a phrase
+    Klima OR Kohle      lines matching either side
+    Klima AND Verkehr   lines matching both sides
+    Klima AND/3 Bahn    lines of either side with the other side at most 3
+                        lines away (in the same doc)
+    Klima NOT Kohle     lines matching the left but not the right side;
+                        also "NOT Kohle" and "Klima AND/3 NOT Kohle"
+    ( ... )             grouping; NOT binds tighter than AND, AND tighter
+                        than OR
+
+    Returns
+    -------
+    tuple
+        ("phrase", text), ("prefix", text), ("fuzzy", text), ("or", [nodes]),
+        ("and", left, right, distance) or ("not", node).
+    """
+    tokens = QUERY_TOKEN_PATTERN.findall(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def is_operand_start(token):
+        return token is not None and token != ")" and token not in ["AND", "OR"]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "OR":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        node = parse_unary()
+        while True:
+            token = peek()
+            near = NEAR_PATTERN.match(token) if token else None
+            if token == "AND" or near:
+                take()
+                node = ("and", node, parse_unary(), int(near.group(1)) if near else 0)
+            elif token == "NOT":
+                node = ("and", node, parse_unary(), 0)
+            elif is_operand_start(token):
+                # adjacent groups without operator
+                node = ("and", node, parse_unary(), 0)
+            else:
+                return node
+
+    def parse_unary():
+        token = peek()
+        if token == "NOT":
+            take()
+            return ("not", parse_unary())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise QuerySyntaxError(f"missing ) in {query!r}")
+            take()
+            return node
+        if token is None or not is_operand_start(token) or NEAR_PATTERN.match(token):
+            raise QuerySyntaxError(f"missing search term in {query!r}")
+        take()
+        if token.startswith("~"):
+            if not token.strip('~"'):
+                raise QuerySyntaxError(f"missing search term in {query!r}")
+            return ("fuzzy", token[1:].strip('"'))
+        if token.startswith('"'):
+            return ("phrase", token.strip('"'))
+        if token.endswith("*") and token.rstrip("*"):
+            return ("prefix", token.rstrip("*"))
+        words = [token]
+        while (
+            peek() is not None
+            and peek() not in OPERATORS
+            and peek()[0] not in '()"~'
+            and not peek().endswith("*")
+            and not NEAR_PATTERN.match(peek())
+        ):
+            words.append(take())
+        return ("phrase", " ".join(words))
+
+    if not tokens:
+        return ("phrase", "")
+    node = parse_or()
+    if position < len(tokens):
+        raise QuerySyntaxError(f"unexpected {tokens[position]!r} in {query!r}")
+    return node
+
+
+def query_leaves(node, positive=True):
+    """Yields (leaf, positive) for all phrase, prefix and fuzzy nodes."""
+    kind = node[0]
+    if kind in ["phrase", "prefix", "fuzzy"]:
+        yield node, positive
+    elif kind == "or":
+        for child in node[1]:
+            yield from query_leaves(child, positive)
+    elif kind == "and":
+        yield from query_leaves(node[1], positive)
+        yield from query_leaves(node[2], positive)
+    elif kind == "not":
+        yield from query_leaves(node[1], not positive)
+
+
+def compile_query_highlight_pattern(query):
+    """
+    Compiles one case-insensitive pattern for all terms a query searches
+    for (not the negated ones); plain phrases get the pattern of
+    compile_highlight_pattern.
+    """
+    if is_plain_phrase(query):
+        return compile_highlight_pattern(query)
+    try:
+        tree = parse_query(query)
+    except QuerySyntaxError:
+        return compile_highlight_pattern(query)
+    alternatives = []
+    for (kind, text), positive in query_leaves(tree):
+        if not positive or not text.split():
+            continue
+        if kind == "prefix":
+            alternatives.append(r"\b" + re.escape(text) + r"\w*")
+        elif kind == "fuzzy":
+            if fuzzy_highlight_pattern_source(text):
+                alternatives.append(fuzzy_highlight_pattern_source(text))
+        else:
+            alternatives.append(r"\s+".join(re.escape(word) for word in text.split()))
+    if not alternatives:
+        return None
+    # longer alternatives first, so the longest term is highlighted
+    alternatives.sort(key=len, reverse=True)
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+def _line_refs(line_refs, line_ids):
+    line_ids = list(line_ids)
+    if not line_ids:
+        return set()
+    if len(line_ids) == 1:
+        return {line_refs[line_ids[0]]}
+    return set(itemgetter(*line_ids)(line_refs))
+
+
+class IndexResolver:
+    """
+    Resolves query terms to sets of (doc_name, line_number) with a search
+    index, see build_search_index. Phrases keep the substring semantics of
+    search_against_docs; prefixes match the words of a line, fuzzy terms
+    the words of a line via fuzzy_index (see build_fuzzy_index), which is
+    only needed for queries with fuzzy terms.
+    """
+
+    def __init__(self, index, fuzzy_index=None):
+        self.index = index
+        self.fuzzy_index = fuzzy_index
+
+    def _fuzzy_index(self):
+        # a callable defers building the fuzzy index to the first fuzzy term
+        if callable(self.fuzzy_index):
+            self.fuzzy_index = self.fuzzy_index()
+        return self.fuzzy_index
+
+    def all_lines(self):
+        return set(self.index["line_refs"])
+
+    def resolve(self, leaves):
+        """
+        Resolves several leaves at once: short phrases, which the n-gram
+        postings cannot answer, share one scan over the lines and all
+        prefixes a range of the sorted vocabulary.
+
+        Returns
+        -------
+        dict
+            A dict of structure leaf: set of (doc_name, line_number).
+        """
+        line_refs = self.index["line_refs"]
+        resolved = {}
+        short_phrases = {}
+        prefixes = {}
+        for leaf in set(leaves):
+            kind, text = leaf
+            if kind == "prefix":
+                prefixes[leaf] = normalize_text(text)
+            elif kind == "fuzzy":
+                resolved[leaf] = _line_refs(
+                    line_refs,
+                    find_fuzzy_line_ids(self._fuzzy_index(), self.index, text),
+                )
+            elif len(normalize_text(text)) < self.index["ngram_size"]:
+                short_phrases[leaf] = normalize_text(text)
+            else:
+                resolved[leaf] = _line_refs(line_refs, find_line_ids(self.index, text))
+        if short_phrases:
+            for leaf in short_phrases:
+                resolved[leaf] = set()
+            for line_id, line in enumerate(self.index["lines"]):
+                for leaf, phrase in short_phrases.items():
+                    if phrase in line:
+                        resolved[leaf].add(line_refs[line_id])
+        if prefixes:
+            for leaf, prefix in prefixes.items():
+                line_ids = set()
+                for _, postings in self.index["tokens"].with_prefix(prefix):
+                    line_ids.update(postings)
+                resolved[leaf] = _line_refs(line_refs, line_ids)
+        return resolved
+
+
+class PhraseIndexResolver(IndexResolver):
+    """
+    Like IndexResolver, but phrases are searched in the normalized text
+    stream (see utils.phrase_index), so they match across line breaks.
+    """
+
+    def __init__(self, index, phrase_index, fuzzy_index=None):
+        super().__init__(index, fuzzy_index)
+        self.phrase_index = phrase_index
+
+    def resolve(self, leaves):
+        leaves = set(leaves)
+        phrases = {leaf for leaf in leaves if leaf[0] == "phrase"}
+        resolved = super().resolve(leaves - phrases)
+        for leaf in phrases:
+            needle = normalize_phrase(leaf[1]).encode("utf8")
+            resolved[leaf] = {
+                (asset_name, line_number)
+                for asset_name, stream in self.phrase_index.items()
+                for line_number in (stream.find_lines(needle) if needle else stream)
+            }
+        return resolved
+
+
+def _near(lines, other_lines, distance):
+    """Returns the lines with at least one of other_lines within distance."""
+    by_doc = {}
+    for asset_name, line_number in other_lines:
+        by_doc.setdefault(asset_name, []).append(line_number)
+    for line_numbers in by_doc.values():
+        line_numbers.sort()
+    near = set()
+    for asset_name, line_number in lines:
+        line_numbers = by_doc.get(asset_name)
+        if not line_numbers:
+            continue
+        position = bisect_left(line_numbers, line_number - distance)
+        if position < len(line_numbers) and line_numbers[position] <= (
+            line_number + distance
+        ):
+            near.add((asset_name, line_number))
+    return near
+
+
+def evaluate_query(node, resolved, universe):
+    """
+    Evaluates a parsed query on the resolved leaves.
+
+    Parameters
+    ----------
+    node : tuple
+        See parse_query.
+    resolved : dict
+        A dict of structure leaf: set of (doc_name, line_number).
+    universe : callable
+        Returns the set of all lines; only called for a standalone NOT.
+
+    Returns
+    -------
+    set
+        The matching (doc_name, line_number).
+    """
+    kind = node[0]
+    if kind in ["phrase", "prefix", "fuzzy"]:
+        return resolved[node]
+    if kind == "or":
+        lines = set()
+        for child in node[1]:
+            lines |= evaluate_query(child, resolved, universe)
+        return lines
+    if kind == "not":
+        return universe() - evaluate_query(node[1], resolved, universe)
+    _, left, right, distance = node
+    left_lines = evaluate_query(left, resolved, universe)
+    if right[0] == "not":
+        excluded = evaluate_query(right[1], resolved, universe)
+        if distance == 0:
+            return left_lines - excluded
+        return left_lines - _near(left_lines, excluded, distance)
+    right_lines = evaluate_query(right, resolved, universe)
+    if distance == 0:
+        return left_lines & right_lines
+    return _near(left_lines, right_lines, distance) | _near(
+        right_lines, left_lines, distance
+    )
+
+
+def evaluate_queries(resolver, queries):
+    """
+    Evaluates several queries in one pass: all distinct terms of all
+    queries are resolved together, each only once.
+
+    Returns
+    -------
+    dict
+        A dict of structure query: set of (doc_name, line_number).
+    """
+    trees = {query: parse_query(query) for query in queries}
+    leaves = {leaf for tree in trees.values() for leaf, _ in query_leaves(tree)}
+    resolved = resolver.resolve(leaves)
+    universe_lines = []
+
+    def universe():
+        if not universe_lines:
+            universe_lines.append(resolver.all_lines())
+        return universe_lines[0]
+
+    return {
+        query: evaluate_query(tree, resolved, universe) for query, tree in trees.items()
+    }
+
+
+def search_queries(resolver, asset_dict, queries):
+    """
+    Batch counterpart of search_against_index for queries.
+
+    Returns
+    -------
+    dict
+        A dict of structure query: matches, matches being a dict with
+        doc_name as key containing a nested dict of structure line_number:
+        [line_text] for lines matching the query.
+    """
+    results = {}
+    for query, lines in evaluate_queries(resolver, queries).items():
+        asset_search_matches = {asset_name: {} for asset_name in asset_dict}
+        for asset_name, line_number in sorted(lines):
+            asset_search_matches[asset_name][line_number] = [
+                asset_dict[asset_name][line_number]
+            ]
+        results[query] = asset_search_matches
+    return results
+
+
+def search_query(resolver, asset_dict, query):
+    return search_queries(resolver, asset_dict, [query])[query]
+
+
+def count_queries(resolver, queries, asset_names):
+    """
+    Counts the matching lines of each query per doc.
+
+    Returns
+    -------
+    dict
+        A dict of structure doc_name: {query: line_count}.
+    """
+    counts = {asset_name: dict.fromkeys(queries, 0) for asset_name in asset_names}
+    for query, lines in evaluate_queries(resolver, queries).items():
+        for asset_name, count in Counter(map(itemgetter(0), lines)).items():
+            counts[asset_name][query] = count
+    return counts
@@ -0,0 +1,237 @@
+import math
+import re
+
+from utils.doc_handler import render_snippet_markdown
+from utils.fuzzy_index import fuzzy_highlight_pattern_source
+from utils.query import (
+    QuerySyntaxError,
+    compile_query_highlight_pattern,
+    is_plain_phrase,
+    parse_query,
+    query_leaves,
+)
+from utils.search_index import TOKEN_PATTERN, normalize_text, tokenize
+
+DEFAULT_PAGE_SIZE = 10
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class UnknownMatchError(KeyError):
+    pass
+
+
+def query_terms(search_phrase):
+    """
+    The terms a query is ranked by: each word of its phrases, each prefix
+    and each fuzzy phrase, without the negated ones.
+
+    Returns
+    -------
+    dict
+        A dict of structure leaf: compiled pattern; leaves as in
+        utils.query.query_leaves, so IndexResolver.resolve can look up their
+        lines.
+    """
+    if is_plain_phrase(search_phrase):
+        leaves = [("phrase", search_phrase)]
+    else:
+        try:
+            tree = parse_query(search_phrase)
+        except QuerySyntaxError:
+            tree = ("phrase", search_phrase)
+        leaves = [leaf for leaf, positive in query_leaves(tree) if positive]
+    terms = {}
+    for kind, text in leaves:
+        if kind == "prefix" and text.strip():
+            source = r"\b" + re.escape(text.strip()) + r"\w*"
+            terms[kind, normalize_text(text.strip())] = source
+        elif kind == "fuzzy" and fuzzy_highlight_pattern_source(text):
+            terms[kind, text] = fuzzy_highlight_pattern_source(text)
+        elif kind == "phrase":
+            for word in tokenize(text):
+                terms["phrase", word] = re.escape(word)
+    return {leaf: re.compile(source, re.IGNORECASE) for leaf, source in terms.items()}
+
+
+def bm25_scores(
+    snippets, terms, document_frequencies=None, line_count=None, k1=1.2, b=0.75
+):
+    """
+    Scores each snippet with BM25, treating the snippet as document: the
+    score sums over the terms of the query (see query_terms) their
+    occurrences in the snippet, saturated and normalized by the number of
+    tokens of the snippet, weighted by their IDF.
+
+    Parameters
+    ----------
+    snippets : list
+    terms : dict
+        A dict of structure term: compiled pattern.
+    document_frequencies : dict
+        A dict of structure term: number of lines of the corpus containing
+        it, and line_count the number of lines of the corpus. Without them,
+        the IDF is taken over the snippets.
+    """
+    lengths = [len(TOKEN_PATTERN.findall(snippet["text"])) for snippet in snippets]
+    average_length = sum(lengths) / len(lengths) if lengths else 0
+    scores = [0.0] * len(snippets)
+    for term, pattern in terms.items():
+        term_frequencies = [
+            len(pattern.findall(snippet["text"])) for snippet in snippets
+        ]
+        if document_frequencies is None:
+            document_count = len(snippets)
+            containing = sum(1 for tf in term_frequencies if tf)
+        else:
+            document_count = line_count
+            containing = document_frequencies.get(term, 0)
+        idf = math.log((document_count - containing + 0.5) / (containing + 0.5) + 1)
+        for position, (tf, length) in enumerate(zip(term_frequencies, lengths)):
+            scores[position] += (
+                idf
+                * tf
+                * (k1 + 1)
+                / (tf + k1 * (1 - b + b * length / (average_length or 1)))
+            )
+    return scores
+
+
+def density_scores(snippets, highlight_pattern):
+    """Scores each snippet by the occurrences of the phrase per line."""
+    return [
+        (len(highlight_pattern.findall(snippet["text"])) if highlight_pattern else 0)
+        / max(snippet["line_end"] - snippet["line_start"], 1)
+        for snippet in snippets
+    ]
+
+
+def _snippet_by_match(snippets):
+    return {nr: snippet for snippet in snippets for nr in snippet["match_nrs"]}
+
+
+def _cursor_position(cursor):
+    if not cursor:
+        return 0
+    if not str(cursor).isdecimal():
+        raise InvalidCursorError(f"invalid cursor {cursor}")
+    return int(cursor)
+
+
+class RankedMatches:
+    """
+    Ranked, paginated view on the match snippets of one doc, as created by
+    extract_match_contexts (ideally with render_markdown=False). Scores and
+    order are computed when it is created and not changed afterwards, so
+    one instance can be shared by all threads; markdown is only rendered
+    for the snippets of the pages actually requested, on copies.
+
+    Parameters
+    ----------
+    snippets : list
+    search_phrase : string
+    scoring : string
+        "bm25" (see bm25_scores) or "density" (see density_scores).
+    document_frequencies : dict
+    line_count : int
+        The corpus statistics of the terms of search_phrase, see
+        bm25_scores.
+    """
+
+    def __init__(
+        self,
+        snippets,
+        search_phrase,
+        scoring="bm25",
+        document_frequencies=None,
+        line_count=None,
+    ):
+        self.snippets = snippets
+        self.search_phrase = search_phrase
+        self.scoring = scoring
+        if scoring == "bm25":
+            scores = bm25_scores(
+                snippets,
+                query_terms(search_phrase),
+                document_frequencies,
+                line_count,
+            )
+        else:
+            scores = density_scores(snippets, self.highlight_pattern)
+        for snippet, score in zip(snippets, scores):
+            snippet["score"] = score
+        # ties keep the order of the doc
+        self._order = sorted(
+            range(len(snippets)), key=lambda position: -scores[position]
+        )
+        self._snippet_by_match = _snippet_by_match(snippets)
+
+    def to_json(self):
+        """The snippets with their scores and the order, see from_json."""
+        return {
+            "snippets": self.snippets,
+            "search_phrase": self.search_phrase,
+            "scoring": self.scoring,
+            "order": self._order,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """Restores a RankedMatches from to_json without scoring again."""
+        ranked_matches = cls.__new__(cls)
+        ranked_matches.snippets = data["snippets"]
+        ranked_matches.search_phrase = data["search_phrase"]
+        ranked_matches.scoring = data["scoring"]
+        ranked_matches._order = data["order"]
+        ranked_matches._snippet_by_match = _snippet_by_match(data["snippets"])
+        return ranked_matches
+
+    def __len__(self):
+        return len(self.snippets)
+
+    @property
+    def highlight_pattern(self):
+        return compile_query_highlight_pattern(self.search_phrase)
+
+    def _rendered(self, snippet, highlight_pattern):
+        if "markdown" in snippet:
+            return snippet
+        return render_snippet_markdown(dict(snippet), highlight_pattern)
+
+    def page(self, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Returns one page of snippets, best first.
+
+        Parameters
+        ----------
+        cursor : string
+            None for the first page, else the cursor returned with the
+            previous page.
+        page_size : int
+
+        Returns
+        -------
+        tuple
+            (snippets, next_cursor); next_cursor is None on the last page.
+            Raises InvalidCursorError for cursors not returned by page.
+        """
+        start = _cursor_position(cursor)
+        order = self._order
+        end = min(start + page_size, len(order))
+        highlight_pattern = self.highlight_pattern
+        page_snippets = [
+            self._rendered(self.snippets[position], highlight_pattern)
+            for position in order[start:end]
+        ]
+        return page_snippets, (str(end) if end < len(order) else None)
+
+    def snippet_for_match(self, match_nr):
+        """
+        Returns the (rendered) snippet containing the match match_nr; raises
+        UnknownMatchError if there is no such match.
+        """
+        if match_nr not in self._snippet_by_match:
+            raise UnknownMatchError(match_nr)
+        return self._rendered(self._snippet_by_match[match_nr], self.highlight_pattern)
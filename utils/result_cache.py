@@ -0,0 +1,244 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULT_CACHE_PATH = ".cache/results.sqlite"
+# marks a dict with int keys (line and match numbers) in stored results
+INT_KEYS = "__int_keys__"
+
+
+def result_cache_key(namespace, *key_parts):
+    key_source = json.dumps(key_parts, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{namespace}:{hashlib.sha1(key_source.encode('utf8')).hexdigest()}"
+
+
+def _tagged(value):
+    if isinstance(value, dict):
+        if value and all(isinstance(key, int) for key in value):
+            return {INT_KEYS: [[key, _tagged(item)] for key, item in value.items()]}
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("result dicts need str or int keys")
+        return {key: _tagged(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_tagged(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _untagged(data):
+    if len(data) == 1 and INT_KEYS in data:
+        return {key: item for key, item in data[INT_KEYS]}
+    return data
+
+
+def encode_result(value):
+    """
+    Encodes a result as JSON (bytes). Besides JSON types, dicts with int
+    keys, tuples (decoded as lists) and numpy scalars and arrays (decoded
+    as numbers and lists) are supported.
+    """
+    return json.dumps(_tagged(value), ensure_ascii=False).encode("utf8")
+
+
+def decode_result(data):
+    return json.loads(data, object_hook=_untagged)
+
+
+class SqliteResultStore:
+    """
+    Result store in a local sqlite file, shared by all processes using the
+    same file. Beyond max_entries the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, db_path=DEFAULT_RESULT_CACHE_PATH, max_entries=20000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value BLOB, accessed REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def get(self, key):
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0]
+
+    def put(self, key, value):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results "
+                "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class RedisResultStore:
+    """
+    Result store on a Redis-compatible server. Bounding the memory is left
+    to the server (maxmemory with an LRU policy); entries expire after ttl
+    seconds.
+    """
+
+    def __init__(self, url, ttl=7 * 24 * 3600, prefix="wahlprogramm_reader:"):
+        # optional dependency, only needed with a RESULT_CACHE_URL
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def put(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+
+class ResultCache:
+    """
+    Two-level cache for computed results such as search matches and chart
+    figures: a small in-process LRU in front of a store shared across
+    sessions and workers (SqliteResultStore or RedisResultStore). Hits and
+    misses are counted per namespace.
+    """
+
+    def __init__(self, store=None, memory_entries=256):
+        self.store = store
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def _count(self, counter, key):
+        namespace = key.split(":", 1)[0]
+        with self._lock:
+            counter[namespace] = counter.get(namespace, 0) + 1
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_or_compute(self, key, compute, encode=None, decode=None):
+        """
+        Returns the cached result for key (see result_cache_key) or computes,
+        stores and returns it. The store holds results as JSON, see
+        encode_result; encode and decode convert other results (such as
+        RankedMatches) to and from JSON-serializable values. If the store
+        fails, the result is computed and only kept in memory.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                value = self._memory[key]
+                found = True
+            else:
+                found = False
+        if found:
+            self._count(self.hits, key)
+            return value
+        if self.store is not None:
+            value = self._load(key, decode)
+            if value is not None:
+                self._remember(key, value)
+                self._count(self.hits, key)
+                return value
+        self._count(self.misses, key)
+        value = compute()
+        self._remember(key, value)
+        if self.store is not None:
+            self._save(key, value, encode)
+        return value
+
+    def _load(self, key, decode):
+        try:
+            stored = self.store.get(key)
+        except Exception:
+            logger.warning("result store failed to get %s", key, exc_info=True)
+            return None
+        if stored is None:
+            return None
+        try:
+            value = decode_result(stored)
+        except (TypeError, ValueError):
+            # written by an older version
+            return None
+        return decode(value) if decode else value
+
+    def _save(self, key, value, encode):
+        try:
+            self.store.put(key, encode_result(encode(value) if encode else value))
+        except Exception:
+            logger.warning("result store failed to put %s", key, exc_info=True)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        dict
+            A dict of structure namespace: {"hits", "misses", "hit_ratio"}.
+        """
+        with self._lock:
+            namespaces = set(self.hits) | set(self.misses)
+            return {
+                namespace: {
+                    "hits": self.hits.get(namespace, 0),
+                    "misses": self.misses.get(namespace, 0),
+                    "hit_ratio": self.hits.get(namespace, 0)
+                    / (self.hits.get(namespace, 0) + self.misses.get(namespace, 0)),
+                }
+                for namespace in namespaces
+            }
+
+
+def create_result_cache(url=None, **kwargs):
+    """
+    Creates a ResultCache backed by Redis if url is given (redis://...),
+    else by the local sqlite store.
+    """
+    if url:
+        return ResultCache(RedisResultStore(url), **kwargs)
+    return ResultCache(SqliteResultStore(), **kwargs)
@@ -0,0 +1,118 @@
+import hashlib
+import random
+
+SAMPLING_MODES = ["random", "stratified"]
+DEFAULT_SECTION_COUNT = 10
+
+
+def sample_seed(*key_parts):
+    """
+    Derives a seed from e.g. (corpus version, party, search phrase), so all
+    users sampling the same matches get the same sample - and therefore the
+    same, shared cached analyses.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for key_part in key_parts:
+        digest.update(str(key_part).encode("utf8") + b"\0")
+    return int.from_bytes(digest.digest(), "big")
+
+
+def positional_sections(
+    match_lines, line_range=None, section_count=DEFAULT_SECTION_COUNT
+):
+    """
+    Assigns each match line to one of section_count equally long stretches
+    of the doc; a stand-in for the sections of a program where its headings
+    are unknown.
+
+    Parameters
+    ----------
+    match_lines : list
+    line_range : tuple
+        (first_line, last_line) of the doc; defaults to the first and last
+        match.
+    section_count : int
+
+    Returns
+    -------
+    list
+        The section of each line of match_lines.
+    """
+    if not match_lines:
+        return []
+    first_line, last_line = line_range or (min(match_lines), max(match_lines))
+    span = last_line - first_line + 1
+    return [
+        (line_number - first_line) * section_count // span
+        for line_number in match_lines
+    ]
+
+
+def sample_order(match_count, seed):
+    """
+    Returns all match_nrs in a random order determined by seed. Each prefix
+    is a uniform sample, and a larger sample contains every smaller one.
+    """
+    match_nrs = list(range(match_count))
+    random.Random(seed).shuffle(match_nrs)
+    return match_nrs
+
+
+def stratified_order(sections, seed):
+    """
+    Orders the matches so each prefix spreads over the sections: one match
+    per section in turn, the sections and the matches within each section
+    in a random order determined by seed.
+
+    Parameters
+    ----------
+    sections : list
+        The section of each match, indexed by match_nr.
+
+    Returns
+    -------
+    list
+        All match_nrs.
+    """
+    rng = random.Random(seed)
+    by_section = {}
+    for match_nr, section in enumerate(sections):
+        by_section.setdefault(section, []).append(match_nr)
+    section_queues = list(by_section.values())
+    rng.shuffle(section_queues)
+    for match_nrs in section_queues:
+        rng.shuffle(match_nrs)
+    order = []
+    for position in range(max(map(len, section_queues), default=0)):
+        order.extend(
+            match_nrs[position]
+            for match_nrs in section_queues
+            if position < len(match_nrs)
+        )
+    return order
+
+
+def match_order(match_lines, seed, sampling="random", sections=None, line_range=None):
+    """
+    Returns the order in which the matches of a doc are sampled.
+
+    Parameters
+    ----------
+    match_lines : list
+        The line numbers of the matches, indexed by match_nr.
+    seed : int
+        See sample_seed.
+    sampling : string
+        One of SAMPLING_MODES.
+    sections : list
+        The section of each match for stratified sampling; defaults to
+        positional_sections within line_range.
+    line_range : tuple
+    """
+    if sampling == "random":
+        return sample_order(len(match_lines), seed)
+    if sampling == "stratified":
+        if sections is None:
+            sections = positional_sections(match_lines, line_range)
+        return stratified_order(sections, seed)
+    raise ValueError(f"unknown sampling mode {sampling!r}")
@@ -0,0 +1,332 @@
+import contextlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+NGRAM_SIZE = 3
+SEARCH_INDEX_FORMAT_VERSION = 1
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def normalize_text(text):
+    return text.lower()
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize_text(text))
+
+
+def char_ngrams(text, ngram_size=NGRAM_SIZE):
+    return {text[i : i + ngram_size] for i in range(len(text) - ngram_size + 1)}
+
+
+class Postings:
+    """
+    Read-only mapping of key: ascending list of line ids, over the sorted
+    keys and the line ids of key i between offsets[i] and offsets[i + 1]
+    (arrays that may be memory-mapped).
+    """
+
+    def __init__(self, keys, offsets, line_ids):
+        self.keys = keys
+        self.offsets = offsets
+        self.line_ids = line_ids
+
+    @classmethod
+    def from_dict(cls, postings_map):
+        keys = sorted(postings_map)
+        return cls(
+            np.array(keys, dtype=str),
+            np.cumsum([0] + [len(postings_map[key]) for key in keys], dtype=np.int64),
+            np.array(
+                [line_id for key in keys for line_id in postings_map[key]],
+                dtype=np.int32,
+            ),
+        )
+
+    def _position(self, key):
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return None
+
+    def _postings(self, position):
+        return self.line_ids[
+            int(self.offsets[position]) : int(self.offsets[position + 1])
+        ].tolist()
+
+    def get(self, key, default=None):
+        position = self._position(key)
+        return default if position is None else self._postings(position)
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self._postings(position)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys.tolist())
+
+    def with_prefix(self, prefix):
+        """Yields (key, postings) of the keys starting with prefix."""
+        start = int(np.searchsorted(self.keys, prefix, "left"))
+        end = int(np.searchsorted(self.keys, prefix + "\U0010ffff", "left"))
+        for position in range(start, end):
+            yield str(self.keys[position]), self._postings(position)
+
+
+def _line_refs_and_lines(asset_dict, docs):
+    line_refs = []
+    lines = []
+    for asset_name in docs:
+        asset_content_dict = asset_dict[asset_name]
+        for line_number in range(len(asset_content_dict)):
+            line_refs.append((asset_name, line_number))
+            lines.append(normalize_text(asset_content_dict[line_number]))
+    return line_refs, lines
+
+
+def build_search_index(asset_dict, ngram_size=NGRAM_SIZE, version=None):
+    """
+    Builds an inverted index over all loaded docs. Every line gets a global
+    line id; normalized tokens and character n-grams point to the ids of the
+    lines they occur in.
+
+    Parameters
+    ----------
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested mapping of structure
+        line_number: line_text, numbered from 0.
+    ngram_size : int
+    version : string
+        The corpus version, stored to detect an outdated index.
+
+    Returns
+    -------
+    dict
+        The index with keys version, ngram_size, docs, line_refs, lines,
+        ngrams and tokens; ngrams and tokens are Postings.
+    """
+    docs = list(asset_dict)
+    line_refs, lines = _line_refs_and_lines(asset_dict, docs)
+    ngrams = {}
+    tokens = {}
+    for line_id, normalized_line in enumerate(lines):
+        for ngram in char_ngrams(normalized_line, ngram_size):
+            ngrams.setdefault(ngram, []).append(line_id)
+        for token in set(TOKEN_PATTERN.findall(normalized_line)):
+            tokens.setdefault(token, []).append(line_id)
+    return {
+        "version": version,
+        "ngram_size": ngram_size,
+        "docs": docs,
+        "line_refs": line_refs,
+        "lines": lines,
+        "ngrams": Postings.from_dict(ngrams),
+        "tokens": Postings.from_dict(tokens),
+    }
+
+
+def write_array_directory(path, arrays, meta):
+    """
+    Writes arrays to the directory path as .npy files, so they can be
+    memory-mapped, plus meta (a dict) as meta.json, written last. Every file
+    is written to a temporary file of its own and then replaced, so
+    concurrent writers and processes with the old files mapped never see a
+    partial file.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    # another writer may have removed it already
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(meta_path)
+    for name in list(arrays) + [None]:
+        file_descriptor, temp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temp_path, 0o644)
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                if name is None:
+                    file.write(json.dumps(meta, ensure_ascii=False).encode("utf8"))
+                else:
+                    np.save(file, arrays[name])
+            os.replace(
+                temp_path,
+                meta_path if name is None else os.path.join(path, f"{name}.npy"),
+            )
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def read_array_directory(path, names, format_version, version=None):
+    """
+    Memory-maps the arrays written by write_array_directory. Returns None
+    if there are none of format_version or, with a version, if they belong
+    to another corpus version.
+
+    Returns
+    -------
+    tuple
+        (meta, arrays)
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf8") as meta_file:
+        meta = json.load(meta_file)
+    if meta.get("format_version") != format_version or (
+        version is not None and meta.get("version") != version
+    ):
+        return None
+    return meta, {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in names
+    }
+
+
+_POSTINGS = ["ngrams", "tokens"]
+_ARRAYS = ["keys", "offsets", "line_ids"]
+
+
+def write_search_index(index, path):
+    arrays = {}
+    for postings in _POSTINGS:
+        arrays[f"{postings}_keys"] = index[postings].keys
+        arrays[f"{postings}_offsets"] = index[postings].offsets
+        arrays[f"{postings}_line_ids"] = index[postings].line_ids
+    write_array_directory(
+        path,
+        arrays,
+        {
+            "version": index["version"],
+            "ngram_size": index["ngram_size"],
+            "docs": index["docs"],
+            "format_version": SEARCH_INDEX_FORMAT_VERSION,
+        },
+    )
+
+
+def read_search_index(path, asset_dict):
+    """
+    Opens the search index of asset_dict (a corpus with a version) with
+    memory-mapped postings; the lines are taken from asset_dict. The index
+    is built and written if it does not exist or belongs to another corpus
+    version.
+    """
+    version = getattr(asset_dict, "version", None)
+    stored = read_array_directory(
+        path,
+        [f"{postings}_{array}" for postings in _POSTINGS for array in _ARRAYS],
+        SEARCH_INDEX_FORMAT_VERSION,
+        version,
+    )
+    if stored is not None and version is not None:
+        meta, arrays = stored
+        line_refs, lines = _line_refs_and_lines(asset_dict, meta["docs"])
+        index = {
+            "version": version,
+            "ngram_size": meta["ngram_size"],
+            "docs": meta["docs"],
+            "line_refs": line_refs,
+            "lines": lines,
+        }
+        for postings in _POSTINGS:
+            index[postings] = Postings(
+                *(arrays[f"{postings}_{array}"] for array in _ARRAYS)
+            )
+        return index
+    index = build_search_index(asset_dict, version=version)
+    if version is not None:
+        write_search_index(index, path)
+    return index
+
+
+def _intersect_postings(postings_lists):
+    postings_lists = sorted(postings_lists, key=len)
+    candidates = set(postings_lists[0])
+    for postings in postings_lists[1:]:
+        candidates.intersection_update(postings)
+        if not candidates:
+            break
+    return sorted(candidates)
+
+
+def find_line_ids(index, search_phrase, whole_word=False):
+    """
+    Looks up the ids of all lines matching search_phrase.
+
+    With whole_word=False the lookup keeps the substring semantics of
+    search_against_docs ("Zug" matches "Aufzug"): candidates are taken from
+    the n-gram postings and verified against the normalized line. Phrases
+    shorter than the n-gram size fall back to a scan over the normalized
+    lines. With whole_word=True every token of search_phrase has to occur
+    as a token of the line.
+
+    Returns
+    -------
+    list
+        Ascending list of line ids.
+    """
+    phrase = normalize_text(search_phrase)
+    lines = index["lines"]
+    if whole_word:
+        phrase_tokens = TOKEN_PATTERN.findall(phrase)
+        if not phrase_tokens:
+            return []
+        postings_lists = [index["tokens"].get(token, []) for token in phrase_tokens]
+        return _intersect_postings(postings_lists)
+    ngram_size = index["ngram_size"]
+    if len(phrase) < ngram_size:
+        return [line_id for line_id, line in enumerate(lines) if phrase in line]
+    postings_lists = []
+    for ngram in char_ngrams(phrase, ngram_size):
+        postings = index["ngrams"].get(ngram)
+        if postings is None:
+            return []
+        postings_lists.append(postings)
+    return [
+        line_id
+        for line_id in _intersect_postings(postings_lists)
+        if phrase in lines[line_id]
+    ]
+
+
+def search_against_index(index, asset_dict, search_phrase, whole_word=False):
+    """
+    Index-backed counterpart of search_against_docs.
+
+    Parameters
+    ----------
+    index : dict
+        As created by build_search_index for asset_dict.
+    asset_dict : dict
+        The docs the index was built from; used to return the original
+        line texts.
+    search_phrase : string
+    whole_word : bool
+
+    Returns
+    -------
+    dict
+        A dict with doc_name as key. Contains a nested dict of structure
+        line_number: [line_text] for lines with a match against search_phrase.
+    """
+    asset_search_matches = {asset_name: {} for asset_name in index["docs"]}
+    line_refs = index["line_refs"]
+    for line_id in find_line_ids(index, search_phrase, whole_word=whole_word):
+        asset_name, line_number = line_refs[line_id]
+        asset_search_matches[asset_name][line_number] = [
+            asset_dict[asset_name][line_number]
+        ]
+    return asset_search_matches
@@ -0,0 +1,513 @@
+import json
+import os
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from utils.fuzzy_index import stem_word
+from utils.search_index import TOKEN_PATTERN, normalize_text, write_array_directory
+
+SEMANTIC_INDEX_FORMAT_VERSION = 1
+CONTEXT_LINES = 5
+# stems are hashed into this many TF-IDF features
+HASH_DIMENSIONS = 2**15
+DIMENSIONS = 128
+DEFAULT_ENCODER = "lsa"
+DEFAULT_PROBES = 8
+_SEED = 2021
+# arrays opened memory-mapped; the rest is read into memory
+_MAPPED_ARRAYS = ["vectors", "lines"]
+_ARRAYS = ["projection", "idf", "centroids", "list_offsets"] + _MAPPED_ARRAYS
+
+_sentence_encoders = {}
+
+
+def _stem_bucket(token, memo):
+    bucket = memo.get(token)
+    if bucket is None:
+        bucket = zlib.crc32(stem_word(token).encode("utf8")) % HASH_DIMENSIONS
+        memo[token] = bucket
+    return bucket
+
+
+def hashed_term_counts(text, memo=None):
+    """
+    Counts the stems of the words of text (see utils.fuzzy_index.stem_word)
+    as hashed features; words of digits only are left out.
+
+    Returns
+    -------
+    Counter
+        A Counter of structure feature: count.
+    """
+    memo = {} if memo is None else memo
+    return Counter(
+        _stem_bucket(token, memo)
+        for token in TOKEN_PATTERN.findall(normalize_text(text))
+        if not token.isdigit()
+    )
+
+
+def _line_term_matrix(asset_dict):
+    """The hashed term counts of all lines as CSR arrays, docs in order."""
+    memo = {}
+    indptr = [0]
+    features = []
+    counts = []
+    for asset_content_dict in asset_dict.values():
+        for line_number in range(len(asset_content_dict)):
+            term_counts = hashed_term_counts(asset_content_dict[line_number], memo)
+            features.extend(term_counts)
+            counts.extend(term_counts.values())
+            indptr.append(len(features))
+    return (
+        np.array(indptr, dtype=np.int64),
+        np.array(features, dtype=np.int64),
+        np.array(counts, dtype=np.float32),
+    )
+
+
+def _sparse_dot(indptr, features, values, dense, chunk_size=4096):
+    """(sparse CSR matrix) @ dense, chunked by rows."""
+    result = np.zeros((len(indptr) - 1, dense.shape[1]), dtype=np.float32)
+    for row_start in range(0, len(indptr) - 1, chunk_size):
+        row_end = min(row_start + chunk_size, len(indptr) - 1)
+        starts = indptr[row_start:row_end]
+        lengths = indptr[row_start + 1 : row_end + 1] - starts
+        non_empty = lengths > 0
+        if not non_empty.any():
+            continue
+        entry_start, entry_end = indptr[row_start], indptr[row_end]
+        products = (
+            values[entry_start:entry_end, None] * dense[features[entry_start:entry_end]]
+        )
+        # empty rows in between have no entries, so each sum ends where the
+        # next non-empty row starts
+        result[row_start:row_end][non_empty] = np.add.reduceat(
+            products, starts[non_empty] - entry_start, axis=0
+        )
+    return result
+
+
+def _sparse_transposed_dot(indptr, features, values, dense):
+    """(sparse CSR matrix).T @ dense, as a HASH_DIMENSIONS x k array."""
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(features, kind="stable")
+    return _sparse_dot(
+        np.searchsorted(features[order], np.arange(HASH_DIMENSIONS + 1)),
+        rows[order],
+        values[order],
+        dense,
+    )
+
+
+def _window_sums(indptr, features, counts, window_starts, window_ends):
+    """Sums the term counts of the line ranges [window_start, window_end)."""
+    keys = np.concatenate(
+        [
+            window_id * HASH_DIMENSIONS
+            + features[indptr[window_start] : indptr[window_end]]
+            for window_id, (window_start, window_end) in enumerate(
+                zip(window_starts, window_ends)
+            )
+        ]
+        or [np.array([], dtype=np.int64)]
+    )
+    window_counts = np.concatenate(
+        [
+            counts[indptr[window_start] : indptr[window_end]]
+            for window_start, window_end in zip(window_starts, window_ends)
+        ]
+        or [np.array([], dtype=np.float32)]
+    )
+    keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.bincount(inverse, weights=window_counts).astype(np.float32)
+    window_ids = keys // HASH_DIMENSIONS
+    return (
+        np.searchsorted(window_ids, np.arange(len(window_starts) + 1)),
+        keys % HASH_DIMENSIONS,
+        summed,
+    )
+
+
+def _orthonormal(matrix):
+    return np.linalg.qr(matrix)[0].astype(np.float32)
+
+
+def fit_lsa(indptr, features, counts, dimensions=DIMENSIONS, power_iterations=2):
+    """
+    Fits latent semantic analysis on hashed term counts of text windows:
+    TF-IDF weighting and a truncated SVD by randomized range finding
+    (Halko et al., 2011).
+
+    Returns
+    -------
+    tuple
+        (idf, projection): the HASH_DIMENSIONS IDF weights and the
+        HASH_DIMENSIONS x dimensions projection onto the latent space.
+    """
+    window_count = len(indptr) - 1
+    document_frequency = np.bincount(features, minlength=HASH_DIMENSIONS)
+    idf = np.log((1 + window_count) / (1 + document_frequency)).astype(np.float32) + 1
+    values = counts * idf[features]
+    rng = np.random.default_rng(_SEED)
+    sample = rng.standard_normal((HASH_DIMENSIONS, dimensions + 10), np.float32)
+    basis = _orthonormal(_sparse_dot(indptr, features, values, sample))
+    for _ in range(power_iterations):
+        basis = _orthonormal(
+            _sparse_dot(
+                indptr,
+                features,
+                values,
+                _orthonormal(_sparse_transposed_dot(indptr, features, values, basis)),
+            )
+        )
+    reduced = _sparse_transposed_dot(indptr, features, values, basis).T
+    _, _, components = np.linalg.svd(reduced, full_matrices=False)
+    return idf, np.ascontiguousarray(components[:dimensions].T, dtype=np.float32)
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _sentence_encoder(model_name):
+    # a local model is optional; only its users need sentence-transformers
+    encoder = _sentence_encoders.get(model_name)
+    if encoder is None:
+        from sentence_transformers import SentenceTransformer
+
+        encoder = _sentence_encoders[model_name] = SentenceTransformer(
+            model_name, device="cpu"
+        )
+    return encoder
+
+
+def _window_text(asset_content_dict, line_number, context_lines):
+    return "\n".join(
+        asset_content_dict[number]
+        for number in range(
+            max(line_number - context_lines, 0),
+            min(line_number + context_lines + 1, len(asset_content_dict)),
+        )
+    )
+
+
+def _spherical_kmeans(vectors, list_count, iterations=10):
+    rng = np.random.default_rng(_SEED)
+    centroids = vectors[rng.choice(len(vectors), list_count, replace=False)]
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignments = _nearest_lists(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        sorted_assignments = assignments[order]
+        non_empty = np.unique(sorted_assignments)
+        sums = np.add.reduceat(
+            vectors[order], np.searchsorted(sorted_assignments, non_empty), axis=0
+        )
+        # empty lists keep their centroid
+        centroids[non_empty] = _normalized(sums)
+    return centroids, _nearest_lists(vectors, centroids)
+
+
+def _nearest_lists(vectors, centroids, chunk_size=8192):
+    return np.concatenate(
+        [
+            np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+            for start in range(0, len(vectors), chunk_size)
+        ]
+        or [np.array([], dtype=np.int64)]
+    )
+
+
+def build_semantic_index(
+    asset_dict,
+    version=None,
+    encoder=DEFAULT_ENCODER,
+    context_lines=CONTEXT_LINES,
+    dimensions=DIMENSIONS,
+):
+    """
+    Embeds the window of context_lines lines before and after every
+    non-empty line of all docs and organizes the vectors as an inverted file
+    index for approximate nearest neighbour search: the vectors are
+    clustered, and each doc's vectors are stored grouped by cluster, so a
+    query only scores the clusters closest to it.
+
+    Parameters
+    ----------
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested mapping of structure
+        line_number: line_text.
+    version : string
+        The corpus version, stored to detect an outdated index.
+    encoder : string
+        "lsa" for latent semantic analysis of hashed TF-IDF stem counts, fit
+        on the corpus (see fit_lsa), or the name of a local
+        sentence-transformers model.
+    context_lines : int
+    dimensions : int
+        Dimensions of the LSA vectors.
+
+    Returns
+    -------
+    dict
+        With keys version, encoder, parties, line_counts, context_lines,
+        idf and projection (the LSA model; empty for other encoders),
+        centroids, vectors (normalized, float16), lines (the center line
+        of each window) and list_offsets: the windows of doc p in cluster
+        c are vectors[list_offsets[p, c]:list_offsets[p, c + 1]].
+    """
+    parties = list(asset_dict)
+    line_counts = [len(asset_dict[party]) for party in parties]
+    window_parties = []
+    window_lines = []
+    for party_id, party in enumerate(parties):
+        for line_number in range(line_counts[party_id]):
+            if asset_dict[party][line_number].strip():
+                window_parties.append(party_id)
+                window_lines.append(line_number)
+    window_parties = np.array(window_parties, dtype=np.int64)
+    window_lines = np.array(window_lines, dtype=np.int64)
+    if encoder == DEFAULT_ENCODER:
+        indptr, features, counts = _line_term_matrix(asset_dict)
+        # fit on non-overlapping windows, so no line is counted twice
+        doc_starts = np.concatenate([[0], np.cumsum(line_counts)]).astype(np.int64)
+        fit_starts = np.concatenate(
+            [
+                np.arange(doc_start, doc_end, 2 * context_lines + 1)
+                for doc_start, doc_end in zip(doc_starts[:-1], doc_starts[1:])
+            ]
+        )
+        fit_ends = np.minimum(
+            fit_starts + 2 * context_lines + 1,
+            doc_starts[np.searchsorted(doc_starts, fit_starts, side="right")],
+        )
+        idf, projection = fit_lsa(
+            *_window_sums(indptr, features, counts, fit_starts, fit_ends),
+            dimensions=dimensions,
+        )
+        # the weighting is linear in the counts, so a window's vector is the
+        # sum of its lines' vectors
+        line_vectors = _sparse_dot(indptr, features, counts * idf[features], projection)
+        cumulative = np.concatenate(
+            [
+                np.zeros((1, projection.shape[1]), np.float32),
+                np.cumsum(line_vectors, axis=0),
+            ]
+        )
+        centers = doc_starts[window_parties] + window_lines
+        window_starts = np.maximum(centers - context_lines, doc_starts[window_parties])
+        window_ends = np.minimum(
+            centers + context_lines + 1, doc_starts[window_parties + 1]
+        )
+        vectors = cumulative[window_ends] - cumulative[window_starts]
+    else:
+        idf = np.zeros(0, dtype=np.float32)
+        projection = np.zeros((0, 0), dtype=np.float32)
+        vectors = _sentence_encoder(encoder).encode(
+            [
+                _window_text(asset_dict[parties[party_id]], line_number, context_lines)
+                for party_id, line_number in zip(window_parties, window_lines)
+            ],
+            batch_size=64,
+        )
+    vectors = _normalized(np.asarray(vectors, dtype=np.float32))
+    list_count = max(1, min(int(np.sqrt(len(vectors))), len(vectors)))
+    if len(vectors):
+        centroids, assignments = _spherical_kmeans(vectors, list_count)
+    else:
+        centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        assignments = np.zeros(0, dtype=np.int64)
+    list_keys = window_parties * list_count + assignments
+    order = np.lexsort((window_lines, list_keys))
+    list_offsets = np.searchsorted(
+        list_keys[order], np.arange(len(parties) * list_count + 1)
+    )
+    return {
+        "version": version,
+        "encoder": encoder,
+        "parties": parties,
+        "line_counts": line_counts,
+        "context_lines": context_lines,
+        "idf": idf,
+        "projection": projection,
+        "centroids": centroids.astype(np.float32),
+        "vectors": vectors[order].astype(np.float16),
+        "lines": window_lines[order].astype(np.int32),
+        "list_offsets": np.array(
+            [
+                list_offsets[party_id * list_count : (party_id + 1) * list_count + 1]
+                for party_id in range(len(parties))
+            ],
+            dtype=np.int64,
+        ).reshape(len(parties), list_count + 1),
+    }
+
+
+def write_semantic_index(semantic_index, path):
+    """
+    Writes the index to the directory path as .npy files, so the window
+    vectors can be memory-mapped, plus meta.json, written last (see
+    utils.search_index.write_array_directory).
+    """
+    meta = {
+        name: semantic_index[name]
+        for name in ["version", "encoder", "parties", "line_counts", "context_lines"]
+    }
+    meta["format_version"] = SEMANTIC_INDEX_FORMAT_VERSION
+    write_array_directory(
+        path, {array: semantic_index[array] for array in _ARRAYS}, meta
+    )
+
+
+def read_semantic_index(path, asset_dict=None, encoder=None):
+    """
+    Opens the index with memory-mapped window vectors. With asset_dict (a
+    corpus with a version), the index is (re)built and written if it does
+    not exist or belongs to another corpus version; encoder defaults to the
+    one of the outdated index.
+    """
+    version = getattr(asset_dict, "version", None)
+    meta_path = os.path.join(path, "meta.json")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf8") as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("format_version") == SEMANTIC_INDEX_FORMAT_VERSION and (
+            asset_dict is None or meta["version"] == version
+        ):
+            semantic_index = dict(meta)
+            for array in _ARRAYS:
+                semantic_index[array] = np.load(
+                    os.path.join(path, f"{array}.npy"),
+                    mmap_mode="r" if array in _MAPPED_ARRAYS else None,
+                )
+            return semantic_index
+    if asset_dict is None:
+        raise FileNotFoundError(meta_path)
+    semantic_index = build_semantic_index(
+        asset_dict,
+        version,
+        encoder=encoder or (meta or {}).get("encoder", DEFAULT_ENCODER),
+    )
+    write_semantic_index(semantic_index, path)
+    return semantic_index
+
+
+def embed_text(semantic_index, text):
+    """
+    Returns the normalized vector of text in the space of the index, or
+    None if none of its words are known to the LSA model.
+    """
+    if semantic_index["encoder"] != DEFAULT_ENCODER:
+        vector = _sentence_encoder(semantic_index["encoder"]).encode([text])[0]
+        return _normalized(np.asarray(vector, dtype=np.float32))
+    term_counts = hashed_term_counts(text)
+    if not term_counts:
+        return None
+    features = np.fromiter(term_counts, dtype=np.int64)
+    weights = np.fromiter(term_counts.values(), dtype=np.float32)
+    vector = (weights * semantic_index["idf"][features]) @ semantic_index["projection"][
+        features
+    ]
+    if not vector.any():
+        return None
+    return _normalized(vector)
+
+
+def _distinct_passages(lines, scores, top_k, min_distance):
+    # the best windows of a doc, skipping windows overlapping a better one
+    selected = []
+    for position in np.argsort(-scores, kind="stable"):
+        line_number = int(lines[position])
+        if all(abs(line_number - other) >= min_distance for other, _ in selected):
+            selected.append((line_number, float(scores[position])))
+            if len(selected) == top_k:
+                break
+    return selected
+
+
+def similar_passages(semantic_index, text, top_k=5, parties=None, probes=None):
+    """
+    Finds the passages of each doc most similar to text: the windows with
+    the highest cosine similarity among the probes clusters closest to text,
+    widening the search until top_k non-overlapping windows are found or
+    the doc is searched exhaustively.
+
+    Parameters
+    ----------
+    semantic_index : dict
+    text : string
+        A word, phrase or question.
+    top_k : int
+    parties : list
+        Defaults to all docs of the index.
+    probes : int
+        Clusters searched first; defaults to DEFAULT_PROBES.
+
+    Returns
+    -------
+    dict
+        A dict of structure doc_name: [(line_number, score)], best first;
+        line_number is the center line of a window of context_lines lines
+        before and after it.
+    """
+    parties = semantic_index["parties"] if parties is None else parties
+    query_vector = embed_text(semantic_index, text)
+    if query_vector is None:
+        return {party: [] for party in parties}
+    list_count = semantic_index["centroids"].shape[0]
+    list_order = np.argsort(-(semantic_index["centroids"] @ query_vector))
+    vectors = semantic_index["vectors"]
+    lines = semantic_index["lines"]
+    min_distance = 2 * semantic_index["context_lines"] + 1
+    passages = {}
+    for party in parties:
+        list_offsets = semantic_index["list_offsets"][
+            semantic_index["parties"].index(party)
+        ]
+        probe_count = min(probes or DEFAULT_PROBES, list_count)
+        while True:
+            ranges = [
+                (list_offsets[list_id], list_offsets[list_id + 1])
+                for list_id in list_order[:probe_count]
+            ]
+            candidates = np.concatenate(
+                [np.arange(start, end) for start, end in ranges]
+            )
+            scores = (vectors[candidates].astype(np.float32) @ query_vector).astype(
+                np.float32
+            )
+            selected = _distinct_passages(
+                lines[candidates], scores, top_k, min_distance
+            )
+            if len(selected) == top_k or probe_count == list_count:
+                break
+            probe_count = min(2 * probe_count, list_count)
+        passages[party] = selected
+    return passages
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.corpus_store import open_corpus
+
+    parser = argparse.ArgumentParser(
+        description="Embed all line windows of a corpus for semantic search."
+    )
+    parser.add_argument("--corpus", default="assets/doc_data.corpus")
+    parser.add_argument("--out", default="assets/doc_data.semantic")
+    parser.add_argument(
+        "--encoder",
+        default=DEFAULT_ENCODER,
+        help='"lsa" or the name of a local sentence-transformers model',
+    )
+    args = parser.parse_args()
+    corpus = open_corpus(args.corpus)
+    semantic_index = build_semantic_index(corpus, corpus.version, args.encoder)
+    write_semantic_index(semantic_index, args.out)
+    print(f"wrote {len(semantic_index['lines'])} windows to {args.out}")
@@ -0,0 +1,277 @@
+import os
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+from utils.search_index import TOKEN_PATTERN, normalize_text
+
+TERM_MATRIX_KINDS = ["word", "substring"]
+
+
+def _substring_terms(token, vocabulary, memo):
+    # every substring of a line made of word characters only lies within one
+    # token, so the terms found as substring in a line are the vocabulary
+    # terms contained in its tokens
+    terms = memo.get(token)
+    if terms is None:
+        terms = frozenset(
+            token[start:end]
+            for start in range(len(token))
+            for end in range(start + 1, len(token) + 1)
+            if token[start:end] in vocabulary
+        )
+        memo[token] = terms
+    return terms
+
+
+def _csr(counters, terms):
+    """Term-major sparse layout of a list of per-party Counters."""
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    entries = sorted(
+        (term_ids[term], party_id, count)
+        for party_id, counter in enumerate(counters)
+        for term, count in counter.items()
+    )
+    term_column = np.array([entry[0] for entry in entries], dtype=np.int64)
+    indptr = np.searchsorted(term_column, np.arange(len(terms) + 1)).astype(np.int64)
+    return (
+        indptr,
+        np.array([entry[1] for entry in entries], dtype=np.int16),
+        np.array([entry[2] for entry in entries], dtype=np.int32),
+    )
+
+
+def build_term_matrix(asset_dict, version=None):
+    """
+    Counts for every word of the corpus (lowercased tokens) the lines per
+    doc containing it as a whole word and as a substring ("zug" is contained
+    in "Aufzug"), i.e. the match counts of search_against_index for
+    single-word phrases.
+
+    Parameters
+    ----------
+    asset_dict : dict
+        A dict with doc_name as key. Contains a nested mapping of structure
+        line_number: line_text.
+    version : string
+        The corpus version, stored to detect an outdated matrix.
+
+    Returns
+    -------
+    dict
+        With keys version, parties, terms (sorted), line_counts (non-empty
+        lines per doc) and per kind in TERM_MATRIX_KINDS the sparse
+        term x doc matrix as {kind}_indptr, {kind}_parties and
+        {kind}_counts: the counts of term i are
+        {kind}_counts[{kind}_indptr[i]:{kind}_indptr[i + 1]], for the docs
+        in the same slice of {kind}_parties.
+    """
+    parties = list(asset_dict)
+    line_tokens = []
+    word_counters = []
+    line_counts = []
+    for asset_content_dict in asset_dict.values():
+        word_counter = Counter()
+        doc_tokens = []
+        for line_text in asset_content_dict.values():
+            tokens = set(TOKEN_PATTERN.findall(normalize_text(line_text)))
+            word_counter.update(tokens)
+            doc_tokens.append(tokens)
+        line_tokens.append(doc_tokens)
+        word_counters.append(word_counter)
+        line_counts.append(sum(1 for tokens in doc_tokens if tokens))
+    terms = sorted(set().union(*word_counters)) if word_counters else []
+    vocabulary = set(terms)
+    memo = {}
+    substring_counters = []
+    for doc_tokens in line_tokens:
+        substring_counter = Counter()
+        for tokens in doc_tokens:
+            if len(tokens) == 1:
+                (token,) = tokens
+                substring_counter.update(_substring_terms(token, vocabulary, memo))
+            elif tokens:
+                substring_counter.update(
+                    frozenset().union(
+                        *(_substring_terms(token, vocabulary, memo) for token in tokens)
+                    )
+                )
+        substring_counters.append(substring_counter)
+
+    term_matrix = {
+        "version": version,
+        "parties": parties,
+        "terms": terms,
+        "line_counts": np.array(line_counts, dtype=np.int64),
+    }
+    for kind, counters in zip(TERM_MATRIX_KINDS, [word_counters, substring_counters]):
+        indptr, party_ids, counts = _csr(counters, terms)
+        term_matrix[f"{kind}_indptr"] = indptr
+        term_matrix[f"{kind}_parties"] = party_ids
+        term_matrix[f"{kind}_counts"] = counts
+    return _with_term_ids(term_matrix)
+
+
+def _with_term_ids(term_matrix):
+    term_matrix["term_ids"] = {
+        term: term_id for term_id, term in enumerate(term_matrix["terms"])
+    }
+    return term_matrix
+
+
+def write_term_matrix(term_matrix, path):
+    """
+    Writes the term matrix to a temporary file next to path, which then
+    replaces path, so concurrent writers and readers never see a partial
+    file.
+    """
+    file_descriptor, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".",
+        suffix=".tmp",
+    )
+    # mkstemp creates the file readable by its owner only
+    os.chmod(tmp_path, 0o644)
+    try:
+        with os.fdopen(file_descriptor, "wb") as term_matrix_file:
+            np.savez_compressed(
+                term_matrix_file,
+                version=np.array(term_matrix["version"] or ""),
+                parties=np.array(term_matrix["parties"]),
+                terms=np.array(term_matrix["terms"]),
+                line_counts=term_matrix["line_counts"],
+                **{
+                    f"{kind}_{array}": term_matrix[f"{kind}_{array}"]
+                    for kind in TERM_MATRIX_KINDS
+                    for array in ["indptr", "parties", "counts"]
+                },
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_term_matrix(path, asset_dict=None):
+    """
+    Reads the term matrix. With asset_dict (a corpus with a version), the
+    matrix is (re)built and written if the file does not exist or belongs
+    to another corpus version.
+    """
+    version = getattr(asset_dict, "version", None)
+    if os.path.exists(path):
+        with np.load(path) as term_matrix_file:
+            term_matrix = {
+                name: term_matrix_file[name] for name in term_matrix_file.files
+            }
+        term_matrix["version"] = str(term_matrix["version"]) or None
+        term_matrix["parties"] = term_matrix["parties"].tolist()
+        term_matrix["terms"] = term_matrix["terms"].tolist()
+        if asset_dict is None or term_matrix["version"] == version:
+            return _with_term_ids(term_matrix)
+    if asset_dict is None:
+        raise FileNotFoundError(path)
+    term_matrix = build_term_matrix(asset_dict, version)
+    write_term_matrix(term_matrix, path)
+    return term_matrix
+
+
+def term_counts(term_matrix, term, whole_word=False):
+    """
+    Looks up the number of lines per doc containing term, without any
+    search.
+
+    Returns
+    -------
+    ndarray
+        The counts in the order of term_matrix["parties"], or None if term
+        is not a single word of the corpus vocabulary (and therefore has to
+        be searched). Terms of the vocabulary found in no line of a doc
+        count 0 there.
+    """
+    normalized_term = normalize_text(term)
+    if not TOKEN_PATTERN.fullmatch(normalized_term):
+        return None
+    term_id = term_matrix["term_ids"].get(normalized_term)
+    counts = np.zeros(len(term_matrix["parties"]), dtype=np.int64)
+    if term_id is None:
+        if whole_word:
+            return counts
+        # a substring of no word, e.g. "klimaz", cannot be told apart from
+        # a substring across words
+        return None
+    kind = "word" if whole_word else "substring"
+    start, end = term_matrix[f"{kind}_indptr"][term_id : term_id + 2]
+    counts[term_matrix[f"{kind}_parties"][start:end]] = term_matrix[f"{kind}_counts"][
+        start:end
+    ]
+    return counts
+
+
+def distinctive_terms(term_matrix, top_n=10, min_count=5, min_length=4):
+    """
+    Ranks the words of each doc by TF-IDF over the whole-word counts: the
+    share of a doc's lines containing the word, weighted by log(number of
+    docs / number of docs using the word). Words all docs use score 0.
+
+    Parameters
+    ----------
+    term_matrix : dict
+    top_n : int
+    min_count : int
+        Words found in fewer lines of the doc are left out.
+    min_length : int
+        Shorter words, and words containing digits, are left out.
+
+    Returns
+    -------
+    dict
+        A dict of structure doc_name: [(term, score)], best first.
+    """
+    parties = term_matrix["parties"]
+    terms = np.array(term_matrix["terms"], dtype=str)
+    indptr = term_matrix["word_indptr"]
+    counts = np.zeros((len(parties), len(terms)), dtype=np.float32)
+    counts[
+        term_matrix["word_parties"], np.repeat(np.arange(len(terms)), np.diff(indptr))
+    ] = term_matrix["word_counts"]
+    term_frequency = counts / np.maximum(term_matrix["line_counts"], 1)[:, None]
+    document_frequency = np.count_nonzero(counts, axis=0)
+    inverse_document_frequency = np.log(
+        len(parties) / np.maximum(document_frequency, 1)
+    )
+    scores = term_frequency * inverse_document_frequency
+    eligible = (np.char.str_len(terms) >= min_length) & np.char.isalpha(terms)
+    scores[:, ~eligible] = 0
+    scores[counts < min_count] = 0
+    top_n = min(top_n, len(terms))
+    if top_n == 0:
+        return {party: [] for party in parties}
+    top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    distinctive = {}
+    for party_id, party in enumerate(parties):
+        term_ids = top[party_id][np.argsort(-scores[party_id, top[party_id]])]
+        distinctive[party] = [
+            (str(terms[term_id]), float(scores[party_id, term_id]))
+            for term_id in term_ids
+            if scores[party_id, term_id] > 0
+        ]
+    return distinctive
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.corpus_store import open_corpus
+
+    parser = argparse.ArgumentParser(
+        description="Build the party x term count matrix of a corpus."
+    )
+    parser.add_argument("--corpus", default="assets/doc_data.corpus")
+    parser.add_argument("--out", default="assets/doc_data.terms.npz")
+    args = parser.parse_args()
+    corpus = open_corpus(args.corpus)
+    term_matrix = build_term_matrix(corpus, corpus.version)
+    write_term_matrix(term_matrix, args.out)
+    print(f"wrote {len(term_matrix['terms'])} terms to {args.out}")
@@ -0,0 +1,231 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from urllib.request import urlopen
+
+from utils.analysis_cache import analysis_cache_key
+
+DEFAULT_EXTRACTORS = ["entities", "topics", "categories"]
+
+# the socket timeout of the requests the current thread sends, see _analyze
+_request_timeout = threading.local()
+
+
+def _urlopen_with_timeout(request, *args, **kwargs):
+    seconds = getattr(_request_timeout, "seconds", None)
+    if seconds is not None:
+        kwargs.setdefault("timeout", seconds)
+    return urlopen(request, *args, **kwargs)
+
+
+def create_textrazor_client(api_key, extractors=DEFAULT_EXTRACTORS):
+    # imported on first use, so serving from precomputed annotations does
+    # not load the TextRazor SDK
+    import textrazor
+
+    textrazor.api_key = api_key
+    # the SDK opens its requests without a timeout, so a stalled connection
+    # would block its worker thread forever
+    textrazor.urlopen = _urlopen_with_timeout
+    return textrazor.TextRazor(extractors=list(extractors))
+
+
+def _analyze(client, text_to_analyze, timeout):
+    _request_timeout.seconds = timeout
+    try:
+        return client.analyze(text_to_analyze)
+    finally:
+        _request_timeout.seconds = None
+
+
+def _cache_late_response(cache, cache_key, future):
+    try:
+        response_json = future.result().json
+    except (_analysis_exception(), OSError):
+        return
+    cache.put(cache_key, response_json)
+
+
+def _analysis_exception():
+    try:
+        from textrazor import TextRazorAnalysisException
+    except ImportError:
+        return ()
+    return TextRazorAnalysisException
+
+
+def analyze_texts(
+    texts,
+    api_key,
+    extractors=DEFAULT_EXTRACTORS,
+    cache=None,
+    client=None,
+    max_workers=4,
+    timeout=30,
+    cache_only=False,
+):
+    """
+    Analyzes several texts with TextRazor. With a cache (see AnalysisCache),
+    responses are looked up by a hash of text and extractors first; cache
+    misses are sent to TextRazor concurrently, as long as today's quota
+    allows, using one shared client and at most max_workers parallel
+    requests.
+
+    Parameters
+    ----------
+    texts : dict
+        A dict of structure key: text_to_analyze.
+    api_key : string
+    extractors : list
+    cache : AnalysisCache
+    client : textrazor.TextRazor
+        Created from api_key and extractors if not given.
+    max_workers : int
+    timeout : int
+        Seconds each request may wait for the connection or for data from
+        TextRazor (the socket timeout of clients created by
+        create_textrazor_client). Requests that have not finished within
+        timeout times the number of request rounds are reported as
+        "timeout"; their responses are still cached once they arrive.
+    cache_only : bool
+        Only look up cached responses; nothing is sent to TextRazor and no
+        quota is used.
+
+    Returns
+    -------
+    dict
+        A dict of structure key: (response_json, source). response_json is
+        the json of the TextRazor response or None; source is one of
+        "cache", "api", "not_cached", "quota_exhausted", "timeout" or
+        "error".
+    """
+    results = {}
+    # identical texts are sent only once
+    pending = {}
+    cache_keys = {}
+    for key, text_to_analyze in texts.items():
+        if text_to_analyze in pending:
+            pending[text_to_analyze].append(key)
+            continue
+        if cache is not None:
+            cache_keys[text_to_analyze] = analysis_cache_key(
+                text_to_analyze, extractors
+            )
+            response_json = cache.get(cache_keys[text_to_analyze])
+            if response_json is not None:
+                results[key] = (response_json, "cache")
+                continue
+        if cache_only:
+            results[key] = (None, "not_cached")
+            continue
+        if cache is not None:
+            if not cache.try_consume_quota():
+                results[key] = (None, "quota_exhausted")
+                continue
+        pending[text_to_analyze] = [key]
+
+    if pending:
+        if client is None:
+            client = create_textrazor_client(api_key, extractors)
+        workers = min(max_workers, len(pending))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            executor.submit(_analyze, client, text_to_analyze, timeout): (
+                text_to_analyze
+            )
+            for text_to_analyze in pending
+        }
+        done, not_done = wait(
+            futures, timeout=timeout * math.ceil(len(pending) / workers)
+        )
+        for future in not_done:
+            text_to_analyze = futures[future]
+            # requests already sent are paid for: keep their responses
+            if not future.cancel() and cache is not None:
+                future.add_done_callback(
+                    partial(_cache_late_response, cache, cache_keys[text_to_analyze])
+                )
+            for key in pending[text_to_analyze]:
+                results[key] = (None, "timeout")
+        executor.shutdown(wait=False)
+        for future in done:
+            text_to_analyze = futures[future]
+            try:
+                response_json = future.result().json
+            except (_analysis_exception(), OSError):
+                for key in pending[text_to_analyze]:
+                    results[key] = (None, "error")
+                continue
+            if cache is not None:
+                cache.put(cache_keys[text_to_analyze], response_json)
+            for key in pending[text_to_analyze]:
+                results[key] = (response_json, "api")
+    return {key: results[key] for key in texts}
+
+
+def analyze_text(
+    text_to_analyze, api_key, extractors=DEFAULT_EXTRACTORS, cache=None, client=None
+):
+    """
+    Analyzes a single text, see analyze_texts.
+
+    Returns
+    -------
+    tuple
+        (response_json, source)
+    """
+    return analyze_texts(
+        {0: text_to_analyze}, api_key, extractors=extractors, cache=cache, client=client
+    )[0]
+
+
+class FakeTextRazorResponse:
+    def __init__(self, response_json):
+        self.json = response_json
+
+
+class FakeTextRazor:
+    """
+    Local stand-in for textrazor.TextRazor, for tests and offline use. Every
+    capitalized word of the analyzed text becomes a topic and an entity,
+    scored by its relative frequency. Analyzed texts are recorded in calls;
+    delay simulates the round trip to the API in seconds.
+    """
+
+    def __init__(self, extractors=DEFAULT_EXTRACTORS, delay=0):
+        self.extractors = list(extractors)
+        self.delay = delay
+        self.calls = []
+
+    def analyze(self, text):
+        self.calls.append(text)
+        if self.delay:
+            time.sleep(self.delay)
+        words = Counter(re.findall(r"\b[A-ZÄÖÜ]\w{3,}", text))
+        total = sum(words.values()) or 1
+        response = {}
+        if "topics" in self.extractors:
+            response["topics"] = [
+                {
+                    "id": n,
+                    "label": word,
+                    "score": count / total,
+                    "wikiLink": f"http://de.wikipedia.org/wiki/{word}",
+                }
+                for n, (word, count) in enumerate(words.most_common())
+            ]
+        if "entities" in self.extractors:
+            response["entities"] = [
+                {
+                    "id": n,
+                    "entityId": word,
+                    "type": ["Concept"],
+                    "confidenceScore": 1 + count / total,
+                }
+                for n, (word, count) in enumerate(words.most_common())
+            ]
+        return FakeTextRazorResponse({"response": response, "ok": True})
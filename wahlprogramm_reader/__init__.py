@@ -0,0 +1,3 @@
+from wahlprogramm_reader.client import HttpReader
+from wahlprogramm_reader.core import Reader, analysis_frames, load
+from wahlprogramm_reader.registry import CorpusRegistry
@@ -0,0 +1,34 @@
+import argparse
+import time
+
+from utils.corpus_registry import DEFAULT_CORPORA_DIR
+from wahlprogramm_reader.registry import CorpusRegistry
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create the files derived from the corpus of an election "
+        "(corpus file, search, phrase and fuzzy index, term matrix, semantic "
+        "index) if they are "
+        "missing or outdated, and load them once. Run before starting the app, "
+        "so its first request does not pay for it."
+    )
+    parser.add_argument("--corpora-dir", default=DEFAULT_CORPORA_DIR)
+    parser.add_argument(
+        "--election",
+        default=None,
+        help="name of the corpus manifest; defaults to the latest election",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="prepare the corpora of all elections"
+    )
+    args = parser.parse_args()
+    registry = CorpusRegistry(args.corpora_dir, memory_budget=0, eager=True)
+    for name in (
+        registry.names if args.all else [registry.manifest(args.election)["name"]]
+    ):
+        start = time.perf_counter()
+        reader = registry.get(name)
+        print(
+            f"{name}: corpus {reader.version} ready in "
+            f"{time.perf_counter() - start:.1f}s ({len(reader.parties)} docs)"
+        )
@@ -0,0 +1,213 @@
+import json
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+
+class ReaderApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+def _int_keys(mapping):
+    # JSON object keys are strings; line and match numbers are ints
+    return {int(key): value for key, value in mapping.items()}
+
+
+class HttpReader:
+    """
+    Client for a ReaderServer with the same interface as Reader, so the
+    Streamlit app can run against a local Reader or a remote server. With a
+    corpus, all requests go to that corpus of the server's CorpusRegistry;
+    corpora and compare give the interface of the registry.
+    """
+
+    def __init__(self, url, timeout=60, corpus=None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.corpus = corpus
+        self._health = None
+
+    def for_corpus(self, name=None):
+        """A client of corpus name of the same server."""
+        return HttpReader(self.url, timeout=self.timeout, corpus=name)
+
+    def _request(self, path, params=None, body=None):
+        url = self.url + path
+        if self.corpus is not None:
+            if body is None:
+                params = dict(params or {}, corpus=self.corpus)
+            else:
+                body = dict(body, corpus=self.corpus)
+        if params:
+            url += "?" + urlencode(
+                {name: value for name, value in params.items() if value is not None}
+            )
+        data = None if body is None else json.dumps(body).encode("utf8")
+        request = Request(
+            url,
+            data=data,
+            method="GET" if body is None else "POST",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except HTTPError as error:
+            try:
+                message = json.loads(error.read()).get("error")
+            except ValueError:
+                message = error.reason
+            raise ReaderApiError(error.code, message)
+
+    def health(self):
+        self._health = self._request("/health")
+        return self._health
+
+    @property
+    def version(self):
+        return (self._health or self.health())["version"]
+
+    @property
+    def parties(self):
+        return (self._health or self.health())["parties"]
+
+    def search(self, search_phrase, across_lines=False):
+        result = self._request(
+            "/search", {"q": search_phrase, "across_lines": int(across_lines)}
+        )
+        return {
+            party: _int_keys(matches) for party, matches in result["matches"].items()
+        }
+
+    def match_counts(self, search_phrase, across_lines=False):
+        # counted by the server, instead of downloading every match
+        return {
+            party: counts.get(search_phrase, 0)
+            for party, counts in self.match_matrix(
+                [search_phrase], across_lines
+            ).items()
+        }
+
+    def match_matrix(self, search_phrases, across_lines=False):
+        return self._request(
+            "/match_matrix",
+            body={"queries": list(search_phrases), "across_lines": across_lines},
+        )
+
+    def distinctive_terms(self, top_n=10):
+        return self._request("/distinctive_terms", {"top_n": top_n})
+
+    def similar_passages(self, text, top_k=5):
+        return self._request("/similar_passages", {"q": text, "top_k": top_k})
+
+    def contexts(
+        self, party, search_phrase, across_lines=False, cursor=None, page_size=10
+    ):
+        return self._request(
+            "/contexts",
+            {
+                "party": party,
+                "q": search_phrase,
+                "across_lines": int(across_lines),
+                "cursor": cursor,
+                "page_size": page_size,
+            },
+        )
+
+    def match_snippets(self, party, search_phrase, match_nrs, across_lines=False):
+        return _int_keys(
+            self._request(
+                "/match_snippets",
+                body={
+                    "party": party,
+                    "q": search_phrase,
+                    "match_nrs": list(match_nrs),
+                    "across_lines": across_lines,
+                },
+            )
+        )
+
+    def section_counts(self, party, search_phrase, across_lines=False, level=1):
+        return self._request(
+            "/section_counts",
+            {
+                "party": party,
+                "q": search_phrase,
+                "across_lines": int(across_lines),
+                "level": level,
+            },
+        )
+
+    def analyze(self, party, search_phrase, match_nrs=None, across_lines=False):
+        return self._request(
+            "/analyze",
+            body={
+                "party": party,
+                "q": search_phrase,
+                "match_nrs": None if match_nrs is None else list(match_nrs),
+                "across_lines": across_lines,
+            },
+        )
+
+    def sample_matches(
+        self,
+        party,
+        search_phrase,
+        sample_size=10,
+        across_lines=False,
+        sampling="random",
+    ):
+        return self._request(
+            "/sample_matches",
+            {
+                "party": party,
+                "q": search_phrase,
+                "sample_size": sample_size,
+                "across_lines": int(across_lines),
+                "sampling": sampling,
+            },
+        )
+
+    def analyze_in_background(
+        self, party, search_phrase, across_lines=False, sampling="stratified"
+    ):
+        return self._request(
+            "/analyze_in_background",
+            body={
+                "party": party,
+                "q": search_phrase,
+                "across_lines": across_lines,
+                "sampling": sampling,
+            },
+        )
+
+    def analysis_progress(
+        self, party, search_phrase, across_lines=False, sampling="stratified"
+    ):
+        return self._request(
+            "/analysis_progress",
+            {
+                "party": party,
+                "q": search_phrase,
+                "across_lines": int(across_lines),
+                "sampling": sampling,
+            },
+        )
+
+    def corpora(self):
+        return self._request("/corpora")["corpora"]
+
+    def compare(self, search_phrases, corpora=None, across_lines=False):
+        return self._request(
+            "/compare",
+            body={
+                "queries": list(search_phrases),
+                "corpora": None if corpora is None else list(corpora),
+                "across_lines": across_lines,
+            },
+        )
+
+    def stats(self):
+        return self._request("/stats")
@@ -0,0 +1,876 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from utils.analysis_cache import AnalysisCache
+from utils.annotations import annotations_for_matches, read_annotations
+from utils.corpus_registry import approximate_size
+from utils.doc_handler import (
+    ENTITY_COLUMNS,
+    TOPIC_COLUMNS,
+    build_textrazor_batch_frames,
+    extract_match_contexts,
+    read_docs_from_corpus,
+    render_snippet_markdown,
+    request_textrazor_batch,
+)
+from utils.doc_structure import (
+    enclosing_heading,
+    locate_lines,
+    read_structure,
+    section_path,
+)
+from utils.fuzzy_index import read_fuzzy_index
+from utils.instrumentation import metrics, span
+from utils.phrase_index import (
+    normalize_phrase,
+    read_phrase_index,
+    search_phrase_across_lines,
+)
+from utils.query import (
+    IndexResolver,
+    PhraseIndexResolver,
+    count_queries,
+    is_plain_phrase,
+    query_key,
+    search_query,
+)
+from utils.ranking import DEFAULT_PAGE_SIZE, RankedMatches, query_terms
+from utils.result_cache import create_result_cache, result_cache_key
+from utils.sampling import match_order, sample_seed
+from utils.search_index import (
+    normalize_text,
+    read_search_index,
+    search_against_index,
+)
+from utils.semantic_index import read_semantic_index, similar_passages
+from utils.term_matrix import distinctive_terms, read_term_matrix, term_counts
+from utils.textrazor_client import analyze_texts, create_textrazor_client
+
+# share of the daily TextRazor quota analyze_in_background leaves to the
+# other users, and the requests one background job may use at most
+BACKGROUND_QUOTA_RESERVE = 0.5
+BACKGROUND_MAX_REQUESTS = 100
+# the lazily loaded indexes, see Reader.memory_usage
+INDEX_ATTRIBUTES = [
+    "_search_index",
+    "_fuzzy_index",
+    "_phrase_index",
+    "_term_matrix",
+    "_semantic_index",
+    "_structure",
+    "_annotations",
+]
+
+
+class Reader:
+    """
+    Search, context extraction and analysis over one loaded corpus,
+    independent of any UI. All results are plain, JSON-serializable
+    structures; one Reader can serve many threads.
+
+    Parameters
+    ----------
+    corpus_path : string
+    json_path : string
+        Used to create the corpus file if it does not exist yet.
+    search_index_path : string
+        The n-gram and token postings, see utils.search_index; written at
+        ingest time and memory-mapped, created like the term matrix if
+        missing or outdated.
+    phrase_index_path : string
+    fuzzy_index_path : string
+        The stems and typo variants of the vocabulary for fuzzy search, see
+        utils.fuzzy_index; written at ingest time, created like the term
+        matrix if missing or outdated.
+    term_matrix_path : string
+        The party x term counts, see utils.term_matrix; created if it does
+        not exist or belongs to another corpus version.
+    semantic_index_path : string
+        The embedded line windows for semantic search, see
+        utils.semantic_index; created like the term matrix.
+    structure_path : string
+        Pages and headings of each doc, see utils.doc_structure; written at
+        ingest time. Without it, matches are not located in the programs.
+    annotations_path : string
+        Precomputed annotations, see utils.annotations; if the file exists
+        and belongs to this corpus version, analyze uses them instead of
+        TextRazor.
+    result_cache : ResultCache
+        Defaults to the local on-disk store.
+    analysis_cache : AnalysisCache
+        Defaults to the local on-disk store.
+    textrazor_key : string
+        Only needed for live analysis.
+    textrazor_client : object
+        Defaults to a TextRazor client created on first use.
+    """
+
+    def __init__(
+        self,
+        corpus_path="assets/doc_data.corpus",
+        json_path="assets/doc_data.json",
+        search_index_path="assets/doc_data.search",
+        phrase_index_path="assets/doc_data.phrases",
+        fuzzy_index_path="assets/doc_data.fuzzy",
+        term_matrix_path="assets/doc_data.terms.npz",
+        semantic_index_path="assets/doc_data.semantic",
+        structure_path="assets/doc_data.structure.npz",
+        annotations_path="assets/annotations.npz",
+        result_cache=None,
+        analysis_cache=None,
+        textrazor_key=None,
+        textrazor_client=None,
+    ):
+        self.assets = read_docs_from_corpus(corpus_path, json_path)
+        self.search_index_path = search_index_path
+        self.phrase_index_path = phrase_index_path
+        self.fuzzy_index_path = fuzzy_index_path
+        self.term_matrix_path = term_matrix_path
+        self.semantic_index_path = semantic_index_path
+        self.structure_path = structure_path
+        self.annotations_path = annotations_path
+        self.result_cache = result_cache or create_result_cache()
+        self._analysis_cache = analysis_cache
+        self.textrazor_key = textrazor_key
+        self._textrazor_client = textrazor_client
+        self._lock = threading.Lock()
+        self._search_index = None
+        self._fuzzy_index = None
+        self._phrase_index = None
+        self._term_matrix = None
+        self._semantic_index = None
+        self._structure = None
+        self._annotations = None
+        self._background = None
+        self._background_jobs = {}
+        self._index_sizes = {}
+
+    @property
+    def version(self):
+        return self.assets.version
+
+    @property
+    def parties(self):
+        return list(self.assets)
+
+    def _get(self, attribute, load):
+        # lazily loaded resources are shared by all threads
+        with self._lock:
+            if getattr(self, attribute) is None:
+                setattr(self, attribute, load())
+            return getattr(self, attribute)
+
+    @property
+    def search_index(self):
+        return self._get(
+            "_search_index",
+            lambda: read_search_index(self.search_index_path, self.assets),
+        )
+
+    @property
+    def fuzzy_index(self):
+        # {} marks a missing or outdated fuzzy index, see structure
+        fuzzy_index = self._get(
+            "_fuzzy_index",
+            lambda: read_fuzzy_index(self.fuzzy_index_path, self.version) or {},
+        )
+        if fuzzy_index:
+            return fuzzy_index
+        # rebuilt from the search index and written
+        search_index = self.search_index
+        with self._lock:
+            if not self._fuzzy_index:
+                self._fuzzy_index = read_fuzzy_index(
+                    self.fuzzy_index_path, self.version, search_index
+                )
+            return self._fuzzy_index
+
+    @property
+    def phrase_index(self):
+        return self._get(
+            "_phrase_index",
+            lambda: read_phrase_index(self.phrase_index_path, self.assets),
+        )
+
+    @property
+    def term_matrix(self):
+        return self._get(
+            "_term_matrix",
+            lambda: read_term_matrix(self.term_matrix_path, self.assets),
+        )
+
+    @property
+    def semantic_index(self):
+        return self._get(
+            "_semantic_index",
+            lambda: read_semantic_index(self.semantic_index_path, self.assets),
+        )
+
+    @property
+    def structure(self):
+        # {} marks a missing or outdated structure index, so it is looked
+        # for only once
+        structure = self._get(
+            "_structure",
+            lambda: read_structure(self.structure_path, self.version) or {},
+        )
+        return structure or None
+
+    @property
+    def annotations(self):
+        # {} marks missing annotations or those of another corpus version,
+        # see structure
+        annotations = self._get(
+            "_annotations",
+            lambda: read_annotations(self.annotations_path, self.version) or {},
+        )
+        return annotations or None
+
+    @property
+    def analysis_cache(self):
+        return self._get("_analysis_cache", AnalysisCache)
+
+    @property
+    def textrazor_client(self):
+        return self._get(
+            "_textrazor_client", lambda: create_textrazor_client(self.textrazor_key)
+        )
+
+    def warm_up(self):
+        """Loads all lazily loaded resources."""
+        self.search_index
+        self.fuzzy_index
+        self.phrase_index
+        self.term_matrix
+        self.semantic_index
+        self.structure
+        self.annotations
+        return self
+
+    def memory_usage(self):
+        """
+        Estimates the bytes the loaded indexes hold on the heap, see
+        utils.corpus_registry.approximate_size. Memory-mapped files (the
+        corpus, phrase index and semantic vectors) count nothing. Each index
+        is measured once, when it is first seen loaded.
+        """
+        with self._lock:
+            loaded = {
+                attribute: getattr(self, attribute)
+                for attribute in INDEX_ATTRIBUTES
+                if attribute not in self._index_sizes
+                and getattr(self, attribute) is not None
+            }
+        sizes = {
+            attribute: approximate_size(index) for attribute, index in loaded.items()
+        }
+        with self._lock:
+            self._index_sizes.update(sizes)
+            return sum(self._index_sizes.values())
+
+    def _resolver(self, across_lines):
+        # the fuzzy index is only needed for fuzzy terms
+        fuzzy_index = lambda: self.fuzzy_index
+        if across_lines:
+            return PhraseIndexResolver(
+                self.search_index, self.phrase_index, fuzzy_index
+            )
+        return IndexResolver(self.search_index, fuzzy_index)
+
+    def search(self, search_phrase, across_lines=False):
+        """
+        Searches all docs, line by line or across lines. search_phrase may
+        be a query, see utils.query.parse_query.
+
+        Returns
+        -------
+        dict
+            A dict with doc_name as key. Contains a nested dict of structure
+            line_number: [line_text] for lines with a match.
+        """
+        with span("search", "Reader.search"):
+            if not is_plain_phrase(search_phrase):
+                return self.result_cache.get_or_compute(
+                    result_cache_key(
+                        "query_search", self.version, search_phrase, across_lines
+                    ),
+                    lambda: search_query(
+                        self._resolver(across_lines), self.assets, search_phrase
+                    ),
+                )
+            if across_lines:
+                return self.result_cache.get_or_compute(
+                    result_cache_key(
+                        "phrase_search", self.version, normalize_phrase(search_phrase)
+                    ),
+                    lambda: search_phrase_across_lines(
+                        self.phrase_index, self.assets, search_phrase
+                    ),
+                )
+            return self.result_cache.get_or_compute(
+                result_cache_key("search", self.version, normalize_text(search_phrase)),
+                lambda: search_against_index(
+                    self.search_index, self.assets, search_phrase
+                ),
+            )
+
+    def _term_counts(self, search_phrase, across_lines):
+        # single words searched line by line are looked up, not searched
+        if across_lines or not is_plain_phrase(search_phrase):
+            return None
+        counts = term_counts(self.term_matrix, search_phrase)
+        if counts is None:
+            return None
+        return dict(zip(self.term_matrix["parties"], counts.tolist()))
+
+    def match_counts(self, search_phrase, across_lines=False):
+        counts = self._term_counts(search_phrase, across_lines)
+        if counts is not None:
+            return counts
+        return {
+            party: len(matches)
+            for party, matches in self.search(search_phrase, across_lines).items()
+        }
+
+    def match_matrix(self, search_phrases, across_lines=False):
+        """
+        Counts the matching lines of several phrases or queries in all docs,
+        evaluated together in one pass.
+
+        Returns
+        -------
+        dict
+            A dict of structure doc_name: {search_phrase: line_count}.
+        """
+        search_phrases = list(search_phrases)
+        with span("search", "Reader.match_matrix"):
+            looked_up = {}
+            for search_phrase in search_phrases:
+                counts = self._term_counts(search_phrase, across_lines)
+                if counts is not None:
+                    looked_up[search_phrase] = counts
+            searched = [
+                search_phrase
+                for search_phrase in search_phrases
+                if search_phrase not in looked_up
+            ]
+            matrix = {party: {} for party in self.parties}
+            if searched:
+                matrix = self.result_cache.get_or_compute(
+                    result_cache_key(
+                        "match_matrix", self.version, searched, across_lines
+                    ),
+                    lambda: count_queries(
+                        self._resolver(across_lines), searched, self.parties
+                    ),
+                )
+            return {
+                party: {
+                    search_phrase: looked_up[search_phrase][party]
+                    if search_phrase in looked_up
+                    else matrix[party][search_phrase]
+                    for search_phrase in search_phrases
+                }
+                for party in self.parties
+            }
+
+    def distinctive_terms(self, top_n=10):
+        """
+        Returns the words most characteristic of each doc compared to the
+        others, see utils.term_matrix.distinctive_terms.
+
+        Returns
+        -------
+        dict
+            A dict of structure doc_name: [[term, score]], best first.
+        """
+        return self.result_cache.get_or_compute(
+            result_cache_key("distinctive_terms", self.version, top_n),
+            lambda: {
+                party: [[term, score] for term, score in terms]
+                for party, terms in distinctive_terms(
+                    self.term_matrix, top_n=top_n
+                ).items()
+            },
+        )
+
+    def similar_passages(self, text, top_k=5):
+        """
+        Finds the passages of each doc closest in meaning to text, which
+        need not contain any of its words, see
+        utils.semantic_index.similar_passages.
+
+        Returns
+        -------
+        dict
+            A dict of structure doc_name: [snippet], best first; each
+            snippet with keys line_number (the center line), line_start,
+            line_end (exclusive), score, text and markdown.
+        """
+        with span("search", "Reader.similar_passages"):
+            return self.result_cache.get_or_compute(
+                result_cache_key(
+                    "similar_passages", self.version, normalize_phrase(text), top_k
+                ),
+                lambda: self._similar_passages(text, top_k),
+            )
+
+    def _similar_passages(self, text, top_k):
+        context_lines = self.semantic_index["context_lines"]
+        passages = {}
+        for party, matches in similar_passages(
+            self.semantic_index, text, top_k
+        ).items():
+            asset_content_dict = self.assets[party]
+            passages[party] = []
+            for line_number, score in matches:
+                line_start = max(line_number - context_lines, 0)
+                line_end = min(line_number + context_lines + 1, len(asset_content_dict))
+                snippet = {
+                    "line_number": line_number,
+                    "line_start": line_start,
+                    "line_end": line_end,
+                    "score": score,
+                    "text": "\n".join(
+                        asset_content_dict[number]
+                        for number in range(line_start, line_end)
+                    ),
+                }
+                passages[party].append(render_snippet_markdown(snippet, None))
+        return passages
+
+    def ranked_matches(self, party, search_phrase, across_lines=False):
+        return self.result_cache.get_or_compute(
+            result_cache_key(
+                "ranked_matches",
+                self.version,
+                party,
+                query_key(search_phrase),
+                across_lines,
+            ),
+            lambda: self._ranked_matches(party, search_phrase, across_lines),
+            encode=RankedMatches.to_json,
+            decode=RankedMatches.from_json,
+        )
+
+    def _ranked_matches(self, party, search_phrase, across_lines):
+        match_lines = list(self.search(search_phrase, across_lines)[party])
+        snippets = extract_match_contexts(
+            self.assets[party], match_lines, search_phrase, render_markdown=False
+        )
+        # located once here, so every page of matches has them for free
+        locations = self.locate(
+            party, [match_lines[snippet["match_nrs"][0]] for snippet in snippets]
+        )
+        for snippet, location in zip(snippets, locations):
+            snippet["location"] = location
+        # the IDF of each term comes from the lines of the whole corpus
+        terms = list(query_terms(search_phrase))
+        resolved = self._resolver(False).resolve(terms)
+        return RankedMatches(
+            snippets,
+            search_phrase,
+            document_frequencies={term: len(resolved[term]) for term in terms},
+            line_count=len(self.search_index["line_refs"]),
+        )
+
+    def locate(self, party, line_numbers):
+        """
+        Looks up the page and section of lines of party in the structure
+        index, see utils.doc_structure.locate_lines.
+
+        Returns
+        -------
+        list
+            One dict per line with keys page (1-based page of the PDF) and
+            section (the titles of the enclosing headings, outermost first),
+            or None per line without a structure index.
+        """
+        line_numbers = list(line_numbers)
+        structure = self.structure
+        if structure is None or party not in structure["parties"]:
+            return [None] * len(line_numbers)
+        pages, heading_ids = locate_lines(structure, party, line_numbers)
+        return [
+            {"page": int(page), "section": section_path(structure, heading_id)}
+            for page, heading_id in zip(pages, heading_ids)
+        ]
+
+    def _chapters(self, party, match_lines, level=1):
+        # the heading of level enclosing each match, or None without a
+        # structure index
+        structure = self.structure
+        if structure is None or party not in structure["parties"]:
+            return None
+        _, heading_ids = locate_lines(structure, party, match_lines)
+        return [
+            enclosing_heading(structure, heading_id, level)
+            for heading_id in heading_ids
+        ]
+
+    def section_counts(self, party, search_phrase, across_lines=False, level=1):
+        """
+        Counts the matches of party per section of level (1 for chapters).
+
+        Returns
+        -------
+        list
+            One dict per section with matches, in the order of the doc, with
+            keys section (its title, None before the first heading), page
+            (where it starts) and matches; None without a structure index.
+        """
+        return self.result_cache.get_or_compute(
+            result_cache_key(
+                "section_counts",
+                self.version,
+                party,
+                query_key(search_phrase),
+                across_lines,
+                level,
+            ),
+            lambda: self._section_counts(party, search_phrase, across_lines, level),
+        )
+
+    def _section_counts(self, party, search_phrase, across_lines, level):
+        match_lines = list(self.search(search_phrase, across_lines)[party])
+        chapters = self._chapters(party, match_lines, level)
+        if chapters is None:
+            return None
+        structure = self.structure
+        counts = Counter(chapters)
+        heading_ids = sorted(counts)
+        heading_pages, _ = locate_lines(
+            structure,
+            party,
+            [
+                structure["heading_lines"][heading_id] if heading_id >= 0 else 0
+                for heading_id in heading_ids
+            ],
+        )
+        return [
+            {
+                "section": structure["heading_titles"][heading_id]
+                if heading_id >= 0
+                else None,
+                "page": int(page),
+                "matches": counts[heading_id],
+            }
+            for heading_id, page in zip(heading_ids, heading_pages)
+        ]
+
+    def contexts(
+        self,
+        party,
+        search_phrase,
+        across_lines=False,
+        cursor=None,
+        page_size=DEFAULT_PAGE_SIZE,
+    ):
+        """
+        Returns one page of the ranked match snippets of party.
+
+        Returns
+        -------
+        dict
+            With keys snippets, next_cursor and total (number of snippets).
+        """
+        with span("context", "Reader.contexts"):
+            ranked_matches = self.ranked_matches(party, search_phrase, across_lines)
+            snippets, next_cursor = ranked_matches.page(cursor, page_size)
+        return {
+            "snippets": snippets,
+            "next_cursor": next_cursor,
+            "total": len(ranked_matches),
+        }
+
+    def match_snippets(self, party, search_phrase, match_nrs, across_lines=False):
+        """Returns a dict of structure match_nr: snippet containing the match."""
+        ranked_matches = self.ranked_matches(party, search_phrase, across_lines)
+        return {
+            match_nr: ranked_matches.snippet_for_match(match_nr)
+            for match_nr in match_nrs
+        }
+
+    def match_order(self, party, search_phrase, across_lines=False, sampling="random"):
+        """
+        Returns all match_nrs of party in the order they are sampled for
+        analysis, see utils.sampling.match_order. The order only depends on
+        corpus version, party and search phrase, so all users share the
+        same samples and their cached analyses. Stratified samples spread
+        over the chapters of the program, or over equally long stretches of
+        it without a structure index.
+        """
+        return self.result_cache.get_or_compute(
+            result_cache_key(
+                "match_order",
+                self.version,
+                party,
+                query_key(search_phrase),
+                across_lines,
+                sampling,
+            ),
+            lambda: self._match_order(party, search_phrase, across_lines, sampling),
+        )
+
+    def _match_order(self, party, search_phrase, across_lines, sampling):
+        match_lines = list(self.search(search_phrase, across_lines)[party])
+        return match_order(
+            match_lines,
+            sample_seed(self.version, party, query_key(search_phrase)),
+            sampling,
+            # stratified by chapter where the headings are known
+            sections=self._chapters(party, match_lines)
+            if sampling != "random"
+            else None,
+            line_range=(min(self.assets[party]), max(self.assets[party])),
+        )
+
+    def sample_matches(
+        self,
+        party,
+        search_phrase,
+        sample_size=10,
+        across_lines=False,
+        sampling="random",
+    ):
+        """Returns a deterministic sample of the match_nrs of party."""
+        order = self.match_order(party, search_phrase, across_lines, sampling)
+        return order[:sample_size]
+
+    def analyze(self, party, search_phrase, match_nrs=None, across_lines=False):
+        """
+        Determines topics and entities in the context of the matches of
+        party. With precomputed annotations all matches are covered;
+        otherwise the snippets of match_nrs are analyzed with TextRazor,
+        using the shared analysis cache and quota.
+
+        Returns
+        -------
+        dict
+            With keys topics and entities (lists of records, see
+            analysis_frames), source ("annotations" or "textrazor") and
+            quota_remaining (None with annotations).
+        """
+        with span("analysis", "Reader.analyze"):
+            return self._analyze(party, search_phrase, match_nrs, across_lines)
+
+    def _analyze(self, party, search_phrase, match_nrs, across_lines):
+        annotations = self.annotations
+        if annotations is not None:
+            match_lines = list(self.search(search_phrase, across_lines)[party])
+            analysis = {
+                unit: annotations_for_matches(annotations, party, match_lines, unit)
+                .astype({"label": str, "score": float})
+                .to_dict("records")
+                for unit in ["topics", "entities"]
+            }
+            analysis.update(source="annotations", quota_remaining=None)
+            return analysis
+        snippets = self.match_snippets(party, search_phrase, match_nrs, across_lines)
+        topic_df, entity_df = request_textrazor_batch(
+            {match_nr: snippet["text"] for match_nr, snippet in snippets.items()},
+            self.textrazor_key,
+            cache=self.analysis_cache,
+            client=self.textrazor_client,
+        )
+        return {
+            "topics": topic_df.astype({"label": str}).to_dict("records"),
+            "entities": entity_df.astype({"label": str, "type": str}).to_dict(
+                "records"
+            ),
+            "source": "textrazor",
+            "quota_remaining": self.analysis_cache.quota_remaining(),
+        }
+
+    def analyze_in_background(
+        self,
+        party,
+        search_phrase,
+        across_lines=False,
+        sampling="stratified",
+        batch_size=10,
+        quota_reserve=None,
+        max_requests=BACKGROUND_MAX_REQUESTS,
+    ):
+        """
+        Starts analyzing the matches of party with TextRazor, batch by batch
+        in the order of match_order, while more than quota_reserve requests
+        of today's quota are left and until the job has used max_requests.
+        The quota is shared by all users, so one search must not use it up.
+        A job runs once per process; returns the current analysis_progress,
+        call that again to get the results analyzed so far.
+
+        Parameters
+        ----------
+        quota_reserve : int
+            Defaults to BACKGROUND_QUOTA_RESERVE of the daily limit.
+        max_requests : int
+        """
+        if quota_reserve is None:
+            quota_reserve = int(
+                BACKGROUND_QUOTA_RESERVE * self.analysis_cache.daily_limit
+            )
+        job_key = (party, query_key(search_phrase), across_lines, sampling)
+        if self.annotations is None:
+            with self._lock:
+                job = self._background_jobs.get(job_key)
+                if job is None or (
+                    job["future"].done() and job["future"].exception() is not None
+                ):
+                    if self._background is None:
+                        self._background = ThreadPoolExecutor(
+                            max_workers=2, thread_name_prefix="analysis"
+                        )
+                    job = {"processed": 0}
+                    job["future"] = self._background.submit(
+                        self._analyze_progressively,
+                        job,
+                        party,
+                        search_phrase,
+                        across_lines,
+                        sampling,
+                        batch_size,
+                        quota_reserve,
+                        max_requests,
+                    )
+                    self._background_jobs[job_key] = job
+        return self.analysis_progress(party, search_phrase, across_lines, sampling)
+
+    def _analyze_progressively(
+        self,
+        job,
+        party,
+        search_phrase,
+        across_lines,
+        sampling,
+        batch_size,
+        quota_reserve,
+        max_requests,
+    ):
+        order = self.match_order(party, search_phrase, across_lines, sampling)
+        requests = 0
+        with span("analysis", "Reader.analyze_in_background"):
+            for start in range(0, len(order), batch_size):
+                if (
+                    self.analysis_cache.quota_remaining() <= quota_reserve
+                    or requests + batch_size > max_requests
+                ):
+                    return
+                # cached matches are skipped by the analysis without using
+                # quota; requests of other jobs meanwhile are counted too,
+                # which only stops the job earlier
+                quota_used = self.analysis_cache.quota_used()
+                self._analyze(
+                    party,
+                    search_phrase,
+                    order[start : start + batch_size],
+                    across_lines,
+                )
+                requests += max(self.analysis_cache.quota_used() - quota_used, 0)
+                job["processed"] = min(start + batch_size, len(order))
+
+    def analysis_progress(
+        self,
+        party,
+        search_phrase,
+        across_lines=False,
+        sampling="stratified",
+        batch_size=10,
+    ):
+        """
+        Returns the analysis of the matches of party analyzed so far, from
+        cached results only: the matches the background job has processed,
+        or at least the first batch_size in the order of match_order.
+
+        Returns
+        -------
+        dict
+            Like analyze, plus analyzed (number of matches covered), total
+            (number of matches) and running (whether analyze_in_background
+            is still working on them).
+        """
+        order = self.match_order(party, search_phrase, across_lines, sampling)
+        job = self._background_jobs.get(
+            (party, query_key(search_phrase), across_lines, sampling)
+        )
+        if self.annotations is not None:
+            analysis = self._analyze(party, search_phrase, None, across_lines)
+            analysis.update(analyzed=len(order), total=len(order), running=False)
+            return analysis
+        processed = max(job["processed"] if job else 0, batch_size)
+        snippets = self.match_snippets(
+            party, search_phrase, order[:processed], across_lines
+        )
+        responses = analyze_texts(
+            {match_nr: snippet["text"] for match_nr, snippet in snippets.items()},
+            self.textrazor_key,
+            cache=self.analysis_cache,
+            cache_only=True,
+        )
+        topic_df, entity_df = build_textrazor_batch_frames(
+            {
+                match_nr: response_json
+                for match_nr, (response_json, source) in responses.items()
+                if source == "cache"
+            }
+        )
+        return {
+            "topics": topic_df.astype({"label": str}).to_dict("records"),
+            "entities": entity_df.astype({"label": str, "type": str}).to_dict(
+                "records"
+            ),
+            "source": "textrazor",
+            "quota_remaining": self.analysis_cache.quota_remaining(),
+            "analyzed": sum(source == "cache" for _, source in responses.values()),
+            "total": len(order),
+            "running": job is not None and not job["future"].done(),
+        }
+
+    def stats(self):
+        """
+        Returns the corpus version, the estimated memory usage of its
+        indexes, the result cache statistics, the stage timings of this
+        process and today's TextRazor quota usage.
+        """
+        return {
+            "version": self.version,
+            "memory_usage": self.memory_usage(),
+            "result_cache": self.result_cache.stats(),
+            "timings": metrics.snapshot(),
+            "textrazor_quota": {
+                "used": self.analysis_cache.quota_used(),
+                "remaining": self.analysis_cache.quota_remaining(),
+            },
+        }
+
+
+def analysis_frames(analysis):
+    """
+    Turns the result of Reader.analyze into typed topic and entity
+    DataFrames with categorical labels.
+
+    Returns
+    -------
+    tuple
+        (topic_df, entity_df)
+    """
+    frames = []
+    for unit, columns in [("topics", TOPIC_COLUMNS), ("entities", ENTITY_COLUMNS)]:
+        frame = pd.DataFrame.from_records(analysis[unit])
+        for column in ["match_nr", "label", "score"]:
+            if column not in frame:
+                frame[column] = pd.Series(dtype=columns[column])
+        frames.append(
+            frame.astype(
+                {column: columns[column] for column in frame if column in columns}
+            )
+        )
+    return tuple(frames)
+
+
+def load(**kwargs):
+    """Creates a Reader, see Reader for the arguments."""
+    return Reader(**kwargs)
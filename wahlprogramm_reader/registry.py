@@ -0,0 +1,271 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from utils.corpus_registry import (
+    DEFAULT_CORPORA_DIR,
+    corpus_paths,
+    read_corpus_manifests,
+    select_manifest,
+)
+from utils.instrumentation import span
+from utils.result_cache import create_result_cache
+from wahlprogramm_reader.core import Reader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 1024**3
+
+
+class CorpusRegistry:
+    """
+    The corpora of all elections, one Reader per manifest in corpora_dir
+    (see utils.corpus_registry). A corpus is loaded with its first query,
+    not at startup, and the least recently used corpora are dropped once
+    the indexes of the loaded corpora exceed memory_budget, so adding
+    elections raises neither the startup time nor the resident memory of a
+    worker. All corpora share one result and analysis cache; result cache
+    keys contain the corpus version.
+
+    Parameters
+    ----------
+    corpora_dir : string
+    memory_budget : int
+        Bytes the indexes of the loaded corpora may hold, see
+        Reader.memory_usage, or None for no limit. The corpus queried last
+        is kept, even if it exceeds the budget on its own.
+    default : string
+        The corpus of queries naming none; defaults to the manifest marked
+        as default, else to the latest election.
+    eager : bool
+        Loads all indexes of a corpus when the corpus is loaded by get,
+        instead of each with its first use. Corpora loaded by compare only
+        load the indexes counting needs.
+    assets_dir : string
+        Where the files of corpora whose manifest does not name them are,
+        see utils.corpus_registry.corpus_paths.
+    manifests : dict
+        Defaults to the manifests read from corpora_dir.
+    result_cache, analysis_cache, textrazor_key, textrazor_client
+        Passed to every Reader, see Reader.
+    """
+
+    def __init__(
+        self,
+        corpora_dir=DEFAULT_CORPORA_DIR,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        default=None,
+        eager=False,
+        assets_dir="assets",
+        manifests=None,
+        result_cache=None,
+        analysis_cache=None,
+        textrazor_key=None,
+        textrazor_client=None,
+    ):
+        self.manifests = (
+            read_corpus_manifests(corpora_dir) if manifests is None else manifests
+        )
+        self.default = select_manifest(self.manifests, default)["name"]
+        self.memory_budget = memory_budget
+        self.eager = eager
+        self.assets_dir = assets_dir
+        self.result_cache = result_cache or create_result_cache()
+        self.analysis_cache = analysis_cache
+        self.textrazor_key = textrazor_key
+        self.textrazor_client = textrazor_client
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # least recently used first
+        self._readers = OrderedDict()
+        self._loads = 0
+        self._evictions = 0
+
+    @classmethod
+    def from_reader(cls, reader, name="default", title=None):
+        """A registry of the single, already loaded corpus of reader."""
+        registry = cls(
+            manifests={
+                name: {"name": name, "title": title or name, "docs": {}},
+            },
+            memory_budget=None,
+            result_cache=reader.result_cache,
+        )
+        registry._readers[name] = reader
+        return registry
+
+    @property
+    def names(self):
+        return list(self.manifests)
+
+    def manifest(self, name=None):
+        return select_manifest(self.manifests, name)
+
+    def corpora(self):
+        """
+        Returns
+        -------
+        list
+            One dict per corpus, oldest election first, with keys name,
+            title, date, parties, default and loaded.
+        """
+        with self._lock:
+            loaded = set(self._readers)
+        return [
+            {
+                "name": name,
+                "title": manifest["title"],
+                "date": manifest.get("date"),
+                "parties": list(manifest.get("docs", {})),
+                "default": name == self.default,
+                "loaded": name in loaded,
+            }
+            for name, manifest in self.manifests.items()
+        ]
+
+    def _load(self, manifest, warm_up):
+        paths = corpus_paths(manifest, self.assets_dir)
+        reader = Reader(
+            corpus_path=paths["corpus"],
+            json_path=paths["json"],
+            search_index_path=paths["search_index"],
+            phrase_index_path=paths["phrase_index"],
+            fuzzy_index_path=paths["fuzzy_index"],
+            term_matrix_path=paths["term_matrix"],
+            semantic_index_path=paths["semantic_index"],
+            structure_path=paths["structure"],
+            annotations_path=paths["annotations"],
+            result_cache=self.result_cache,
+            analysis_cache=self.analysis_cache,
+            textrazor_key=self.textrazor_key,
+            textrazor_client=self.textrazor_client,
+        )
+        return reader.warm_up() if warm_up else reader
+
+    def get(self, name=None, warm_up=None):
+        """
+        Returns the Reader of corpus name (default: the default corpus),
+        loading it on first use. Raises UnknownCorpusError for names without
+        manifest.
+
+        Parameters
+        ----------
+        name : string
+        warm_up : bool
+            Loads all indexes of a corpus loaded now; defaults to eager.
+        """
+        if warm_up is None:
+            warm_up = self.eager
+        name = self.manifest(name)["name"]
+        with self._lock:
+            reader = self._readers.get(name)
+            if reader is not None:
+                self._readers.move_to_end(name)
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        if reader is None:
+            # corpora load one at a time each, without blocking queries of
+            # the corpora already loaded
+            with load_lock:
+                with self._lock:
+                    reader = self._readers.get(name)
+                if reader is None:
+                    with span("load", "CorpusRegistry.get"):
+                        reader = self._load(self.manifests[name], warm_up)
+                    with self._lock:
+                        self._readers[name] = reader
+                        self._loads += 1
+        self._evict(keep=name)
+        return reader
+
+    def for_corpus(self, name=None):
+        """Same as get; HttpReader.for_corpus is its remote counterpart."""
+        return self.get(name)
+
+    def _evict(self, keep):
+        # readers are only dropped, not closed: requests still running on
+        # them keep them (and their mapped files) alive until they finish
+        if self.memory_budget is None:
+            return
+        with self._lock:
+            readers = list(self._readers.items())
+        usage = {name: reader.memory_usage() for name, reader in readers}
+        total = sum(usage.values())
+        evicted = []
+        with self._lock:
+            for name in list(self._readers):
+                if total <= self.memory_budget:
+                    break
+                if name == keep or name not in usage:
+                    continue
+                del self._readers[name]
+                total -= usage[name]
+                evicted.append(name)
+            self._evictions += len(evicted)
+        if evicted:
+            logger.info(
+                "evicted corpora %s, %d bytes of indexes still loaded",
+                ", ".join(evicted),
+                total,
+            )
+
+    def compare(self, search_phrases, corpora=None, across_lines=False):
+        """
+        Counts several phrases or queries in the docs of several corpora,
+        see Reader.match_matrix. The line counts of the docs allow to
+        compare programs of different lengths. Corpora not loaded yet are
+        loaded without warm-up, so only the term matrix and the search (or,
+        across lines, phrase) index are read.
+
+        Parameters
+        ----------
+        search_phrases : list
+        corpora : list
+            Names of the corpora; defaults to all, oldest election first.
+        across_lines : bool
+
+        Returns
+        -------
+        dict
+            A dict of structure corpus name: {"title", "date", "matrix",
+            "line_counts"}, matrix as returned by Reader.match_matrix and
+            line_counts of structure doc_name: number of lines.
+        """
+        search_phrases = list(search_phrases)
+        comparison = {}
+        with span("search", "CorpusRegistry.compare"):
+            for name in corpora or self.names:
+                manifest = self.manifest(name)
+                with self._lock:
+                    loaded = manifest["name"] in self._readers
+                reader = self.get(manifest["name"], warm_up=False)
+                if not loaded:
+                    # evicted first, so comparing does not push the corpora
+                    # in use out of the budget
+                    with self._lock:
+                        if manifest["name"] in self._readers:
+                            self._readers.move_to_end(manifest["name"], last=False)
+                comparison[manifest["name"]] = {
+                    "title": manifest["title"],
+                    "date": manifest.get("date"),
+                    "matrix": reader.match_matrix(search_phrases, across_lines),
+                    "line_counts": {
+                        party: len(reader.assets[party]) for party in reader.parties
+                    },
+                }
+        return comparison
+
+    def stats(self):
+        """
+        Returns the default corpus, the memory budget, the estimated memory
+        usage of each loaded corpus and the number of loads and evictions.
+        """
+        with self._lock:
+            readers = list(self._readers.items())
+            loads, evictions = self._loads, self._evictions
+        return {
+            "default": self.default,
+            "memory_budget": self.memory_budget,
+            "memory_usage": {name: reader.memory_usage() for name, reader in readers},
+            "loads": loads,
+            "evictions": evictions,
+        }
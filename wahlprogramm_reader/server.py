@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from utils.corpus_registry import UnknownCorpusError
+from utils.query import QuerySyntaxError
+from utils.ranking import InvalidCursorError, UnknownMatchError
+from utils.sampling import SAMPLING_MODES
+from wahlprogramm_reader.registry import CorpusRegistry
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_json(payload):
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf8")
+
+
+def _flag(value):
+    return str(value).lower() in ["1", "true", "yes"]
+
+
+def _required(params, name):
+    if params.get(name) in [None, ""]:
+        raise RequestError(400, f"missing parameter {name}")
+    return params[name]
+
+
+def _int(params, name, default, minimum=0):
+    value = params.get(name)
+    if value in [None, ""]:
+        return default
+    if not str(value).isdecimal() or int(value) < minimum:
+        raise RequestError(400, f"parameter {name} must be an integer >= {minimum}")
+    return int(value)
+
+
+def _match_nrs(params):
+    match_nrs = params.get("match_nrs")
+    if match_nrs is None:
+        return None
+    if not isinstance(match_nrs, list) or not all(
+        str(match_nr).isdecimal() for match_nr in match_nrs
+    ):
+        raise RequestError(400, "parameter match_nrs must be a list of integers")
+    return [int(match_nr) for match_nr in match_nrs]
+
+
+def _reader(registry, params):
+    corpus = params.get("corpus") or None
+    try:
+        return registry.get(corpus)
+    except UnknownCorpusError:
+        raise RequestError(404, f"unknown corpus {corpus}")
+
+
+def _party(reader, params):
+    party = _required(params, "party")
+    if party not in reader.parties:
+        raise RequestError(404, f"unknown party {party}")
+    return party
+
+
+def _sampling(params):
+    sampling = params.get("sampling", "random")
+    if sampling not in SAMPLING_MODES:
+        raise RequestError(400, f"unknown sampling mode {sampling}")
+    return sampling
+
+
+def handle_search(reader, params):
+    search_phrase = _required(params, "q")
+    across_lines = _flag(params.get("across_lines"))
+    return {
+        "version": reader.version,
+        "matches": reader.search(search_phrase, across_lines),
+    }
+
+
+def handle_match_matrix(reader, params):
+    queries = params.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise RequestError(400, "missing parameter queries")
+    return reader.match_matrix(
+        [str(query) for query in queries],
+        across_lines=_flag(params.get("across_lines")),
+    )
+
+
+def handle_distinctive_terms(reader, params):
+    return reader.distinctive_terms(top_n=_int(params, "top_n", 10))
+
+
+def handle_similar_passages(reader, params):
+    return reader.similar_passages(
+        _required(params, "q"), top_k=_int(params, "top_k", 5)
+    )
+
+
+def handle_contexts(reader, params):
+    return reader.contexts(
+        _party(reader, params),
+        _required(params, "q"),
+        across_lines=_flag(params.get("across_lines")),
+        cursor=params.get("cursor"),
+        page_size=_int(params, "page_size", 10, minimum=1),
+    )
+
+
+def handle_match_snippets(reader, params):
+    return reader.match_snippets(
+        _party(reader, params),
+        _required(params, "q"),
+        _match_nrs(params) or [],
+        across_lines=_flag(params.get("across_lines")),
+    )
+
+
+def handle_section_counts(reader, params):
+    return reader.section_counts(
+        _party(reader, params),
+        _required(params, "q"),
+        across_lines=_flag(params.get("across_lines")),
+        level=_int(params, "level", 1, minimum=1),
+    )
+
+
+def handle_analyze(reader, params):
+    return reader.analyze(
+        _party(reader, params),
+        _required(params, "q"),
+        match_nrs=_match_nrs(params) or None,
+        across_lines=_flag(params.get("across_lines")),
+    )
+
+
+def handle_sample_matches(reader, params):
+    return reader.sample_matches(
+        _party(reader, params),
+        _required(params, "q"),
+        sample_size=_int(params, "sample_size", 10),
+        across_lines=_flag(params.get("across_lines")),
+        sampling=_sampling(params),
+    )
+
+
+def handle_analyze_in_background(reader, params):
+    return reader.analyze_in_background(
+        _party(reader, params),
+        _required(params, "q"),
+        across_lines=_flag(params.get("across_lines")),
+        sampling=_sampling(params),
+    )
+
+
+def handle_analysis_progress(reader, params):
+    return reader.analysis_progress(
+        _party(reader, params),
+        _required(params, "q"),
+        across_lines=_flag(params.get("across_lines")),
+        sampling=_sampling(params),
+    )
+
+
+def handle_health(reader, params):
+    return {"status": "ok", "version": reader.version, "parties": reader.parties}
+
+
+def handle_corpora(registry, params):
+    return {"default": registry.default, "corpora": registry.corpora()}
+
+
+def handle_compare(registry, params):
+    queries = params.get("queries")
+    if not isinstance(queries, list) or not queries:
+        raise RequestError(400, "missing parameter queries")
+    corpora = params.get("corpora") or None
+    unknown = [name for name in corpora or [] if name not in registry.manifests]
+    if unknown:
+        raise RequestError(404, f"unknown corpus {', '.join(unknown)}")
+    return registry.compare(
+        [str(query) for query in queries],
+        corpora=corpora,
+        across_lines=_flag(params.get("across_lines")),
+    )
+
+
+def handle_stats(registry, params):
+    return dict(_reader(registry, params).stats(), corpora=registry.stats())
+
+
+ROUTES = {
+    ("GET", "/search"): handle_search,
+    ("POST", "/match_matrix"): handle_match_matrix,
+    ("GET", "/distinctive_terms"): handle_distinctive_terms,
+    ("GET", "/similar_passages"): handle_similar_passages,
+    ("GET", "/contexts"): handle_contexts,
+    ("POST", "/match_snippets"): handle_match_snippets,
+    ("GET", "/section_counts"): handle_section_counts,
+    ("POST", "/analyze"): handle_analyze,
+    ("GET", "/sample_matches"): handle_sample_matches,
+    ("POST", "/analyze_in_background"): handle_analyze_in_background,
+    ("GET", "/analysis_progress"): handle_analysis_progress,
+    ("GET", "/health"): handle_health,
+}
+# handlers of the registry rather than of one corpus
+REGISTRY_ROUTES = {
+    ("GET", "/corpora"): handle_corpora,
+    ("POST", "/compare"): handle_compare,
+    ("GET", "/stats"): handle_stats,
+}
+
+
+class ReaderServer:
+    """
+    Minimal asynchronous HTTP/1.1 server with JSON endpoints on top of a
+    CorpusRegistry (or a single Reader). Each corpus and its indexes are
+    loaded once, with the first request for it; requests are parsed on the
+    event loop and the blocking work runs on a thread pool, so many clients
+    can be served concurrently. Connections are kept alive.
+
+    Endpoints
+    ---------
+    All endpoints but /corpora and /compare take an optional parameter
+    corpus, the name of the election; without it, they serve the default
+    corpus.
+
+    GET /search?q=&across_lines=
+    POST /match_matrix {"queries", "across_lines"}
+    GET /distinctive_terms?top_n=
+    GET /similar_passages?q=&top_k=
+    GET /contexts?party=&q=&across_lines=&cursor=&page_size=
+    POST /match_snippets {"party", "q", "match_nrs", "across_lines"}
+    GET /section_counts?party=&q=&across_lines=&level=
+    POST /analyze {"party", "q", "match_nrs", "across_lines"}
+    GET /sample_matches?party=&q=&across_lines=&sample_size=&sampling=
+    POST /analyze_in_background {"party", "q", "across_lines", "sampling"}
+    GET /analysis_progress?party=&q=&across_lines=&sampling=
+    GET /health
+    GET /corpora
+    POST /compare {"queries", "corpora", "across_lines"}
+    GET /stats
+    """
+
+    def __init__(self, registry, max_workers=8):
+        if not isinstance(registry, CorpusRegistry):
+            registry = CorpusRegistry.from_reader(registry)
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _handle(self, handler, params):
+        return handler(_reader(self.registry, params), params)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if not any(path == url.path for _, path in [*ROUTES, *REGISTRY_ROUTES]):
+            raise RequestError(404, f"no endpoint {url.path}")
+        if (method, url.path) in REGISTRY_ROUTES:
+            handler = partial(REGISTRY_ROUTES[method, url.path], self.registry)
+        elif (method, url.path) in ROUTES:
+            handler = partial(self._handle, ROUTES[method, url.path])
+        else:
+            raise RequestError(405, f"{method} not allowed for {url.path}")
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if body:
+            try:
+                params.update(json.loads(body))
+            except (ValueError, TypeError):
+                raise RequestError(400, "body is not a JSON object")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, partial(handler, params))
+        except (QuerySyntaxError, InvalidCursorError) as error:
+            raise RequestError(400, str(error))
+        except UnknownMatchError as error:
+            raise RequestError(400, f"unknown match_nr {error.args[0]}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin1").split(" ", 2)
+                headers = {}
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in [b"\r\n", b"\n", b""]:
+                        break
+                    name, _, value = header_line.decode("latin1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                content_length = int(headers.get("content-length", 0))
+                try:
+                    if content_length > MAX_BODY_SIZE:
+                        raise RequestError(413, "request body too large")
+                    body = await reader.readexactly(content_length)
+                    status, payload = 200, await self.dispatch(method, target, body)
+                except RequestError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception:
+                    logger.exception("request %s %s failed", method, target)
+                    status, payload = 500, {"error": "internal error"}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                response_body = encode_json(payload)
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                        "Content-Type: application/json; charset=utf-8\r\n"
+                        f"Content-Length: {len(response_body)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin1")
+                    + response_body
+                )
+                await writer.drain()
+                if not keep_alive or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(
+            "serving corpora %s on %s:%s", ", ".join(self.registry.names), host, port
+        )
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    from decouple import config
+
+    from utils.corpus_registry import DEFAULT_CORPORA_DIR
+    from utils.result_cache import create_result_cache
+    from wahlprogramm_reader.registry import DEFAULT_MEMORY_BUDGET
+
+    parser = argparse.ArgumentParser(
+        description="Serve search, contexts and analysis as JSON over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--corpora-dir", default=DEFAULT_CORPORA_DIR)
+    parser.add_argument(
+        "--default-corpus",
+        default=None,
+        help="corpus of requests naming none; defaults to the latest election",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET // 1024**2,
+        help="memory the indexes of the loaded corpora may use before the "
+        "least recently used are dropped",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    registry = CorpusRegistry(
+        args.corpora_dir,
+        memory_budget=args.memory_budget_mb * 1024**2,
+        default=args.default_corpus,
+        eager=True,
+        result_cache=create_result_cache(config("RESULT_CACHE_URL", default=None)),
+        textrazor_key=config("TEXTRAZOR", default=None),
+    )
+    # only the default corpus is loaded before the first request
+    registry.get()
+    asyncio.run(
+        ReaderServer(registry, max_workers=args.workers).serve(args.host, args.port)
+    )